@@ -1,4 +1,5 @@
 from rest_framework import serializers
+from friend.serializers import MutualFriendsListSerializer, MutualFriendsMixin
 from .models import AdminUser, EndUser
 
 
@@ -35,7 +36,7 @@ class AdminUserSerializer(serializers.ModelSerializer):
         )
 
 
-class EndUserSerializer(serializers.ModelSerializer):
+class EndUserSerializer(MutualFriendsMixin, serializers.ModelSerializer):
     class Meta:
         model = EndUser
         fields = (
@@ -46,4 +47,6 @@ class EndUserSerializer(serializers.ModelSerializer):
             "location",
             "website",
             "status",
+            "mutual_friends",
         )
+        list_serializer_class = MutualFriendsListSerializer
@@ -2,6 +2,10 @@
 ASGI config for backend project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Production serves it with ``uvicorn backend.asgi:application``. The post
+comment streams and the message WebSockets are only served by this
+application. With the default in-memory channel layer it has to run as a
+single process, see CHANNEL_LAYER.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
@@ -13,4 +17,18 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "backend.settings")
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported once the app registry is ready
+from message.sockets import websocket_routes  # noqa: E402
+
+
+async def application(scope, receive, send):
+    if scope["type"] != "websocket":
+        return await django_application(scope, receive, send)
+
+    socket = websocket_routes.get(scope["path"])
+    if socket is None:
+        await send({"type": "websocket.close"})
+        return
+    return await socket(scope, receive, send)
@@ -39,6 +39,7 @@ INSTALLED_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "django.contrib.postgres",
     "rest_framework",
     "rest_framework_simplejwt",
     "account",
@@ -93,6 +94,17 @@ DATABASES = {
     }
 }
 
+# Use a shared backend (e.g. Redis or Memcached) when running several workers,
+# otherwise cache invalidation does not reach the other processes
+CACHES = {
+    "default": {
+        "BACKEND": config(
+            "CACHE_BACKEND", default="django.core.cache.backends.locmem.LocMemCache"
+        ),
+        "LOCATION": config("CACHE_LOCATION", default=""),
+    }
+}
+
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": [
         "rest_framework_simplejwt.authentication.JWTAuthentication"
@@ -101,6 +113,68 @@ REST_FRAMEWORK = {
     "DEFAULT_PAGINATION_CLASS": "rest_framework.pagination.LimitOffsetPagination",
     "PAGE_SIZE": 10,
 }
+
+# Maximum number of friends-only posts materialized per home timeline
+TIMELINE_MAX_LENGTH = config("TIMELINE_MAX_LENGTH", cast=int, default=1000)
+
+# Seconds a user's friend id set stays cached; it is also invalidated whenever
+# a friendship is created or removed
+FRIEND_IDS_CACHE_TIMEOUT = config("FRIEND_IDS_CACHE_TIMEOUT", cast=int, default=3600)
+
+# Friend suggestions kept per user, and how far back reactions and comments
+# between two users count as recent interactions when ranking them
+FRIEND_SUGGESTIONS_LIMIT = config("FRIEND_SUGGESTIONS_LIMIT", cast=int, default=50)
+FRIEND_SUGGESTIONS_INTERACTION_DAYS = config(
+    "FRIEND_SUGGESTIONS_INTERACTION_DAYS", cast=int, default=30
+)
+
+# In-memory friendship graph: workers map the snapshot file written by the
+# snapshot_friend_graph command (or load from the database when it is unset)
+# and pick up a newer one, or reload, every FRIEND_GRAPH_RELOAD_INTERVAL seconds
+FRIEND_GRAPH_SNAPSHOT = config("FRIEND_GRAPH_SNAPSHOT", default="")
+FRIEND_GRAPH_RELOAD_INTERVAL = config(
+    "FRIEND_GRAPH_RELOAD_INTERVAL", cast=float, default=300
+)
+# Past this age, or this many friendships changed by the worker itself, the
+# graph is rebuilt from the database, so friendships changed by other workers
+# show up even when no newer snapshot was written
+FRIEND_GRAPH_MAX_AGE = config("FRIEND_GRAPH_MAX_AGE", cast=float, default=3600)
+FRIEND_GRAPH_MAX_CHANGES = config("FRIEND_GRAPH_MAX_CHANGES", cast=int, default=10000)
+
+# Channel layer carrying the live events of the post streams and the message
+# sockets. The in-memory layer only reaches listeners of the same process, so
+# the checks refuse it when the server runs more than one worker.
+CHANNEL_LAYER = config("CHANNEL_LAYER", default="core.broadcast.InMemoryChannelLayer")
+
+# Worker processes of the server, read from the same variable as uvicorn and
+# gunicorn
+WEB_CONCURRENCY = config("WEB_CONCURRENCY", cast=int, default=1)
+
+# Trending scores halve every TRENDING_HALF_LIFE_HOURS and only posts from the
+# last TRENDING_WINDOW_DAYS are ranked
+TRENDING_HALF_LIFE_HOURS = config("TRENDING_HALF_LIFE_HOURS", cast=float, default=24)
+TRENDING_WINDOW_DAYS = config("TRENDING_WINDOW_DAYS", cast=int, default=7)
+
+# Write-behind mode for reactions: the Reaction rows are written right away
+# but counter and trending updates are buffered per process and flushed every
+# REACTION_FLUSH_INTERVAL seconds, which bounds how stale reactions_count gets
+REACTION_WRITE_BEHIND = config("REACTION_WRITE_BEHIND", cast=bool, default=False)
+REACTION_FLUSH_INTERVAL = config("REACTION_FLUSH_INTERVAL", cast=float, default=1.0)
+
+# Opening a conversation only moves the reader's cursor. The is_read flags of
+# its messages are settled per conversation by a buffer flushed every
+# READ_RECEIPT_FLUSH_INTERVAL seconds, or within the request when
+# READ_RECEIPT_WRITE_BEHIND is off. A worker that exits loses what it buffered,
+# which the settle_read_receipts command, run periodically, catches up on
+READ_RECEIPT_WRITE_BEHIND = config("READ_RECEIPT_WRITE_BEHIND", cast=bool, default=True)
+READ_RECEIPT_FLUSH_INTERVAL = config(
+    "READ_RECEIPT_FLUSH_INTERVAL", cast=float, default=1.0
+)
+
+# Posts archived for longer than this are moved to the partitioned archive
+# tables by the archive_posts command
+ARCHIVE_AFTER_DAYS = config("ARCHIVE_AFTER_DAYS", cast=int, default=90)
+
 # Only use the email backend for authentication
 AUTHENTICATION_BACKENDS = ["core.custom_auth.EmailBackend"]
 
@@ -23,5 +23,7 @@ urlpatterns = [
     path("api/accounts/", include("account.urls")),
     path("api/posts/", include("post.urls")),
     path("api/friends/", include("friend.urls")),
+    path("api/notifications/", include("notification.urls")),
+    path("api/messages/", include("message.urls")),
     path("api/core/", include("core.urls")),
 ]
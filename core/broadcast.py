@@ -0,0 +1,164 @@
+# core/broadcast.py
+import asyncio
+import functools
+import threading
+from abc import ABC, abstractmethod
+
+from django.conf import settings
+from django.core import checks
+from django.utils.module_loading import import_string
+
+
+class Subscription:
+    """
+    One listener of a channel. Events are queued on the listener's event loop
+    and read with `await subscription.get()`; a listener that falls more than
+    `maxsize` events behind is marked `lagging` and stops receiving, so it can
+    resynchronize from its cursor instead of slowing every publisher down.
+    """
+
+    def __init__(self, hub, channel, maxsize):
+        self.hub = hub
+        self.channel = channel
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self.lagging = False
+
+    def deliver(self, event):
+        # Always runs on the subscriber's own loop
+        if self.lagging:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.lagging = True
+
+    async def get(self, timeout=None):
+        """Next event, or None once `timeout` seconds pass without one"""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self):
+        self.hub.unsubscribe(self)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+
+class BroadcastHub:
+    """
+    In-process publish/subscribe between request handlers.
+
+    Subscribers are async (streaming responses on the ASGI event loop) while
+    publishers are usually sync views running in worker threads, so every
+    event is handed to each subscriber's loop with call_soon_threadsafe. Only
+    listeners connected to this process see an event.
+    """
+
+    def __init__(self, maxsize=100):
+        self.maxsize = maxsize
+        self.lock = threading.Lock()
+        self.channels = {}
+
+    def subscribe(self, channel):
+        """Must be called from the event loop that will read the events"""
+        subscription = Subscription(self, channel, self.maxsize)
+        with self.lock:
+            self.channels.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            listeners = self.channels.get(subscription.channel)
+            if listeners is not None:
+                listeners.discard(subscription)
+                if not listeners:
+                    del self.channels[subscription.channel]
+
+    def publish(self, channel, event):
+        """
+        Send an event to every current listener of a channel, from any thread
+
+        Returns:
+            Number of listeners the event was handed to
+        """
+        with self.lock:
+            listeners = list(self.channels.get(channel, ()))
+        for subscription in listeners:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.deliver, event)
+            except RuntimeError:
+                # The listener's loop is gone
+                self.unsubscribe(subscription)
+        return len(listeners)
+
+
+hub = BroadcastHub()
+
+
+class ChannelLayer(ABC):
+    """
+    Transport between the processes publishing events and the listeners of
+    streams and sockets. `subscribe` returns a Subscription-like object (async
+    `get`, `lagging`, `close`); `publish` is called from sync code, usually in
+    a transaction.on_commit hook, with a JSON serializable message.
+
+    The layer in use is CHANNEL_LAYER; a multi-node deployment plugs in one
+    backed by a shared broker instead of the in-memory default.
+    """
+
+    @abstractmethod
+    async def subscribe(self, channel):
+        """Subscribe to a channel, from the event loop that reads it"""
+
+    @abstractmethod
+    def publish(self, channel, message):
+        """Send a message to the current listeners of a channel"""
+
+
+class InMemoryChannelLayer(ChannelLayer):
+    """
+    The broadcast hub of this process: enough for a single server process,
+    and for tests. Listeners connected to other processes never see the
+    events, which `check_channel_layer` guards against.
+    """
+
+    def __init__(self, hub=hub):
+        self.hub = hub
+
+    async def subscribe(self, channel):
+        return self.hub.subscribe(channel)
+
+    def publish(self, channel, message):
+        return self.hub.publish(channel, message)
+
+
+@functools.cache
+def get_channel_layer():
+    return import_string(settings.CHANNEL_LAYER)()
+
+
+def check_channel_layer(app_configs, **kwargs):
+    """
+    System check refusing the in-memory layer under a server with several
+    worker processes, where a view and a socket of the same conversation
+    would usually live in different processes
+    """
+    layer = import_string(settings.CHANNEL_LAYER)
+    if settings.WEB_CONCURRENCY > 1 and issubclass(layer, InMemoryChannelLayer):
+        return [
+            checks.Error(
+                "The in-memory channel layer only reaches listeners of the "
+                "process that publishes, but WEB_CONCURRENCY is "
+                f"{settings.WEB_CONCURRENCY}.",
+                hint="Run a single worker, or set CHANNEL_LAYER to a layer "
+                "backed by a shared broker.",
+                id="core.E001",
+            )
+        ]
+    return []
@@ -0,0 +1,91 @@
+# core/conditional.py
+import hashlib
+
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags, quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+
+
+class NotModified(Exception):
+    """Raised once a request's If-None-Match matches the current version"""
+
+
+def make_etag(parts, weak=False):
+    digest = hashlib.blake2b(repr(parts).encode("utf-8"), digest_size=16).hexdigest()
+    etag = quote_etag(digest)
+    return f"W/{etag}" if weak else etag
+
+
+def etag_matches(request, etag):
+    header = request.headers.get("If-None-Match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+
+    # If-None-Match always uses the weak comparison
+    opaque = etag.removeprefix("W/")
+    return any(tag.removeprefix("W/") == opaque for tag in parse_etags(header))
+
+
+class ConditionalGetMixin:
+    """
+    ETag / If-None-Match support for viewsets.
+
+    retrieve() asks get_etag_parts() for a cheap version of the object, and
+    paginated lists build a weak ETag from the `etag_fields` of the rows on
+    the page. Both run before any serializer, so a matching If-None-Match is
+    answered with an empty 304 without rendering anything. The viewer is
+    part of every ETag since responses carry per-user fields.
+    """
+
+    etag_fields = None
+
+    def get_etag_parts(self):
+        """Return the version of the object being retrieved, or None to skip"""
+        return None
+
+    def check_etag(self, parts, weak=False):
+        if parts is None or self.request.method not in ("GET", "HEAD"):
+            return
+        self.etag = make_etag((str(self.request.user.pk), parts), weak=weak)
+        if etag_matches(self.request, self.etag):
+            raise NotModified
+
+    def retrieve(self, request, *args, **kwargs):
+        self.check_etag(self.get_etag_parts())
+        return super().retrieve(request, *args, **kwargs)
+
+    def paginate_queryset(self, queryset):
+        page = super().paginate_queryset(queryset)
+        if page is not None and self.etag_fields:
+            self.check_etag(
+                (
+                    self.request.get_full_path(),
+                    self.paginator.get_next_link(),
+                    self.paginator.get_previous_link(),
+                    [
+                        tuple(getattr(obj, field) for field in self.etag_fields)
+                        for obj in page
+                    ],
+                ),
+                weak=True,
+            )
+        return page
+
+    def handle_exception(self, exc):
+        if isinstance(exc, NotModified):
+            return Response(status=status.HTTP_304_NOT_MODIFIED)
+        return super().handle_exception(exc)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        etag = getattr(self, "etag", None)
+        if etag and response.status_code in (
+            status.HTTP_200_OK,
+            status.HTTP_304_NOT_MODIFIED,
+        ):
+            response["ETag"] = etag
+            patch_vary_headers(response, ("Authorization", "Cookie"))
+        return response
@@ -0,0 +1,219 @@
+import json
+from base64 import b64decode, b64encode
+from datetime import datetime
+from uuid import UUID
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, _positive_int
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination keyed on (created_at, id).
+
+    Each page is fetched with a range predicate on the ordering columns rather
+    than an OFFSET, so deep pages cost the same as the first one, and no COUNT
+    query is ever run. The trailing id keeps the order stable when several
+    rows share a timestamp.
+    """
+
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = "limit"
+    max_page_size = 100
+    cursor_query_param = "cursor"
+    ordering = ("-created_at", "-id")
+    invalid_cursor_message = "Invalid cursor"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor_fields = [
+            self._ordering_field(queryset, field.lstrip("-")) for field in self.ordering
+        ]
+
+        position, reverse = self.decode_cursor(request)
+        ordering = self.ordering
+        if reverse:
+            ordering = tuple(self._flip(field) for field in ordering)
+
+        if position is not None:
+            queryset = self._filter(queryset, self._after(ordering, position))
+
+        results = list(queryset.order_by(*ordering)[: self.page_size + 1])
+        has_more = len(results) > self.page_size
+        results = results[: self.page_size]
+
+        if reverse:
+            results.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, position is not None
+
+        self.page = results
+        return results
+
+    def get_page_size(self, request):
+        try:
+            return _positive_int(
+                request.query_params[self.page_size_query_param],
+                strict=True,
+                cutoff=self.max_page_size,
+            )
+        except (KeyError, ValueError):
+            return self.page_size
+
+    def get_ordering(self, request, queryset, view):
+        # Defer to an OrderingFilter on the view when the client asked for
+        # one, always keeping the id as a tie breaker
+        ordering = self.ordering
+        for filter_cls in getattr(view, "filter_backends", []):
+            if hasattr(filter_cls, "get_ordering"):
+                requested = filter_cls().get_ordering(request, queryset, view)
+                if requested:
+                    ordering = (requested[0],)
+                break
+
+        field = ordering[0]
+        if field.lstrip("-") == "id":
+            return (field,)
+        return (field, "-id" if field.startswith("-") else "id")
+
+    def get_paginated_response(self, data):
+        return Response(
+            {
+                "next": self.get_next_link(),
+                "previous": self.get_previous_link(),
+                "results": data,
+            }
+        )
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "required": ["results"],
+            "properties": {
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "previous": {"type": "string", "nullable": True, "format": "uri"},
+                "results": schema,
+            },
+        }
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self._link(self._position(self.page[-1]), reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self._link(self._position(self.page[0]), reverse=True)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None, False
+
+        try:
+            cursor = json.loads(b64decode(encoded.encode("ascii")).decode("utf-8"))
+            position = cursor["p"]
+            reverse = bool(cursor.get("r", False))
+            if not isinstance(position, list) or len(position) != len(self.ordering):
+                raise ValueError
+            # Values the database would reject never reach the query
+            position = [
+                field.to_python(value)
+                for field, value in zip(self.cursor_fields, position)
+            ]
+        except (TypeError, ValueError, KeyError, UnicodeDecodeError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+        return position, reverse
+
+    def encode_cursor(self, position, reverse):
+        cursor = {"p": position}
+        if reverse:
+            cursor["r"] = 1
+        return b64encode(json.dumps(cursor).encode("utf-8")).decode("ascii")
+
+    def _link(self, position, reverse):
+        url = self.request.build_absolute_uri()
+        return replace_query_param(
+            url, self.cursor_query_param, self.encode_cursor(position, reverse)
+        )
+
+    def _position(self, obj):
+        position = []
+        for field in self.ordering:
+            value = getattr(obj, field.lstrip("-"))
+            if isinstance(value, datetime):
+                value = value.isoformat()
+            elif isinstance(value, UUID):
+                value = str(value)
+            position.append(value)
+        return position
+
+    @staticmethod
+    def _ordering_field(queryset, name):
+        # Ordering on an annotation, e.g. the search rank, or a model field
+        if name in queryset.query.annotations:
+            return queryset.query.annotations[name].output_field
+        return queryset.model._meta.get_field(name)
+
+    @staticmethod
+    def _flip(field):
+        return field[1:] if field.startswith("-") else f"-{field}"
+
+    @staticmethod
+    def _after(ordering, position):
+        # Rows strictly after the position in lexicographic order. The leading
+        # column also gets a plain range bound so the planner can start the
+        # index scan at the cursor instead of filtering from the top.
+        lookups = [
+            (field.lstrip("-"), "lt" if field.startswith("-") else "gt")
+            for field in ordering
+        ]
+        first_field, first_lookup = lookups[0]
+        bound = Q(**{f"{first_field}__{first_lookup}e": position[0]})
+
+        after = Q()
+        for index, (field, lookup) in enumerate(lookups):
+            step = Q(**{f"{field}__{lookup}": position[index]})
+            for (previous_field, _), value in zip(lookups[:index], position):
+                step &= Q(**{previous_field: value})
+            after |= step
+
+        return bound & after
+
+    @staticmethod
+    def _filter(queryset, condition):
+        # Combined querysets (e.g. a UNION feed) cannot be filtered once they
+        # are combined, so the predicate is pushed into every branch instead.
+        if not queryset.query.combinator:
+            return queryset.filter(condition)
+
+        queryset = queryset.all()
+        branches = []
+        for query in queryset.query.combined_queries:
+            query = query.clone()
+            query.add_q(condition)
+            branches.append(query)
+        queryset.query.combined_queries = tuple(branches)
+        return queryset
+
+
+class RankedKeysetPagination(KeysetPagination):
+    """
+    Keyset pagination for relevance-ranked results, which must be annotated
+    with a `rank` cast to double precision so cursor values compare exactly.
+    """
+
+    ordering = ("-rank", "-created_at", "-id")
+
+    def get_ordering(self, request, queryset, view):
+        return self.ordering
@@ -0,0 +1,144 @@
+# core/partitions.py
+import re
+from datetime import datetime, timezone as dt_timezone
+
+from django.db import connection, transaction
+
+# Monthly partitions are named <parent>_yYYYYmMM
+PARTITION_SUFFIX = re.compile(r"_y(\d{4})m(\d{2})$")
+
+
+def month_start(value):
+    return datetime(value.year, value.month, 1, tzinfo=dt_timezone.utc)
+
+
+def next_month(start):
+    return month_start(
+        datetime(start.year + start.month // 12, start.month % 12 + 1, 1)
+    )
+
+
+def partition_name(table, start):
+    return f"{table}_y{start.year}m{start.month:02d}"
+
+
+def partitions(table):
+    """
+    Monthly partitions currently attached to a range-partitioned table
+
+    Returns:
+        List of (partition name, month start) pairs, oldest first
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT child.relname
+            FROM pg_inherits
+            JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+            JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+            WHERE parent.relname = %s
+            """,
+            [table],
+        )
+        names = [name for (name,) in cursor.fetchall()]
+
+    monthly = []
+    for name in names:
+        match = PARTITION_SUFFIX.search(name)
+        if match:
+            year, month = map(int, match.groups())
+            monthly.append((name, datetime(year, month, 1, tzinfo=dt_timezone.utc)))
+    return sorted(monthly, key=lambda partition: partition[1])
+
+
+def default_partition(table):
+    """
+    The DEFAULT partition of a range-partitioned table
+
+    Returns:
+        (partition name, partition key column), or None without one
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT partdefid::regclass::text, attname
+            FROM pg_partitioned_table
+            JOIN pg_attribute
+                ON attrelid = partrelid AND attnum = partattrs[0]
+            WHERE partrelid = %s::regclass AND partdefid <> 0
+            """,
+            [table],
+        )
+        return cursor.fetchone()
+
+
+def ensure_partitions(table, dates):
+    """
+    Create the missing monthly partitions of `table` needed to hold rows at
+    the given dates. A month whose partition was detached is left to the
+    DEFAULT partition rather than recreated under the same name. Once the
+    detached table is dropped, the month gets a partition again, and the
+    rows it had in DEFAULT are moved into it, as PostgreSQL refuses a
+    partition whose range DEFAULT still holds rows of.
+
+    Returns:
+        Names of the partitions that were created
+    """
+    quote = connection.ops.quote_name
+    default = default_partition(table)
+    created = []
+    with transaction.atomic(), connection.cursor() as cursor:
+        for start in sorted({month_start(value) for value in dates}):
+            name = partition_name(table, start)
+            cursor.execute("SELECT to_regclass(%s) IS NULL", [name])
+            if not cursor.fetchone()[0]:
+                continue
+
+            bounds = [start, next_month(start)]
+            if default:
+                default_name, key = default
+                cursor.execute(
+                    f"""
+                    CREATE TEMPORARY TABLE partition_rows ON COMMIT DROP AS
+                    WITH moved AS (
+                        DELETE FROM {quote(default_name)}
+                        WHERE {quote(key)} >= %s AND {quote(key)} < %s
+                        RETURNING *
+                    )
+                    SELECT * FROM moved
+                    """,
+                    bounds,
+                )
+            cursor.execute(
+                f"CREATE TABLE {quote(name)} PARTITION OF {quote(table)} "
+                f"FOR VALUES FROM (%s) TO (%s)",
+                bounds,
+            )
+            if default:
+                cursor.execute(
+                    f"INSERT INTO {quote(table)} SELECT * FROM partition_rows"
+                )
+                cursor.execute("DROP TABLE partition_rows")
+            created.append(name)
+    return created
+
+
+def detach_partitions(table, before):
+    """
+    Detach the monthly partitions of `table` that end on or before `before`.
+    They are left in place as ordinary tables, to be dumped, moved to a
+    cheaper tablespace or dropped.
+
+    Returns:
+        Names of the detached partitions
+    """
+    quote = connection.ops.quote_name
+    detached = []
+    with connection.cursor() as cursor:
+        for name, start in partitions(table):
+            if next_month(start) <= before:
+                cursor.execute(
+                    f"ALTER TABLE {quote(table)} DETACH PARTITION {quote(name)}"
+                )
+                detached.append(name)
+    return detached
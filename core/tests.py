@@ -0,0 +1,377 @@
+import json
+import os
+import random
+from pathlib import Path
+
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APITestCase
+
+from account.models import EndUser
+from friend.graph import friend_graph
+from friend.models import FriendEdge, FriendRequest, Friendship
+from friend.services import SuggestionService
+from message.models import Conversation, ConversationMember, Message
+from message.services import InboxService
+from notification.models import Notification
+from post.models import Comment, Post, Reaction
+from post.services import TimelineService, TrendingService
+
+# Plan snapshots live next to this file, one JSON file per endpoint. Run the
+# tests with UPDATE_QUERY_PLANS=1 to rewrite them after an intended change.
+SNAPSHOT_DIR = Path(__file__).resolve().parent / "query_plans"
+UPDATE_SNAPSHOTS = os.environ.get("UPDATE_QUERY_PLANS") == "1"
+
+# Tables estimated at more rows than this must never be read sequentially
+LARGE_TABLE_ROWS = 1000
+
+EXPLAINABLE = ("SELECT", "WITH", "INSERT", "UPDATE", "DELETE")
+
+
+def plan_shape(node):
+    """Node types, relations and indexes of a plan, without costs or row counts"""
+    shape = {"node": node["Node Type"]}
+    for key, name in (("Relation Name", "relation"), ("Index Name", "index")):
+        if key in node:
+            shape[name] = node[key]
+    children = [plan_shape(child) for child in node.get("Plans", [])]
+    if children:
+        shape["children"] = children
+    return shape
+
+
+def seq_scans(node):
+    if node["Node Type"] == "Seq Scan":
+        yield node["Relation Name"]
+    for child in node.get("Plans", []):
+        yield from seq_scans(child)
+
+
+@override_settings(PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"])
+class QueryPlanTests(APITestCase):
+    """
+    Runs the hot endpoints against a seeded dataset and EXPLAINs every
+    statement they issue. A sequential scan on a large table, a statement
+    above the endpoint's cost budget or a plan that differs from its
+    snapshot fails the test.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        rng = random.Random(15)
+
+        users = [
+            EndUser.objects.create_user(
+                email=f"user{i}@example.com", password="password123"
+            )
+            for i in range(200)
+        ]
+        cls.viewer = users[0]
+
+        pairs = {(0, friend) for friend in range(1, 41)}
+        while len(pairs) < 1500:
+            first, second = sorted(rng.sample(range(1, 200), 2))
+            pairs.add((first, second))
+        friendships = Friendship.objects.bulk_create(
+            [
+                Friendship(user1_id=first, user2_id=second)
+                for first, second in (
+                    Friendship.ordered(users[a].pk, users[b].pk) for a, b in pairs
+                )
+            ]
+        )
+        FriendEdge.objects.bulk_create(FriendEdge.for_friendships(friendships))
+        FriendRequest.objects.bulk_create(
+            [
+                FriendRequest(sender=users[a], receiver=users[b])
+                for a, b in {tuple(rng.sample(range(200), 2)) for _ in range(600)}
+                if (min(a, b), max(a, b)) not in pairs
+            ]
+        )
+
+        posts = Post.objects.bulk_create(
+            [
+                Post(
+                    author=rng.choice(users),
+                    content=f"Post {i} about {rng.choice(['cats', 'dogs', 'trains'])}",
+                    is_public=rng.random() < 0.7,
+                    is_archived=rng.random() < 0.05,
+                )
+                for i in range(12000)
+            ]
+        )
+        comments = Comment.objects.bulk_create(
+            [
+                Comment(
+                    post=rng.choice(posts[:3000]),
+                    author=rng.choice(users),
+                    content=f"Comment {i}",
+                )
+                for i in range(6000)
+            ]
+        )
+        Comment.objects.bulk_create(
+            [
+                Comment(
+                    post=parent.post,
+                    parent=parent,
+                    author=rng.choice(users),
+                    content=f"Reply {i}",
+                )
+                for i, parent in enumerate(rng.sample(comments, 2000))
+            ]
+        )
+        post_pairs = {(rng.randrange(200), rng.randrange(3000)) for _ in range(30000)}
+        comment_pairs = {(rng.randrange(200), rng.randrange(6000)) for _ in range(5000)}
+        types = Reaction.ReactionType.values
+        Reaction.objects.bulk_create(
+            [
+                Reaction(user=users[u], post=posts[p], reaction_type=rng.choice(types))
+                for u, p in post_pairs
+            ]
+            + [
+                Reaction(
+                    user=users[u], comment=comments[c], reaction_type=rng.choice(types)
+                )
+                for u, c in comment_pairs
+            ]
+        )
+        Notification.objects.bulk_create(
+            [
+                Notification(
+                    recipient=rng.choice(users),
+                    actor=rng.choice(users),
+                    notification_type=Notification.NotificationType.POST_LIKE,
+                    title="New reaction",
+                    message="Someone reacted to your post",
+                )
+                for _ in range(5000)
+            ]
+        )
+
+        conversations = Conversation.objects.bulk_create(
+            [Conversation(is_group=i % 5 == 0) for i in range(300)]
+        )
+        members = {}
+        memberships = []
+        for index, conversation in enumerate(conversations):
+            chosen = {0} if index < 20 else set()
+            chosen.update(rng.sample(range(1, 200), 4 if conversation.is_group else 1))
+            members[conversation.id] = [users[i] for i in chosen]
+            memberships += [
+                ConversationMember(conversation=conversation, user=users[i])
+                for i in chosen
+            ]
+        ConversationMember.objects.bulk_create(memberships)
+        Message.objects.bulk_create(
+            [
+                Message(
+                    conversation=conversation,
+                    sender=rng.choice(members[conversation.id]),
+                    content=f"Message {i}",
+                )
+                for i, conversation in enumerate(
+                    rng.choice(conversations) for _ in range(6000)
+                )
+            ]
+        )
+
+        with connection.cursor() as cursor:
+            # Spread the history over four months, deterministically
+            cursor.execute("SELECT setseed(0.15)")
+            for table in (
+                "post_post",
+                "post_comment",
+                "post_reaction",
+                "notification_notification",
+                "message_message",
+            ):
+                cursor.execute(
+                    f"UPDATE {table} SET created_at = "
+                    f"now() - random() * interval '120 days'"
+                )
+            # Members have read all but up to a few of the latest messages
+            cursor.execute(f"""
+                UPDATE {ConversationMember._meta.db_table} member
+                SET (last_read_at, last_read_message_id) = (
+                    SELECT created_at, id FROM {Message._meta.db_table} message
+                    WHERE message.conversation_id = member.conversation_id
+                    ORDER BY created_at DESC, id DESC
+                    OFFSET floor(random() * 6)::integer LIMIT 1
+                )
+                """)
+            # Inbox order and previews from the latest message of each
+            cursor.execute(f"""
+                UPDATE {Conversation._meta.db_table} conversation
+                SET last_message_id = latest.id,
+                    last_message_snippet = left(latest.content, 50),
+                    last_activity_at = latest.created_at
+                FROM (
+                    SELECT DISTINCT ON (conversation_id)
+                        conversation_id, id, content, created_at
+                    FROM {Message._meta.db_table}
+                    ORDER BY conversation_id, created_at DESC, id DESC
+                ) latest
+                WHERE latest.conversation_id = conversation.id
+                """)
+            cursor.execute(f"""
+                UPDATE {ConversationMember._meta.db_table} member
+                SET last_activity_at = conversation.last_activity_at
+                FROM {Conversation._meta.db_table} conversation
+                WHERE conversation.id = member.conversation_id
+                """)
+        InboxService.recount([user.pk for user in users])
+        TimelineService.fan_out_posts([post.id for post in posts])
+        TrendingService.refresh()
+        SuggestionService.rebuild()
+        # Loaded up front like a worker that has served requests before
+        friend_graph.reset()
+        friend_graph.get()
+
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+            cursor.execute(
+                "SELECT relname FROM pg_class WHERE relkind = 'r' AND reltuples > %s",
+                [LARGE_TABLE_ROWS],
+            )
+            cls.large_tables = {name for (name,) in cursor.fetchall()}
+
+        cls.post = posts[0]
+        cls.comment = comments[0]
+        cls.friend = users[1]
+        cls.suggested = users[50]
+        cls.conversation = conversations[0]
+
+    def setUp(self):
+        self.client.force_authenticate(user=self.viewer)
+
+    def explain(self, sql):
+        # With sequential scans disabled the planner only falls back to one
+        # when no index can serve the query, whatever the size of the seed
+        with connection.cursor() as cursor:
+            cursor.execute("SET enable_seqscan = off")
+            try:
+                cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}")
+                plan = cursor.fetchone()[0]
+            finally:
+                cursor.execute("RESET enable_seqscan")
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return plan[0]["Plan"]
+
+    def assertPlans(self, name, url, cost_budget):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, response.content)
+
+        shapes = []
+        for query in context.captured_queries:
+            sql = query["sql"]
+            if not sql.lstrip().upper().startswith(EXPLAINABLE):
+                continue
+            plan = self.explain(sql)
+            scanned = sorted(set(seq_scans(plan)) & self.large_tables)
+            self.assertFalse(scanned, f"{name}: sequential scan on {scanned} in\n{sql}")
+            self.assertLessEqual(
+                plan["Total Cost"],
+                cost_budget,
+                f"{name}: plan cost {plan['Total Cost']} over budget in\n{sql}",
+            )
+            shapes.append(plan_shape(plan))
+
+        snapshot = SNAPSHOT_DIR / f"{name}.json"
+        if UPDATE_SNAPSHOTS or not snapshot.exists():
+            SNAPSHOT_DIR.mkdir(exist_ok=True)
+            snapshot.write_text(json.dumps(shapes, indent=2) + "\n")
+        else:
+            self.assertEqual(
+                shapes,
+                json.loads(snapshot.read_text()),
+                f"{name}: query plans changed, review them and rerun with "
+                f"UPDATE_QUERY_PLANS=1 if the change is intended",
+            )
+
+    def test_post_feed(self):
+        self.assertPlans("post_feed", "/api/posts/posts/", 500)
+
+    def test_post_list_by_author(self):
+        self.assertPlans(
+            "post_list_by_author", f"/api/posts/posts/?author={self.friend.id}", 500
+        )
+
+    def test_post_list_ordered(self):
+        self.assertPlans(
+            "post_list_ordered", "/api/posts/posts/?ordering=-updated_at", 500
+        )
+
+    def test_post_list_by_date(self):
+        self.assertPlans(
+            "post_list_by_date", "/api/posts/posts/?ordering=created_at", 500
+        )
+
+    def test_post_detail(self):
+        self.assertPlans("post_detail", f"/api/posts/posts/{self.post.id}/", 500)
+
+    def test_post_comments(self):
+        self.assertPlans(
+            "post_comments", f"/api/posts/posts/{self.post.id}/comments/", 500
+        )
+
+    def test_post_reactions(self):
+        self.assertPlans(
+            "post_reactions",
+            f"/api/posts/posts/{self.post.id}/reactions/?reaction_type=LIKE",
+            500,
+        )
+
+    def test_post_search(self):
+        # Ranking has to score every match, so this one scales with them
+        self.assertPlans("post_search", "/api/posts/posts/search/?q=trains", 3000)
+
+    def test_post_trending(self):
+        self.assertPlans("post_trending", "/api/posts/posts/trending/", 500)
+
+    def test_comment_replies(self):
+        self.assertPlans(
+            "comment_replies", f"/api/posts/comments/{self.comment.id}/replies/", 500
+        )
+
+    def test_friendship_list(self):
+        self.assertPlans("friendship_list", "/api/friends/friendship/", 500)
+
+    def test_friend_suggestions(self):
+        self.assertPlans(
+            "friend_suggestions", "/api/friends/friendship/suggestions/", 500
+        )
+
+    def test_mutual_friends(self):
+        self.assertPlans(
+            "mutual_friends",
+            f"/api/friends/friendship/mutual/?user={self.suggested.id}",
+            500,
+        )
+
+    def test_user_directory(self):
+        self.assertPlans("user_directory", "/api/accounts/end-users/", 500)
+
+    def test_friend_requests(self):
+        self.assertPlans("friend_requests", "/api/friends/requests/", 500)
+
+    def test_notifications(self):
+        self.assertPlans("notifications", "/api/notifications/", 500)
+
+    def test_conversation_inbox(self):
+        self.assertPlans("conversation_inbox", "/api/messages/conversations/", 500)
+
+    def test_conversation_detail(self):
+        self.assertPlans(
+            "conversation_detail",
+            f"/api/messages/conversations/{self.conversation.id}/",
+            500,
+        )
+
+    def test_unread_count(self):
+        self.assertPlans(
+            "unread_count", "/api/messages/conversations/unread_count/", 500
+        )
@@ -0,0 +1,112 @@
+# friends/cache.py
+from bisect import bisect_left
+from uuid import UUID
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+ID_SIZE = 16
+
+
+class FriendIdSet:
+    """
+    Immutable set of user ids, packed as the sorted 16-byte form of each UUID.
+
+    The packed bytes are what gets cached, so a user with a thousand friends
+    costs 16KB in the cache and membership is a binary search.
+    """
+
+    __slots__ = ("packed",)
+
+    def __init__(self, ids=()):
+        self.packed = b"".join(sorted(UUID(str(user_id)).bytes for user_id in ids))
+
+    @classmethod
+    def from_packed(cls, packed):
+        id_set = cls()
+        id_set.packed = packed
+        return id_set
+
+    def __len__(self):
+        return len(self.packed) // ID_SIZE
+
+    def __iter__(self):
+        for offset in range(0, len(self.packed), ID_SIZE):
+            yield UUID(bytes=self.packed[offset : offset + ID_SIZE])
+
+    def __contains__(self, user_id):
+        key = UUID(str(user_id)).bytes
+        view = _PackedView(self.packed)
+        index = bisect_left(view, key)
+        return index < len(view) and view[index] == key
+
+    def __repr__(self):
+        return f"<FriendIdSet of {len(self)} ids>"
+
+
+class _PackedView:
+    # Sequence view of the packed ids for bisect
+    __slots__ = ("packed",)
+
+    def __init__(self, packed):
+        self.packed = packed
+
+    def __len__(self):
+        return len(self.packed) // ID_SIZE
+
+    def __getitem__(self, index):
+        return self.packed[index * ID_SIZE : (index + 1) * ID_SIZE]
+
+
+def friend_ids_cache_key(user_id):
+    return f"friend:ids:{user_id}"
+
+
+def _changed_in_transaction():
+    # Ids of the users whose friendships changed in the open transaction of
+    # this connection. What a rolled back transaction left behind is dropped
+    # as soon as the connection is out of it.
+    connection = transaction.get_connection()
+    changed = getattr(connection, "friend_ids_changed", None)
+    if changed is None or not connection.in_atomic_block:
+        changed = connection.friend_ids_changed = set()
+    return changed
+
+
+def get_cached_friend_ids(user_id):
+    # The cached list of a user changed in this transaction is out of date
+    if str(user_id) in _changed_in_transaction():
+        return None
+    packed = cache.get(friend_ids_cache_key(user_id))
+    if packed is None:
+        return None
+    return FriendIdSet.from_packed(packed)
+
+
+def set_cached_friend_ids(user_id, friend_ids):
+    # A list read inside the transaction that changed it would be visible to
+    # other connections before the change is, and outlive a rollback
+    if str(user_id) in _changed_in_transaction():
+        return
+    cache.set(
+        friend_ids_cache_key(user_id),
+        friend_ids.packed,
+        settings.FRIEND_IDS_CACHE_TIMEOUT,
+    )
+
+
+def invalidate_friend_ids(*user_ids):
+    """
+    Drop the cached friend lists of users whose friendships are about to
+    change. Call it before the change: until the transaction ends, their
+    lists are neither read from nor written to the cache on this connection.
+    """
+    keys = [friend_ids_cache_key(user_id) for user_id in user_ids]
+    cache.delete_many(keys)
+    if transaction.get_connection().in_atomic_block:
+        _changed_in_transaction().update(str(user_id) for user_id in user_ids)
+    # Drop them again once the change is visible to other connections, in
+    # case a concurrent request re-cached the old friend list in between. A
+    # rollback needs nothing more, the old list is still the right one.
+    transaction.on_commit(lambda: cache.delete_many(keys))
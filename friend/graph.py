@@ -0,0 +1,361 @@
+# friends/graph.py
+import mmap
+import os
+import struct
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from uuid import UUID
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from .cache import ID_SIZE
+from .models import FriendEdge
+
+# Snapshot layout: header, the sorted 16-byte user ids, then the offsets
+# (int64, one more than there are users) and neighbors (int32) arrays in
+# native byte order, each section aligned for a zero-copy memoryview cast
+SNAPSHOT_MAGIC = b"FGRAPH01"
+SNAPSHOT_HEADER = struct.Struct("=8sdqq")
+
+ADD, REMOVE = "add", "remove"
+
+
+class _SortedIds:
+    # Sequence view of packed sorted ids for bisect
+    __slots__ = ("packed",)
+
+    def __init__(self, packed):
+        self.packed = packed
+
+    def __len__(self):
+        return len(self.packed) // ID_SIZE
+
+    def __getitem__(self, index):
+        return bytes(self.packed[index * ID_SIZE : (index + 1) * ID_SIZE])
+
+
+class FriendGraph:
+    """
+    The friendship graph in compressed sparse row form.
+
+    Users with friends are numbered by the order of their UUIDs, so a user's
+    number is a binary search over the packed ids and needs no dictionary.
+    The friends of user i are the sorted numbers neighbors[offsets[i]:
+    offsets[i + 1]], and mutual friends are an intersection of two such
+    slices. The arrays are either built in memory or mapped read-only from a
+    snapshot file, which every worker shares through the page cache.
+
+    Friendships made or ended after the build are kept in a small overlay of
+    added and removed edges, together with a log of the changes so they can
+    be replayed on top of a newer snapshot.
+    """
+
+    def __init__(self, ids, offsets, neighbors, built_at, buffer=None):
+        self.ids = ids
+        self.offsets = offsets
+        self.neighbors = neighbors
+        self.built_at = built_at
+        self.size = len(offsets) - 1
+        # Keeps the mapped snapshot open for as long as the views are in use
+        self.buffer = buffer
+
+        self.lock = threading.Lock()
+        self.extra_nodes = {}
+        self.extra_ids = []
+        self.added = {}
+        self.removed = {}
+        self.changes = []
+
+    @classmethod
+    def build(cls, rows, built_at):
+        """
+        Build a graph from (user_id, friend number) rows ordered by user and
+        friend, where the friend number is its rank among all user ids
+        """
+        ids = bytearray()
+        offsets = array("q", [0])
+        neighbors = array("i")
+        previous = None
+        for user_id, friend_node in rows:
+            if user_id != previous:
+                if previous is not None:
+                    offsets.append(len(neighbors))
+                ids += UUID(str(user_id)).bytes
+                previous = user_id
+            neighbors.append(friend_node)
+        if previous is not None:
+            offsets.append(len(neighbors))
+        return cls(bytes(ids), offsets, neighbors, built_at)
+
+    @classmethod
+    def from_database(cls):
+        """Load the graph from FriendEdge in one pass over its unique index"""
+        built_at = time.time()
+        edges = FriendEdge._meta.db_table
+        # Every friend is also a user with edges, so the dense rank of the
+        # friend ids is the number of the friend
+        with transaction.atomic():
+            cursor = connection.chunked_cursor()
+            try:
+                cursor.execute(f"""
+                    SELECT user_id,
+                        dense_rank() OVER (ORDER BY friend_id)::integer - 1
+                    FROM {edges}
+                    ORDER BY user_id, friend_id
+                    """)
+                return cls.build(cursor, built_at)
+            finally:
+                cursor.close()
+
+    @classmethod
+    def open(cls, path):
+        """Map a snapshot written by save()"""
+        with open(path, "rb") as file:
+            buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, built_at, size, edges = SNAPSHOT_HEADER.unpack_from(buffer)
+        if magic != SNAPSHOT_MAGIC:
+            buffer.close()
+            raise ValueError(f"{path} is not a friend graph snapshot")
+
+        view = memoryview(buffer)
+        start = SNAPSHOT_HEADER.size
+        ids = view[start : start + size * ID_SIZE]
+        start += len(ids)
+        offsets = view[start : start + (size + 1) * 8].cast("q")
+        start += len(offsets) * 8
+        neighbors = view[start : start + edges * 4].cast("i")
+        return cls(ids, offsets, neighbors, built_at, buffer)
+
+    def save(self, path):
+        """
+        Write the built arrays to a snapshot file, replacing any previous one
+        atomically. Overlay changes are not part of the snapshot.
+        """
+        temporary = f"{path}.tmp"
+        with open(temporary, "wb") as file:
+            file.write(
+                SNAPSHOT_HEADER.pack(
+                    SNAPSHOT_MAGIC, self.built_at, self.size, len(self.neighbors)
+                )
+            )
+            file.write(self.ids)
+            file.write(self.offsets.tobytes())
+            file.write(self.neighbors.tobytes())
+        os.replace(temporary, path)
+
+    def node(self, user_id, create=False):
+        """The number of a user, or None if they have no friends"""
+        key = UUID(str(user_id)).bytes
+        ids = _SortedIds(self.ids)
+        index = bisect_left(ids, key)
+        if index < len(ids) and ids[index] == key:
+            return index
+        node = self.extra_nodes.get(key)
+        if node is None and create:
+            node = self.size + len(self.extra_ids)
+            self.extra_nodes[key] = node
+            self.extra_ids.append(key)
+        return node
+
+    def user_id(self, node):
+        if node < self.size:
+            return UUID(bytes=bytes(self.ids[node * ID_SIZE : (node + 1) * ID_SIZE]))
+        return UUID(bytes=self.extra_ids[node - self.size])
+
+    def friends(self, node):
+        """Sorted numbers of the friends of a user number"""
+        if node is None:
+            return ()
+        base = ()
+        if node < self.size:
+            base = self.neighbors[self.offsets[node] : self.offsets[node + 1]]
+        if node not in self.added and node not in self.removed:
+            return base
+        with self.lock:
+            current = set(base).difference(self.removed.get(node, ()))
+            current.update(self.added.get(node, ()))
+        return sorted(current)
+
+    def friend_ids(self, user_id):
+        return [self.user_id(node) for node in self.friends(self.node(user_id))]
+
+    def degree(self, user_id):
+        return len(self.friends(self.node(user_id)))
+
+    def are_friends(self, user1_id, user2_id):
+        other = self.node(user2_id)
+        if other is None:
+            return False
+        friends = self.friends(self.node(user1_id))
+        index = bisect_left(friends, other)
+        return index < len(friends) and friends[index] == other
+
+    def mutual_friends(self, user1_id, user2_id):
+        """Ids of the friends two users have in common"""
+        first = self.friends(self.node(user1_id))
+        second = self.friends(self.node(user2_id))
+        if len(first) > len(second):
+            first, second = second, first
+        return [self.user_id(node) for node in sorted(set(first).intersection(second))]
+
+    def mutual_counts(self, user_id, candidate_ids):
+        """Number of mutual friends between a user and each candidate"""
+        mine = set(self.friends(self.node(user_id)))
+        return {
+            candidate_id: len(mine.intersection(self.friends(self.node(candidate_id))))
+            for candidate_id in candidate_ids
+        }
+
+    def friends_among(self, user_id, user_ids):
+        """
+        The given users that are friends of a user, e.g. the friends among
+        the people who reacted to a post
+        """
+        friends = set(self.friends(self.node(user_id)))
+        return [
+            candidate_id
+            for candidate_id in user_ids
+            if self.node(candidate_id) in friends
+        ]
+
+    def distance(self, user1_id, user2_id, max_depth=6):
+        """
+        Degrees of separation between two users, from a bidirectional
+        breadth-first search
+
+        Returns:
+            Number of hops, or None if they are further apart than max_depth
+        """
+        source, target = self.node(user1_id), self.node(user2_id)
+        if source is None or target is None:
+            return 0 if str(user1_id) == str(user2_id) else None
+        if source == target:
+            return 0
+
+        sides = [({source: 0}, [source]), ({target: 0}, [target])]
+        for depth in range(1, max_depth + 1):
+            # Expand one whole level of the smaller frontier
+            sides.sort(key=lambda side: len(side[1]))
+            (seen, frontier), (other_seen, _) = sides
+            if not frontier:
+                return None
+            level = seen[frontier[0]] + 1
+            best = None
+            expanded = []
+            for node in frontier:
+                for friend in self.friends(node):
+                    if friend in other_seen:
+                        hops = level + other_seen[friend]
+                        best = hops if best is None else min(best, hops)
+                    elif friend not in seen:
+                        seen[friend] = level
+                        expanded.append(friend)
+            if best is not None:
+                return best if best <= max_depth else None
+            sides[0] = (seen, expanded)
+        return None
+
+    def apply(self, change, user1_id, user2_id, at=None):
+        """Record a friendship made (ADD) or ended (REMOVE) after the build"""
+        with self.lock:
+            first = self.node(user1_id, create=True)
+            second = self.node(user2_id, create=True)
+            for node, friend in ((first, second), (second, first)):
+                if change == ADD:
+                    self.removed.get(node, set()).discard(friend)
+                    self.added.setdefault(node, set()).add(friend)
+                else:
+                    self.added.get(node, set()).discard(friend)
+                    self.removed.setdefault(node, set()).add(friend)
+            self.changes.append((at or time.time(), change, user1_id, user2_id))
+
+    def replay(self, changes):
+        """Apply the changes of an older graph that this one was built without"""
+        for at, change, user1_id, user2_id in changes:
+            if at >= self.built_at:
+                self.apply(change, user1_id, user2_id, at)
+
+
+class ProcessGraph:
+    """
+    The friend graph of this process, loaded on first use from the snapshot
+    file if there is one and from the database otherwise. It is reloaded
+    every FRIEND_GRAPH_RELOAD_INTERVAL seconds (a snapshot only when a newer
+    file appeared), replaying the friendship changes this process made since
+    the new graph was built.
+
+    Friendships changed by other processes only show up in a newer build, so
+    a graph older than FRIEND_GRAPH_MAX_AGE seconds, or carrying more than
+    FRIEND_GRAPH_MAX_CHANGES changes of its own, is rebuilt from the
+    database even while the snapshot file stays the same.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.graph = None
+        self.checked_at = 0.0
+        self.snapshot_mtime = None
+
+    def get(self):
+        if self.graph is not None and not self._stale():
+            return self.graph
+        with self.lock:
+            if self.graph is None or self._stale():
+                self._reload()
+            return self.graph
+
+    def _stale(self):
+        return (
+            time.monotonic() - self.checked_at >= settings.FRIEND_GRAPH_RELOAD_INTERVAL
+        )
+
+    @staticmethod
+    def _outdated(graph):
+        return (
+            time.time() - graph.built_at >= settings.FRIEND_GRAPH_MAX_AGE
+            or len(graph.changes) > settings.FRIEND_GRAPH_MAX_CHANGES
+        )
+
+    def _snapshot(self):
+        # The graph of the snapshot file, the loaded one while the file is
+        # unchanged, or None without a snapshot
+        path = settings.FRIEND_GRAPH_SNAPSHOT
+        if not path or not os.path.exists(path):
+            return None
+        mtime = os.stat(path).st_mtime
+        if self.graph is not None and mtime == self.snapshot_mtime:
+            return self.graph
+        self.snapshot_mtime = mtime
+        return FriendGraph.open(path)
+
+    def _reload(self):
+        graph = self._snapshot()
+        if graph is None or self._outdated(graph):
+            graph = FriendGraph.from_database()
+        if graph is not self.graph:
+            if self.graph is not None:
+                # Only the changes the new graph was built without carry
+                # over, so the change log starts over on every reload
+                graph.replay(self.graph.changes)
+            self.graph = graph
+        self.checked_at = time.monotonic()
+
+    def friendship_changed(self, user1, user2, change):
+        """Apply a friendship change to the loaded graph once it commits"""
+
+        def apply():
+            if self.graph is not None:
+                self.graph.apply(change, user1.pk, user2.pk)
+
+        transaction.on_commit(apply)
+
+    def reset(self):
+        with self.lock:
+            self.graph = None
+            self.snapshot_mtime = None
+
+
+friend_graph = ProcessGraph()
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from friend.services import SuggestionService
+
+
+class Command(BaseCommand):
+    help = "Recompute the ranked friend suggestions of every user"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="Users recomputed per transaction",
+        )
+
+    def handle(self, *args, **options):
+        written = SuggestionService.rebuild(options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(f"Stored {written} friend suggestion(s)."))
@@ -0,0 +1,35 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from friend.graph import FriendGraph
+
+
+class Command(BaseCommand):
+    help = (
+        "Load the friendship graph from the database and write the snapshot "
+        "file that workers map on startup"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--path",
+            default=settings.FRIEND_GRAPH_SNAPSHOT,
+            help="Snapshot file to write (defaults to FRIEND_GRAPH_SNAPSHOT)",
+        )
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        if not path:
+            raise CommandError("Set FRIEND_GRAPH_SNAPSHOT or pass --path.")
+
+        started = time.monotonic()
+        graph = FriendGraph.from_database()
+        graph.save(path)
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Wrote {graph.size} user(s) and {len(graph.neighbors)} edge(s) "
+                f"to {path} in {time.monotonic() - started:.1f}s."
+            )
+        )
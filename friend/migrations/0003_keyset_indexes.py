@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("account", "0001_initial"),
+        ("friend", "0002_remove_friendrequest_status"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="friendrequest",
+            index=models.Index(
+                fields=["sender", "-created_at", "-id"],
+                name="friend_frie_sender__634861_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="friendrequest",
+            index=models.Index(
+                fields=["receiver", "-created_at", "-id"],
+                name="friend_frie_receive_09abb9_idx",
+            ),
+        ),
+    ]
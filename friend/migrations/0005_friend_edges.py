@@ -0,0 +1,96 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:50
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("account", "0001_initial"),
+        ("friend", "0004_friend_suggestions"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="FriendEdge",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name="friendedge",
+            name="friend",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="+",
+                to="account.enduser",
+            ),
+        ),
+        migrations.AddField(
+            model_name="friendedge",
+            name="friendship",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="edges",
+                to="friend.friendship",
+            ),
+        ),
+        migrations.AddField(
+            model_name="friendedge",
+            name="user",
+            field=models.ForeignKey(
+                db_index=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="friend_edges",
+                to="account.enduser",
+            ),
+        ),
+        migrations.AlterUniqueTogether(
+            name="friendedge",
+            unique_together={("user", "friend")},
+        ),
+        # Store every pair with the lower id first, dropping the second row of
+        # pairs that were stored both ways round, then add both edges of each
+        migrations.RunSQL(
+            sql=[
+                """
+                DELETE FROM friend_friendship friendship
+                WHERE user1_id > user2_id AND EXISTS (
+                    SELECT 1 FROM friend_friendship mirrored
+                    WHERE mirrored.user1_id = friendship.user2_id
+                        AND mirrored.user2_id = friendship.user1_id
+                )
+                """,
+                """
+                UPDATE friend_friendship
+                SET user1_id = user2_id, user2_id = user1_id
+                WHERE user1_id > user2_id
+                """,
+                """
+                INSERT INTO friend_friendedge (friendship_id, user_id, friend_id)
+                SELECT id, user1_id, user2_id FROM friend_friendship
+                UNION ALL
+                SELECT id, user2_id, user1_id FROM friend_friendship
+                """,
+                # Fire the deferred foreign key checks before the ALTER TABLE
+                "SET CONSTRAINTS ALL IMMEDIATE",
+            ],
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+        migrations.AddConstraint(
+            model_name="friendship",
+            constraint=models.CheckConstraint(
+                condition=models.Q(("user1__lt", models.F("user2"))),
+                name="friendship_canonical_order",
+            ),
+        ),
+    ]
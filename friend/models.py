@@ -1,8 +1,17 @@
 # friends/models.py
-from django.db import models
+from uuid import UUID
+
+from django.db import models, transaction
 from core.models import BaseModel
 from account.models import EndUser
-from django.db.models import Q
+from django.db.models import F, Q
+
+from .cache import (
+    FriendIdSet,
+    get_cached_friend_ids,
+    invalidate_friend_ids,
+    set_cached_friend_ids,
+)
 
 
 class FriendRequest(BaseModel):
@@ -16,12 +25,18 @@ class FriendRequest(BaseModel):
 
     class Meta:
         unique_together = ("sender", "receiver")
+        indexes = [
+            models.Index(fields=["sender", "-created_at", "-id"]),
+            models.Index(fields=["receiver", "-created_at", "-id"]),
+        ]
 
     def __str__(self):
         return f"{self.sender.email} → {self.receiver.email}"
 
 
 class Friendship(BaseModel):
+    # One row per pair with user1 holding the lower id. Friendship checks and
+    # friend lists go through FriendEdge, which has both directions.
     user1 = models.ForeignKey(
         EndUser, related_name="friendships1", on_delete=models.CASCADE
     )
@@ -31,27 +46,141 @@ class Friendship(BaseModel):
 
     class Meta:
         unique_together = ("user1", "user2")
+        constraints = [
+            models.CheckConstraint(
+                condition=Q(user1__lt=F("user2")), name="friendship_canonical_order"
+            ),
+        ]
 
     def __str__(self):
         return f"{self.user1.username} ↔ {self.user2.username}"
 
+    @staticmethod
+    def ordered(user1_id, user2_id):
+        """The ids of a pair in the order they are stored in"""
+        user1_id, user2_id = UUID(str(user1_id)), UUID(str(user2_id))
+        return (user1_id, user2_id) if user1_id < user2_id else (user2_id, user1_id)
+
+    @transaction.atomic
+    def save(self, *args, **kwargs):
+        self.user1_id, self.user2_id = self.ordered(self.user1_id, self.user2_id)
+        adding = self._state.adding
+        super().save(*args, **kwargs)
+        if adding:
+            FriendEdge.objects.bulk_create(FriendEdge.for_friendships([self]))
+
+    @classmethod
+    def between(cls, user1, user2):
+        user1_id, user2_id = cls.ordered(user1.pk, user2.pk)
+        return cls.objects.filter(user1_id=user1_id, user2_id=user2_id)
+
+    @classmethod
+    def connect(cls, user1, user2):
+        """
+        Make two users friends, their cached friend lists are invalidated
+
+        Returns:
+            (friendship, created) like get_or_create
+        """
+        user1_id, user2_id = cls.ordered(user1.pk, user2.pk)
+        cls.invalidate_friend_ids(user1, user2)
+        return cls.objects.get_or_create(user1_id=user1_id, user2_id=user2_id)
+
+    @classmethod
+    def disconnect(cls, user1, user2):
+        """
+        End the friendship of two users, its edges go with it and their
+        cached friend lists are invalidated
+
+        Returns:
+            True if they were friends
+        """
+        cls.invalidate_friend_ids(user1, user2)
+        deleted, _ = cls.between(user1, user2).delete()
+        return deleted > 0
+
     @classmethod
     def are_friends(cls, user1, user2):
-        return cls.objects.filter(
-            (Q(user1=user1) & Q(user2=user2)) | (Q(user1=user2) & Q(user2=user1))
-        ).exists()
+        return FriendEdge.objects.filter(user_id=user1.pk, friend_id=user2.pk).exists()
+
+    @classmethod
+    def get_friend_ids(cls, user):
+        """Return the ids of the user's friends as a cached FriendIdSet"""
+        friend_ids = get_cached_friend_ids(user.pk)
+        if friend_ids is not None:
+            return friend_ids
+
+        # An index-only range scan of the user's edges
+        friend_ids = FriendIdSet(
+            FriendEdge.objects.filter(user_id=user.pk).values_list(
+                "friend_id", flat=True
+            )
+        )
+        set_cached_friend_ids(user.pk, friend_ids)
+        return friend_ids
+
+    @classmethod
+    def invalidate_friend_ids(cls, *users):
+        invalidate_friend_ids(*(user.pk for user in users))
 
     @classmethod
     def get_friends(cls, user):
-        # Get all friendships involving the user
-        friendships = cls.objects.filter(Q(user1=user) | Q(user2=user))
-
-        # Extract the friend from each friendship
-        friends = []
-        for friendship in friendships:
-            if friendship.user1 == user:
-                friends.append(friendship.user2)
-            else:
-                friends.append(friendship.user1)
-
-        return friends
+        return list(EndUser.objects.filter(id__in=list(cls.get_friend_ids(user))))
+
+
+class FriendEdge(models.Model):
+    # Both directions of every Friendship, so that checking a friendship is
+    # one probe of the unique (user, friend) index and listing friends is one
+    # range scan of it
+    friendship = models.ForeignKey(
+        Friendship, related_name="edges", on_delete=models.CASCADE
+    )
+    user = models.ForeignKey(
+        EndUser,
+        related_name="friend_edges",
+        on_delete=models.CASCADE,
+        db_index=False,
+    )
+    friend = models.ForeignKey(EndUser, related_name="+", on_delete=models.CASCADE)
+
+    class Meta:
+        unique_together = ("user", "friend")
+
+    def __str__(self):
+        return f"{self.user_id} → {self.friend_id}"
+
+    @classmethod
+    def for_friendships(cls, friendships):
+        """Unsaved edges of both directions of some friendships, for bulk_create"""
+        return [
+            cls(friendship=friendship, user_id=user_id, friend_id=friend_id)
+            for friendship in friendships
+            for user_id, friend_id in (
+                (friendship.user1_id, friendship.user2_id),
+                (friendship.user2_id, friendship.user1_id),
+            )
+        ]
+
+
+class FriendSuggestion(models.Model):
+    # Precomputed "people you may know" candidates of a user, ranked by
+    # SuggestionService and kept in step with friendship changes
+    user = models.ForeignKey(
+        EndUser, related_name="friend_suggestions", on_delete=models.CASCADE
+    )
+    candidate = models.ForeignKey(
+        EndUser, related_name="suggested_to", on_delete=models.CASCADE
+    )
+    mutual_friends = models.PositiveIntegerField(default=0)
+    interactions = models.PositiveIntegerField(default=0)
+    score = models.FloatField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ("user", "candidate")
+        indexes = [
+            models.Index(fields=["user", "-score", "candidate"]),
+        ]
+
+    def __str__(self):
+        return f"{self.candidate_id} for {self.user_id}: {self.score}"
@@ -1,5 +1,7 @@
+from django.db.models import Exists, OuterRef
 from rest_framework import serializers
-from .models import FriendRequest, Friendship
+from .models import FriendEdge, FriendRequest, Friendship
+from .services import MutualFriendService
 from account.models import EndUser
 
 
@@ -9,6 +11,49 @@ class EndUserMinimalSerializer(serializers.ModelSerializer):
         fields = ["id", "username", "first_name", "last_name"]
 
 
+class MutualFriendsListSerializer(serializers.ListSerializer):
+    """
+    Looks up the mutual friends of the viewer with every user on the page in
+    one pass, for serializers that use MutualFriendsMixin
+    """
+
+    def to_representation(self, data):
+        users = list(data.all() if hasattr(data, "all") else data)
+
+        request = self.context.get("request")
+        if request and request.user.is_authenticated:
+            self.context["mutual_friends"] = MutualFriendService.for_users(
+                request.user, [user.pk for user in users]
+            )
+
+        return super().to_representation(users)
+
+
+class MutualFriendsMixin(serializers.Serializer):
+    mutual_friends = serializers.SerializerMethodField()
+
+    def get_mutual_friends(self, obj):
+        # Preloaded for the whole page by MutualFriendsListSerializer
+        mutual_friends = self.context.get("mutual_friends")
+        if mutual_friends is None:
+            request = self.context.get("request")
+            if not request or not request.user.is_authenticated:
+                return None
+            mutual_friends = MutualFriendService.for_users(request.user, [obj.pk])
+
+        count, preview = mutual_friends.get(obj.pk, (0, []))
+        return {
+            "count": count,
+            "preview": EndUserMinimalSerializer(preview, many=True).data,
+        }
+
+
+class SuggestedUserSerializer(MutualFriendsMixin, EndUserMinimalSerializer):
+    class Meta(EndUserMinimalSerializer.Meta):
+        fields = EndUserMinimalSerializer.Meta.fields + ["mutual_friends"]
+        list_serializer_class = MutualFriendsListSerializer
+
+
 class FriendRequestSerializer(serializers.ModelSerializer):
     sender_details = EndUserMinimalSerializer(source="sender", read_only=True)
     receiver_details = EndUserMinimalSerializer(source="receiver", read_only=True)
@@ -33,16 +78,37 @@ class FriendRequestSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError(
                 "You cannot send a friend request to yourself."
             )
+        # A partial update that leaves the receiver alone
+        if receiver is None:
+            return data
+
+        # Pending requests both ways and the friendship in a single query
+        sent, received, friends = (
+            EndUser.objects.filter(pk=receiver.pk)
+            .annotate(
+                sent=Exists(
+                    FriendRequest.objects.filter(sender=sender, receiver=OuterRef("pk"))
+                ),
+                received=Exists(
+                    FriendRequest.objects.filter(sender=OuterRef("pk"), receiver=sender)
+                ),
+                friends=Exists(
+                    FriendEdge.objects.filter(user=sender, friend=OuterRef("pk"))
+                ),
+            )
+            .values_list("sent", "received", "friends")
+            .get()
+        )
 
-        if FriendRequest.objects.filter(sender=sender, receiver=receiver).exists():
+        if sent:
             raise serializers.ValidationError("Friend request already sent.")
 
-        if FriendRequest.objects.filter(sender=receiver, receiver=sender).exists():
+        if received:
             raise serializers.ValidationError(
                 "This user has already sent you a friend request."
             )
 
-        if Friendship.are_friends(sender, receiver):
+        if friends:
             raise serializers.ValidationError("You are already friends with this user.")
 
         return data
@@ -59,7 +125,7 @@ class FriendshipSerializer(serializers.ModelSerializer):
         request = self.context.get("request")
         user = request.user
 
-        if obj.user1 == user:
+        if obj.user1_id == user.pk:
             friend = obj.user2
         else:
             friend = obj.user1
@@ -0,0 +1,283 @@
+# friends/services.py
+from datetime import timedelta
+from uuid import UUID
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from account.models import EndUser
+from post.models import Comment, Post, Reaction
+from .graph import friend_graph
+from .models import FriendEdge, FriendRequest, FriendSuggestion, Friendship
+
+
+class SuggestionService:
+    """
+    Friends-of-friends suggestions, precomputed per user.
+
+    Candidates are the friends of a user's friends and the people they
+    recently interacted with, minus their friends and anyone with a pending
+    request either way. They are ranked by mutual friends plus a fraction of
+    the interactions and stored in FriendSuggestion, so reading them is one
+    index range scan. A batch job computes everything; friendship and
+    request changes only recompute the pairs they affect.
+    """
+
+    INTERACTION_WEIGHT = 0.5
+
+    @staticmethod
+    def _interactions(user_column, candidate_column, restrict):
+        # Reactions and comments of candidates on posts of the users, as
+        # (user_id, candidate_id) rows
+        posts = Post._meta.db_table
+        rows = []
+        for table, actor in (
+            (Reaction._meta.db_table, "user_id"),
+            (Comment._meta.db_table, "author_id"),
+        ):
+            columns = {"author": "post.author_id", "actor": f"activity.{actor}"}
+            rows.append(f"""
+                SELECT {columns[user_column]} AS user_id,
+                    {columns[candidate_column]} AS candidate_id
+                FROM {table} activity
+                JOIN {posts} post ON post.id = activity.post_id
+                WHERE activity.created_at >= %(since)s
+                    AND {columns[user_column]} = ANY(%(users)s)
+                    {restrict.format(candidate=columns[candidate_column])}
+                """)
+        return " UNION ALL ".join(rows)
+
+    @staticmethod
+    def refresh(user_ids, candidate_ids=None):
+        """
+        Recompute the suggestions of some users, or only their rows for the
+        given candidates
+
+        Returns:
+            Number of suggestions written
+        """
+        if not user_ids:
+            return 0
+        restrict = ""
+        if candidate_ids is not None:
+            restrict = "AND {candidate} = ANY(%(candidates)s)"
+        suggestions = FriendSuggestion._meta.db_table
+        requests = FriendRequest._meta.db_table
+        edges = FriendEdge._meta.db_table
+        params = {
+            "users": list(user_ids),
+            "candidates": list(candidate_ids or ()),
+            "since": timezone.now()
+            - timedelta(days=settings.FRIEND_SUGGESTIONS_INTERACTION_DAYS),
+            "weight": SuggestionService.INTERACTION_WEIGHT,
+            "limit": settings.FRIEND_SUGGESTIONS_LIMIT,
+        }
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                WITH mutual AS (
+                    SELECT mine.user_id, theirs.friend_id AS candidate_id,
+                        count(*) AS mutual_friends
+                    FROM {edges} mine
+                    JOIN {edges} theirs ON theirs.user_id = mine.friend_id
+                    WHERE mine.user_id = ANY(%(users)s)
+                        {restrict.format(candidate="theirs.friend_id")}
+                    GROUP BY 1, 2
+                ),
+                interactions AS (
+                    SELECT user_id, candidate_id, count(*) AS interactions
+                    FROM (
+                        {SuggestionService._interactions("author", "actor", restrict)}
+                        UNION ALL
+                        {SuggestionService._interactions("actor", "author", restrict)}
+                    ) interaction
+                    GROUP BY 1, 2
+                ),
+                pairs AS (
+                    SELECT user_id, candidate_id,
+                        coalesce(mutual_friends, 0) AS mutual_friends,
+                        coalesce(interactions, 0) AS interactions,
+                        coalesce(mutual_friends, 0)
+                            + %(weight)s * coalesce(interactions, 0) AS score
+                    FROM mutual FULL JOIN interactions USING (user_id, candidate_id)
+                ),
+                kept AS (
+                    SELECT * FROM (
+                        SELECT pair.*, row_number() OVER (
+                            PARTITION BY pair.user_id
+                            ORDER BY pair.score DESC, pair.candidate_id
+                        ) AS rank
+                        FROM pairs pair
+                        WHERE pair.user_id <> pair.candidate_id
+                            AND NOT EXISTS (
+                                SELECT 1 FROM {edges} edge
+                                WHERE edge.user_id = pair.user_id
+                                    AND edge.friend_id = pair.candidate_id
+                            )
+                            AND NOT EXISTS (
+                                SELECT 1 FROM {requests} request
+                                WHERE (
+                                    request.sender_id = pair.user_id
+                                    AND request.receiver_id = pair.candidate_id
+                                ) OR (
+                                    request.sender_id = pair.candidate_id
+                                    AND request.receiver_id = pair.user_id
+                                )
+                            )
+                    ) ranked
+                    WHERE rank <= %(limit)s
+                ),
+                stale AS (
+                    DELETE FROM {suggestions} suggestion
+                    WHERE suggestion.user_id = ANY(%(users)s)
+                        {restrict.format(candidate="suggestion.candidate_id")}
+                        AND NOT EXISTS (
+                            SELECT 1 FROM kept
+                            WHERE kept.user_id = suggestion.user_id
+                                AND kept.candidate_id = suggestion.candidate_id
+                        )
+                )
+                INSERT INTO {suggestions} (user_id, candidate_id, mutual_friends,
+                    interactions, score, updated_at)
+                SELECT user_id, candidate_id, mutual_friends, interactions, score,
+                    now()
+                FROM kept
+                ON CONFLICT (user_id, candidate_id) DO UPDATE SET
+                    mutual_friends = EXCLUDED.mutual_friends,
+                    interactions = EXCLUDED.interactions,
+                    score = EXCLUDED.score,
+                    updated_at = EXCLUDED.updated_at
+                """,
+                params,
+            )
+            written = cursor.rowcount
+
+            if candidate_ids is not None:
+                # Only part of each list was ranked, trim it back to the limit
+                cursor.execute(
+                    f"""
+                    DELETE FROM {suggestions} WHERE id IN (
+                        SELECT id FROM (
+                            SELECT id, row_number() OVER (
+                                PARTITION BY user_id
+                                ORDER BY score DESC, candidate_id
+                            ) AS rank
+                            FROM {suggestions}
+                            WHERE user_id = ANY(%(users)s)
+                        ) ranked
+                        WHERE rank > %(limit)s
+                    )
+                    """,
+                    params,
+                )
+        return written
+
+    @staticmethod
+    @transaction.atomic
+    def friendship_changed(user1, user2):
+        """
+        Refresh the suggestions affected by two users becoming friends or
+        unfriending: their own pair, and their mutual friend counts with the
+        friends of the other one
+        """
+        for user, other in ((user1, user2), (user2, user1)):
+            audience = [*Friendship.get_friend_ids(other), other.pk]
+            SuggestionService.refresh([user.pk], audience)
+            SuggestionService.refresh(audience, [user.pk])
+
+    @staticmethod
+    @transaction.atomic
+    def request_changed(sender, receiver):
+        """Refresh the pair of a friend request that was sent or withdrawn"""
+        SuggestionService.refresh([sender.pk], [receiver.pk])
+        SuggestionService.refresh([receiver.pk], [sender.pk])
+
+    @staticmethod
+    def rebuild(batch_size=500):
+        """
+        Recompute the suggestions of every user, one batch of users per
+        transaction
+
+        Returns:
+            Number of suggestions written
+        """
+        written = 0
+        user_ids = EndUser.objects.order_by("pk").values_list("pk", flat=True)
+        last = None
+        while True:
+            batch = user_ids.filter(pk__gt=last) if last else user_ids
+            batch = list(batch[:batch_size])
+            if not batch:
+                return written
+            with transaction.atomic():
+                written += SuggestionService.refresh(batch)
+            last = batch[-1]
+
+    @staticmethod
+    def suggestions_for(user, limit=10):
+        return (
+            FriendSuggestion.objects.filter(user=user)
+            .select_related("candidate")
+            .order_by("-score", "candidate_id")[:limit]
+        )
+
+
+class MutualFriendService:
+    """
+    Mutual friends. A page of users gets its counts from a self-join of
+    FriendEdge, where the viewer's edges meet the edges of the other users
+    on the shared friend, each side read from the unique (user, friend)
+    index. The friends two users share are an intersection of their rows in
+    the process's friend graph.
+    """
+
+    PREVIEW = 3
+
+    @staticmethod
+    def for_users(user, user_ids, preview=PREVIEW):
+        """
+        Mutual friend counts and a short preview for a whole page of users, in
+        two queries whatever the page size
+
+        Returns:
+            Dict of user id to (count, preview users), for users that share at
+            least one friend with `user`
+        """
+        user_ids = [other_id for other_id in user_ids if other_id != user.pk]
+        if not user_ids:
+            return {}
+        edges = FriendEdge._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                SELECT user_id, friend_id, total FROM (
+                    SELECT theirs.user_id, mine.friend_id,
+                        count(*) OVER (PARTITION BY theirs.user_id) AS total,
+                        row_number() OVER (
+                            PARTITION BY theirs.user_id ORDER BY mine.friend_id
+                        ) AS position
+                    FROM {edges} mine
+                    JOIN {edges} theirs ON theirs.friend_id = mine.friend_id
+                    WHERE mine.user_id = %(user)s
+                        AND theirs.user_id = ANY(%(users)s)
+                ) mutual
+                WHERE position <= %(preview)s
+                """,
+                {"user": user.pk, "users": user_ids, "preview": preview},
+            )
+            rows = cursor.fetchall()
+
+        friends = EndUser.objects.in_bulk({friend_id for _, friend_id, _ in rows})
+        mutual = {}
+        for other_id, friend_id, total in rows:
+            _, previewed = mutual.setdefault(UUID(str(other_id)), (total, []))
+            previewed.append(friends[UUID(str(friend_id))])
+        return mutual
+
+    @staticmethod
+    def mutual_friends(user, other):
+        """Friends `user` and `other` have in common"""
+        mutual_ids = friend_graph.get().mutual_friends(user.pk, other.pk)
+        return EndUser.objects.filter(pk__in=mutual_ids)
@@ -1,3 +1,319 @@
-from django.test import TestCase
+import os
+import tempfile
 
-# Create your tests here.
+from django.core.cache import cache
+from django.db import transaction
+from django.test import TestCase, override_settings
+from rest_framework.test import APITestCase
+
+from account.models import EndUser
+from post.models import Post, Reaction
+from .cache import FriendIdSet, friend_ids_cache_key
+from .graph import ADD, REMOVE, FriendGraph, ProcessGraph, friend_graph
+from .models import FriendRequest, FriendSuggestion, Friendship
+from .services import MutualFriendService, SuggestionService
+
+
+class SuggestionTests(APITestCase):
+    def setUp(self):
+        self.users = {
+            name: EndUser.objects.create_user(
+                email=f"{name}@example.com", password="password123"
+            )
+            for name in "abcdefg"
+        }
+        for first, second in ("ab", "ac", "bd", "cd", "be", "bf"):
+            Friendship.objects.create(user1=self.users[first], user2=self.users[second])
+        FriendRequest.objects.create(sender=self.users["f"], receiver=self.users["a"])
+        post = Post.objects.create(author=self.users["a"], content="Hello")
+        Reaction.objects.create(
+            user=self.users["g"], post=post, reaction_type=Reaction.ReactionType.LIKE
+        )
+        SuggestionService.rebuild()
+
+    def suggested(self, name):
+        self.client.force_authenticate(user=self.users[name])
+        response = self.client.get("/api/friends/friendship/suggestions/")
+        self.assertEqual(response.status_code, 200)
+        by_id = {str(user.id): name for name, user in self.users.items()}
+        return [by_id[user["id"]] for user in response.data]
+
+    def stored(self):
+        return set(
+            FriendSuggestion.objects.values_list(
+                "user_id", "candidate_id", "mutual_friends", "interactions", "score"
+            )
+        )
+
+    def test_candidates_are_ranked_by_mutual_friends_and_interactions(self):
+        # d shares two friends, e one, g reacted to a's post and f has a
+        # pending request with a
+        self.assertEqual(self.suggested("a"), ["d", "e", "g"])
+        first, *tied = self.suggested("d")
+        self.assertEqual((first, sorted(tied)), ("a", ["e", "f"]))
+
+    def test_incremental_updates_match_a_rebuild(self):
+        self.client.force_authenticate(user=self.users["a"])
+        response = self.client.post(
+            "/api/friends/requests/", {"receiver": self.users["e"].id}
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertNotIn("e", self.suggested("a"))
+
+        self.client.force_authenticate(user=self.users["e"])
+        response = self.client.post(
+            f"/api/friends/requests/{response.data['id']}/accept/"
+        )
+        self.assertEqual(response.status_code, 200)
+
+        self.client.force_authenticate(user=self.users["b"])
+        response = self.client.delete(
+            "/api/friends/friendship/unfriend/", {"friend_id": self.users["d"].id}
+        )
+        self.assertEqual(response.status_code, 200)
+
+        incremental = self.stored()
+        SuggestionService.rebuild()
+        self.assertEqual(incremental, self.stored())
+
+
+class FriendGraphTests(TestCase):
+    def setUp(self):
+        self.users = {
+            name: EndUser.objects.create_user(
+                email=f"{name}@example.com", password="password123"
+            )
+            for name in "abcdefg"
+        }
+        # a - b - d - f, a - c - d, b - e; g has no friends
+        for first, second in ("ab", "ac", "bd", "cd", "be", "df"):
+            Friendship.connect(self.users[first], self.users[second])
+
+    def id(self, name):
+        return self.users[name].id
+
+    def assertQueries(self, graph):
+        self.assertEqual(
+            sorted(graph.mutual_friends(self.id("a"), self.id("d"))),
+            sorted([self.id("b"), self.id("c")]),
+        )
+        self.assertEqual(
+            graph.mutual_counts(self.id("a"), [self.id("d"), self.id("e")]),
+            {self.id("d"): 2, self.id("e"): 1},
+        )
+        self.assertEqual(
+            graph.friends_among(self.id("d"), [self.id(name) for name in "abcg"]),
+            [self.id("b"), self.id("c")],
+        )
+        self.assertEqual(graph.distance(self.id("e"), self.id("f")), 3)
+        self.assertEqual(graph.distance(self.id("a"), self.id("a")), 0)
+        self.assertIsNone(graph.distance(self.id("a"), self.id("g")))
+        self.assertIsNone(graph.distance(self.id("e"), self.id("f"), max_depth=2))
+        self.assertEqual(graph.degree(self.id("g")), 0)
+
+    def test_queries_on_a_built_and_a_mapped_graph(self):
+        graph = FriendGraph.from_database()
+        self.assertEqual(graph.size, 6)
+        self.assertQueries(graph)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "graph.bin")
+            graph.save(path)
+            mapped = FriendGraph.open(path)
+            self.assertEqual(mapped.built_at, graph.built_at)
+            self.assertQueries(mapped)
+
+    def test_changes_are_applied_and_replayed_on_a_newer_graph(self):
+        graph = FriendGraph.from_database()
+        # A snapshot built elsewhere before this process saw the changes
+        newer = FriendGraph.from_database()
+        graph.apply(ADD, self.id("g"), self.id("a"))
+        graph.apply(REMOVE, self.id("b"), self.id("d"))
+
+        self.assertTrue(graph.are_friends(self.id("a"), self.id("g")))
+        self.assertEqual(
+            graph.mutual_friends(self.id("a"), self.id("d")), [self.id("c")]
+        )
+        self.assertEqual(graph.distance(self.id("g"), self.id("f")), 4)
+
+        newer.replay(graph.changes)
+        self.assertTrue(newer.are_friends(self.id("g"), self.id("a")))
+        self.assertFalse(newer.are_friends(self.id("d"), self.id("b")))
+
+    def test_process_graph_reloads_a_newer_snapshot_and_replays_changes(self):
+        process = ProcessGraph()
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "graph.bin")
+            with override_settings(
+                FRIEND_GRAPH_SNAPSHOT=path, FRIEND_GRAPH_RELOAD_INTERVAL=0
+            ):
+                # Loaded from the database while there is no snapshot
+                loaded = process.get()
+                self.assertTrue(loaded.are_friends(self.id("a"), self.id("b")))
+
+                FriendGraph.from_database().save(path)
+                with self.captureOnCommitCallbacks(execute=True):
+                    process.friendship_changed(self.users["g"], self.users["a"], ADD)
+                self.assertTrue(loaded.are_friends(self.id("a"), self.id("g")))
+
+                # The snapshot predates the change, which is replayed on it
+                mapped = process.get()
+                self.assertIsNot(mapped, loaded)
+                self.assertIsNotNone(mapped.buffer)
+                self.assertTrue(mapped.are_friends(self.id("g"), self.id("a")))
+
+                # An unchanged snapshot is not mapped again
+                self.assertIs(process.get(), mapped)
+
+    def test_process_graph_falls_back_to_the_database(self):
+        process = ProcessGraph()
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "graph.bin")
+            FriendGraph.from_database().save(path)
+            with override_settings(
+                FRIEND_GRAPH_SNAPSHOT=path, FRIEND_GRAPH_RELOAD_INTERVAL=0
+            ):
+                mapped = process.get()
+                # Made friends by another worker, which this one never hears of
+                Friendship.connect(self.users["g"], self.users["e"])
+                self.assertIs(process.get(), mapped)
+                self.assertFalse(mapped.are_friends(self.id("g"), self.id("e")))
+
+                with override_settings(FRIEND_GRAPH_MAX_AGE=0):
+                    rebuilt = process.get()
+                self.assertIsNone(rebuilt.buffer)
+                self.assertTrue(rebuilt.are_friends(self.id("g"), self.id("e")))
+
+                # Its own changes outgrowing the limit rebuild it too, and
+                # the change log starts over
+                with override_settings(FRIEND_GRAPH_MAX_CHANGES=1):
+                    for name in "bc":
+                        Friendship.connect(self.users["g"], self.users[name])
+                        with self.captureOnCommitCallbacks(execute=True):
+                            process.friendship_changed(
+                                self.users["g"], self.users[name], ADD
+                            )
+                    self.assertEqual(len(rebuilt.changes), 2)
+                    latest = process.get()
+                self.assertIsNot(latest, rebuilt)
+                self.assertEqual(latest.changes, [])
+                self.assertEqual(latest.degree(self.id("g")), 3)
+
+
+class MutualFriendsTests(APITestCase):
+    def setUp(self):
+        self.users = {
+            name: EndUser.objects.create_user(
+                email=f"{name}@example.com", password="password123"
+            )
+            for name in "abcdefgh"
+        }
+        # a and d share b, c and e; a and f share b; g shares nobody with a
+        for first, second in ("ab", "ac", "ae", "bd", "cd", "ed", "bf", "gh"):
+            Friendship.connect(self.users[first], self.users[second])
+        self.client.force_authenticate(user=self.users["a"])
+        # Loaded again from this test's friendships on first use
+        friend_graph.reset()
+
+    def test_directory_counts_mutual_friends_in_a_fixed_number_of_queries(self):
+        # Count, page, mutual friends of the whole page and their previews
+        with self.assertNumQueries(4):
+            response = self.client.get("/api/accounts/end-users/?limit=8")
+
+        mutual = {
+            user["id"]: user["mutual_friends"] for user in response.data["results"]
+        }
+        d = mutual[str(self.users["d"].id)]
+        self.assertEqual(d["count"], 3)
+        self.assertEqual(len(d["preview"]), MutualFriendService.PREVIEW)
+        self.assertEqual(mutual[str(self.users["f"].id)]["count"], 1)
+        self.assertEqual(mutual[str(self.users["g"].id)], {"count": 0, "preview": []})
+
+    def test_mutual_friends_listing(self):
+        url = f"/api/friends/friendship/mutual/?user={self.users['d'].id}&limit=2"
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["count"], 3)
+        first_page = [user["id"] for user in response.data["results"]]
+
+        response = self.client.get(response.data["next"])
+        listed = first_page + [user["id"] for user in response.data["results"]]
+        self.assertEqual(
+            sorted(listed), sorted(str(self.users[name].id) for name in "bce")
+        )
+
+        response = self.client.get("/api/friends/friendship/mutual/?user=nope")
+        self.assertEqual(response.status_code, 404)
+
+    def test_unfriending_updates_the_loaded_graph(self):
+        url = f"/api/friends/friendship/mutual/?user={self.users['d'].id}"
+        self.assertEqual(self.client.get(url).data["count"], 3)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.delete(
+                "/api/friends/friendship/unfriend/", {"friend_id": self.users["b"].id}
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get(url).data["count"], 2)
+
+
+class FriendRequestTests(APITestCase):
+    def setUp(self):
+        self.sender, self.receiver = [
+            EndUser.objects.create_user(
+                email=f"{name}@example.com", password="password123"
+            )
+            for name in ("sender", "receiver")
+        ]
+        self.client.force_authenticate(user=self.sender)
+
+    def test_requests_are_validated_against_pending_ones(self):
+        response = self.client.post(
+            "/api/friends/requests/", {"receiver": self.receiver.id}
+        )
+        self.assertEqual(response.status_code, 201)
+        url = f"/api/friends/requests/{response.data['id']}/"
+
+        response = self.client.post(
+            "/api/friends/requests/", {"receiver": self.receiver.id}
+        )
+        self.assertEqual(response.status_code, 400)
+
+        # A partial update without a receiver has nothing to check
+        response = self.client.patch(url, {})
+        self.assertEqual(response.status_code, 200)
+
+
+class FriendIdCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.a, self.b = [
+            EndUser.objects.create_user(
+                email=f"{name}@example.com", password="password123"
+            )
+            for name in "ab"
+        ]
+        self.key = friend_ids_cache_key(self.a.pk)
+
+    def test_a_rolled_back_change_leaves_no_stale_list(self):
+        self.assertEqual(len(Friendship.get_friend_ids(self.a)), 0)
+        self.assertIsNotNone(cache.get(self.key))
+
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            Friendship.connect(self.a, self.b)
+            # Read from the database, but not cached for other connections
+            self.assertIn(self.b.pk, Friendship.get_friend_ids(self.a))
+            self.assertIsNone(cache.get(self.key))
+            raise RuntimeError
+
+        self.assertIsNone(cache.get(self.key))
+        self.assertNotIn(self.b.pk, Friendship.get_friend_ids(self.a))
+
+    def test_a_committed_change_is_dropped_again_on_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            Friendship.connect(self.a, self.b)
+            # A concurrent request re-caches the list from before the change
+            cache.set(self.key, FriendIdSet().packed)
+        for callback in callbacks:
+            callback()
+        self.assertIsNone(cache.get(self.key))
@@ -3,20 +3,27 @@ from rest_framework import viewsets, status, permissions
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from django.db.models import Q
-from django.shortcuts import get_object_or_404
+from rest_framework.generics import get_object_or_404
+from django.db.transaction import atomic
 
+from .graph import ADD, REMOVE, friend_graph
 from .models import FriendRequest, Friendship
+from .services import MutualFriendService, SuggestionService
 from account.models import EndUser
+from core.pagination import KeysetPagination
+from post.services import TimelineService
 from .serializers import (
     FriendRequestSerializer,
     FriendshipSerializer,
     EndUserMinimalSerializer,
+    SuggestedUserSerializer,
 )
 
 
 class FriendRequestViewSet(viewsets.ModelViewSet):
     serializer_class = FriendRequestSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = KeysetPagination
 
     def get_queryset(self):
         user = self.request.user.enduser
@@ -24,9 +31,19 @@ class FriendRequestViewSet(viewsets.ModelViewSet):
             "-created_at"
         )
 
+    @atomic
     def perform_create(self, serializer):
-        serializer.save(sender=self.request.user.enduser)
+        friend_request = serializer.save(sender=self.request.user.enduser)
+        SuggestionService.request_changed(
+            friend_request.sender, friend_request.receiver
+        )
+
+    @atomic
+    def perform_destroy(self, instance):
+        instance.delete()
+        SuggestionService.request_changed(instance.sender, instance.receiver)
 
+    @atomic
     @action(detail=True, methods=["post"])
     def accept(self, request, pk=None):
         friend_request = self.get_object()
@@ -38,11 +55,20 @@ class FriendRequestViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_403_FORBIDDEN,
             )
 
-        Friendship.objects.get_or_create(
-            user1=friend_request.sender, user2=friend_request.receiver
-        )
+        _, created = Friendship.connect(friend_request.sender, friend_request.receiver)
+        if created:
+            TimelineService.connect_friends(
+                friend_request.sender, friend_request.receiver
+            )
 
         friend_request.delete()
+        if created:
+            SuggestionService.friendship_changed(
+                friend_request.sender, friend_request.receiver
+            )
+            friend_graph.friendship_changed(
+                friend_request.sender, friend_request.receiver, ADD
+            )
 
         return Response(
             {
@@ -74,8 +100,12 @@ class FriendshipViewSet(viewsets.ReadOnlyModelViewSet):
 
     def get_queryset(self):
         user = self.request.user.enduser
-        return Friendship.objects.filter(Q(user1=user) | Q(user2=user))
+        # The user's edges lead to their friendships in one index range scan
+        return Friendship.objects.filter(edges__user=user).select_related(
+            "user1", "user2"
+        )
 
+    @atomic
     @action(detail=False, methods=["delete"])
     def unfriend(self, request):
         friend_id = request.data.get("friend_id")
@@ -87,34 +117,48 @@ class FriendshipViewSet(viewsets.ReadOnlyModelViewSet):
         friend = get_object_or_404(EndUser, id=friend_id)
         user = request.user.enduser
 
-        # Find and delete the friendship
-        friendship = Friendship.objects.filter(
-            (Q(user1=user) & Q(user2=friend)) | (Q(user1=friend) & Q(user2=user))
-        ).first()
-
-        if not friendship:
+        # Delete the friendship, its edges go with it
+        if not Friendship.disconnect(user, friend):
             return Response(
                 {"detail": "You are not friends with this user."},
                 status=status.HTTP_404_NOT_FOUND,
             )
 
-        friendship.delete()
+        TimelineService.disconnect_friends(user, friend)
+        SuggestionService.friendship_changed(user, friend)
+        friend_graph.friendship_changed(user, friend, REMOVE)
         return Response(
             {"detail": "Unfriended successfully."}, status=status.HTTP_200_OK
         )
 
     @action(detail=False, methods=["get"])
     def suggestions(self, request):
-        user = request.user.enduser
+        # Top 10 precomputed candidates, ranked by mutual friends and
+        # recent interactions
+        suggestions = SuggestionService.suggestions_for(request.user.enduser)
+
+        serializer = SuggestedUserSerializer(
+            [suggestion.candidate for suggestion in suggestions],
+            many=True,
+            context=self.get_serializer_context(),
+        )
+        return Response(serializer.data)
 
-        # Get current friends
-        friends = Friendship.get_friends(user)
-        friend_ids = [friend.id for friend in friends]
+    @action(detail=False, methods=["get"])
+    def mutual(self, request):
+        other_id = request.query_params.get("user")
+        if not other_id:
+            return Response(
+                {"detail": "user is required."}, status=status.HTTP_400_BAD_REQUEST
+            )
+        other = get_object_or_404(EndUser, id=other_id)
 
-        # Get users who are not friends
-        potential_friends = EndUser.objects.exclude(id__in=friend_ids + [user.id])[
-            :10
-        ]  # Limit to 10 suggestions
+        mutual_friends = MutualFriendService.mutual_friends(request.user.enduser, other)
+        paginator = KeysetPagination()
+        paginator.ordering = ("id",)
+        page = paginator.paginate_queryset(mutual_friends, request, self)
 
-        serializer = EndUserMinimalSerializer(potential_friends, many=True)
-        return Response(serializer.data)
+        serializer = EndUserMinimalSerializer(page, many=True)
+        response = paginator.get_paginated_response(serializer.data)
+        response.data["count"] = mutual_friends.count()
+        return response
@@ -1,6 +1,12 @@
 from django.apps import AppConfig
+from django.core import checks
 
 
 class MessageConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "message"
+
+    def ready(self):
+        from core.broadcast import check_channel_layer
+
+        checks.register(check_channel_layer)
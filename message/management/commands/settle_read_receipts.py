@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand
+
+from message.models import Message
+from message.services import ReadService
+
+
+class Command(BaseCommand):
+    help = (
+        "Mark read the messages every other member has read, in each "
+        "conversation that still has unread messages. Run it periodically when "
+        "READ_RECEIPT_WRITE_BEHIND is on: receipts a worker buffered are lost "
+        "if it exits before flushing them."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Number of conversations looked up at a time",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+
+        conversations = settled = 0
+        last_pk = None
+        while True:
+            # Distinct conversations of the partial message_unread_idx index
+            batch = (
+                Message.objects.filter(is_read=False)
+                .order_by("conversation_id")
+                .values_list("conversation_id", flat=True)
+                .distinct()
+            )
+            if last_pk is not None:
+                batch = batch.filter(conversation_id__gt=last_pk)
+            pks = list(batch[:batch_size])
+            if not pks:
+                break
+
+            for pk in pks:
+                settled += ReadService.settle(pk)
+            conversations += len(pks)
+            last_pk = pks[-1]
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Marked {settled} message(s) read in {conversations} conversation(s)."
+            )
+        )
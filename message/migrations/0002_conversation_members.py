@@ -0,0 +1,115 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:13
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("account", "0001_initial"),
+        ("message", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ConversationMember",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("last_read_at", models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="message",
+            index=models.Index(
+                fields=["conversation", "created_at", "id"],
+                name="message_mes_convers_67c761_idx",
+            ),
+        ),
+        migrations.AddField(
+            model_name="conversationmember",
+            name="conversation",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="members",
+                to="message.conversation",
+            ),
+        ),
+        migrations.AddField(
+            model_name="conversationmember",
+            name="last_read_message",
+            field=models.ForeignKey(
+                blank=True,
+                db_constraint=False,
+                null=True,
+                on_delete=django.db.models.deletion.DO_NOTHING,
+                related_name="+",
+                to="message.message",
+            ),
+        ),
+        migrations.AddField(
+            model_name="conversationmember",
+            name="user",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="conversation_memberships",
+                to="account.enduser",
+            ),
+        ),
+        migrations.AlterUniqueTogether(
+            name="conversationmember",
+            unique_together={("conversation", "user")},
+        ),
+        # Every participant becomes a member whose cursor is the latest
+        # message they had read
+        migrations.RunSQL(
+            sql=[
+                """
+                INSERT INTO message_conversationmember
+                    (conversation_id, user_id, last_read_at, last_read_message_id)
+                SELECT participant.conversation_id, participant.enduser_id,
+                    last_read.created_at, last_read.id
+                FROM message_conversation_participants participant
+                LEFT JOIN LATERAL (
+                    SELECT message.created_at, message.id
+                    FROM message_message message
+                    JOIN message_message_read_by read
+                        ON read.message_id = message.id
+                    WHERE message.conversation_id = participant.conversation_id
+                        AND read.enduser_id = participant.enduser_id
+                    ORDER BY message.created_at DESC, message.id DESC
+                    LIMIT 1
+                ) last_read ON true
+                """,
+                "SET CONSTRAINTS ALL IMMEDIATE",
+            ],
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+        # An auto-created many-to-many table cannot be altered into a through
+        # model, so the field is replaced
+        migrations.RemoveField(
+            model_name="conversation",
+            name="participants",
+        ),
+        migrations.AddField(
+            model_name="conversation",
+            name="participants",
+            field=models.ManyToManyField(
+                related_name="conversations",
+                through="message.ConversationMember",
+                to="account.enduser",
+            ),
+        ),
+        migrations.RemoveField(
+            model_name="message",
+            name="read_by",
+        ),
+    ]
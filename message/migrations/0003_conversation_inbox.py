@@ -0,0 +1,96 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:20
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("account", "0001_initial"),
+        ("message", "0002_conversation_members"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="conversation",
+            name="last_activity_at",
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name="conversation",
+            name="last_message",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="+",
+                to="message.message",
+            ),
+        ),
+        migrations.AddField(
+            model_name="conversation",
+            name="last_message_snippet",
+            field=models.CharField(blank=True, default="", max_length=64),
+        ),
+        migrations.AddField(
+            model_name="conversationmember",
+            name="last_activity_at",
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        # Point every conversation at its latest message, and date it and its
+        # memberships by that message
+        migrations.RunSQL(
+            sql=[
+                """
+                UPDATE message_conversation conversation
+                SET last_message_id = latest.id,
+                    last_message_snippet = CASE
+                        WHEN length(latest.content) > 50
+                        THEN left(latest.content, 50) || '...'
+                        ELSE latest.content
+                    END,
+                    last_activity_at = latest.created_at
+                FROM (
+                    SELECT DISTINCT ON (conversation_id)
+                        conversation_id, id, content, created_at
+                    FROM message_message
+                    ORDER BY conversation_id, created_at DESC, id DESC
+                ) latest
+                WHERE latest.conversation_id = conversation.id
+                """,
+                """
+                UPDATE message_conversation
+                SET last_activity_at = created_at
+                WHERE last_message_id IS NULL
+                """,
+                """
+                UPDATE message_conversationmember member
+                SET last_activity_at = conversation.last_activity_at
+                FROM message_conversation conversation
+                WHERE conversation.id = member.conversation_id
+                """,
+                "SET CONSTRAINTS ALL IMMEDIATE",
+            ],
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+        migrations.AddIndex(
+            model_name="conversationmember",
+            index=models.Index(
+                fields=["user", "-last_activity_at", "-conversation"],
+                name="message_con_user_id_b74900_idx",
+            ),
+        ),
+        # Covered by the index above
+        migrations.AlterField(
+            model_name="conversationmember",
+            name="user",
+            field=models.ForeignKey(
+                db_index=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="conversation_memberships",
+                to="account.enduser",
+            ),
+        ),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:42
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("account", "0001_initial"),
+        ("message", "0003_conversation_inbox"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="UnreadCounter",
+            fields=[
+                (
+                    "user",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="unread_counter",
+                        serialize=False,
+                        to="account.enduser",
+                    ),
+                ),
+                ("count", models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name="conversationmember",
+            name="unread_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        # Count what every member has not read yet, and total it per user
+        migrations.RunSQL(
+            sql=[
+                """
+                UPDATE message_conversationmember member
+                SET unread_count = (
+                    SELECT count(*) FROM message_message message
+                    WHERE message.conversation_id = member.conversation_id
+                        AND message.sender_id <> member.user_id
+                        AND (
+                            member.last_read_at IS NULL
+                            OR (message.created_at, message.id)
+                                > (member.last_read_at, member.last_read_message_id)
+                        )
+                )
+                """,
+                """
+                INSERT INTO message_unreadcounter (user_id, count)
+                SELECT user_id, sum(unread_count)
+                FROM message_conversationmember
+                GROUP BY user_id
+                """,
+            ],
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
@@ -1,16 +1,27 @@
 # messages/models.py
 from django.db import models
+from django.utils import timezone
 from core.models import BaseModel
 from account.models import EndUser
+from core.pagination import KeysetPagination
 from django.db.models import Q
 
 
 class Conversation(BaseModel):
-    participants = models.ManyToManyField(EndUser, related_name="conversations")
+    participants = models.ManyToManyField(
+        EndUser, through="ConversationMember", related_name="conversations"
+    )
     is_group = models.BooleanField(default=False)
     name = models.CharField(
         max_length=255, blank=True, null=True
     )  # For group conversations
+    # Kept by InboxService as messages are sent, so the inbox needs no
+    # lookup of the latest message per conversation
+    last_message = models.ForeignKey(
+        "Message", related_name="+", on_delete=models.SET_NULL, blank=True, null=True
+    )
+    last_message_snippet = models.CharField(max_length=64, blank=True, default="")
+    last_activity_at = models.DateTimeField(default=timezone.now)
 
     def __str__(self):
         if self.is_group and self.name:
@@ -25,8 +36,9 @@ class Conversation(BaseModel):
         return f"Conversation: {participant_names}"
 
     @property
-    def last_message(self):
-        return self.messages.order_by("-created_at").first()
+    def participant_ids(self):
+        # From the participants prefetched for the inbox
+        return sorted(str(user.pk) for user in self.participants.all())
 
     @classmethod
     def get_or_create_direct_conversation(cls, user1, user2):
@@ -56,22 +68,104 @@ class Message(BaseModel):
         EndUser, related_name="sent_messages", on_delete=models.CASCADE
     )
     content = models.TextField()
+    # Set once every participant other than the sender has read it
     is_read = models.BooleanField(default=False)
-    read_by = models.ManyToManyField(EndUser, related_name="read_messages", blank=True)
+
+    # Position of a message in its conversation, which read cursors point at
+    CURSOR_ORDERING = ("created_at", "id")
 
     def __str__(self):
         return f"Message from {self.sender.username} in {self.conversation}"
 
     class Meta:
         ordering = ["created_at"]
+        indexes = [
+            models.Index(fields=["conversation", "created_at", "id"]),
+            # Messages waiting for read receipts, which ReadService.settle
+            # reads without going over the read history
+            models.Index(
+                fields=["conversation", "created_at", "id"],
+                condition=Q(is_read=False),
+                name="message_unread_idx",
+            ),
+        ]
+
+    @property
+    def cursor(self):
+        return (self.created_at, self.id)
+
+
+def read_after(cursor, prefix=""):
+    """
+    Messages after a read cursor, (created_at, id) of the last message read,
+    or all of them when nothing was read yet
+    """
+    if cursor[0] is None:
+        return Q()
+    ordering = tuple(f"{prefix}{field}" for field in Message.CURSOR_ORDERING)
+    return KeysetPagination._after(ordering, list(cursor))
+
+
+class ConversationMember(models.Model):
+    # A participant of a conversation with their read cursor: unread messages
+    # are the index range after it and read receipts come from comparing it
+    # with the position of a message, instead of a row per reader per message
+    conversation = models.ForeignKey(
+        Conversation, related_name="members", on_delete=models.CASCADE
+    )
+    user = models.ForeignKey(
+        EndUser,
+        related_name="conversation_memberships",
+        on_delete=models.CASCADE,
+        db_index=False,
+    )
+    last_read_at = models.DateTimeField(blank=True, null=True)
+    # Messages of others after the cursor, kept by InboxService and
+    # ReadService as messages are sent and read
+    unread_count = models.PositiveIntegerField(default=0)
+    # Copy of the conversation's last_activity_at, so a user's inbox is read in
+    # order from the (user, last_activity_at) index
+    last_activity_at = models.DateTimeField(default=timezone.now)
+    # Not a constraint: deleting the message must not move the cursor
+    last_read_message = models.ForeignKey(
+        Message,
+        related_name="+",
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        blank=True,
+        null=True,
+    )
+
+    class Meta:
+        unique_together = ("conversation", "user")
+        indexes = [models.Index(fields=["user", "-last_activity_at", "-conversation"])]
+
+    def __str__(self):
+        return f"{self.user_id} in {self.conversation_id}"
+
+    @property
+    def cursor(self):
+        return (self.last_read_at, self.last_read_message_id)
+
+    def has_read(self, message):
+        return self.last_read_at is not None and self.cursor >= message.cursor
+
+    def unread_messages(self):
+        return Message.objects.filter(
+            read_after(self.cursor), conversation_id=self.conversation_id
+        ).exclude(sender_id=self.user_id)
 
-    def mark_as_read(self, user):
-        if user != self.sender and user in self.conversation.participants.all():
-            self.read_by.add(user)
-            # If all participants have read the message, mark it as read
-            if (
-                self.read_by.count() == self.conversation.participants.count() - 1
-            ):  # Exclude sender
-                self.is_read = True
-                self.save()
 
+class UnreadCounter(models.Model):
+    # Total unread messages of a user over all their conversations, the sum of
+    # their memberships' unread_count, so the badge is a primary key lookup
+    user = models.OneToOneField(
+        EndUser,
+        related_name="unread_counter",
+        on_delete=models.CASCADE,
+        primary_key=True,
+    )
+    count = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.user_id}: {self.count}"
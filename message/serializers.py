@@ -1,9 +1,22 @@
 # messages/serializers.py
 from rest_framework import serializers
-from .models import Conversation, Message
+from .models import Conversation, ConversationMember, Message
 from account.models import EndUser
 
 
+def conversation_members(context, conversation_id):
+    # Members and their read cursors, loaded once per conversation for all the
+    # messages serialized with the same context
+    members = context.setdefault("conversation_members", {})
+    if conversation_id not in members:
+        members[conversation_id] = list(
+            ConversationMember.objects.filter(
+                conversation_id=conversation_id
+            ).select_related("user")
+        )
+    return members[conversation_id]
+
+
 class ParticipantSerializer(serializers.ModelSerializer):
     class Meta:
         model = EndUser
@@ -13,7 +26,7 @@ class ParticipantSerializer(serializers.ModelSerializer):
 class MessageSerializer(serializers.ModelSerializer):
     sender_details = ParticipantSerializer(source="sender", read_only=True)
     is_sender = serializers.SerializerMethodField()
-    read_by_list = ParticipantSerializer(source="read_by", read_only=True, many=True)
+    read_by_list = serializers.SerializerMethodField()
 
     class Meta:
         model = Message
@@ -36,8 +49,33 @@ class MessageSerializer(serializers.ModelSerializer):
             return obj.sender == request.user
         return False
 
+    def get_read_by_list(self, obj):
+        readers = [
+            member.user
+            for member in conversation_members(self.context, obj.conversation_id)
+            if member.user_id != obj.sender_id and member.has_read(obj)
+        ]
+        return ParticipantSerializer(readers, many=True).data
+
+
+class MessageEventSerializer(MessageSerializer):
+    # Pushed to every participant alike, and nobody has read it yet
+    is_sender = None
+    read_by_list = None
+
+    class Meta(MessageSerializer.Meta):
+        fields = [
+            field
+            for field in MessageSerializer.Meta.fields
+            if field not in ("is_sender", "read_by_list")
+        ]
+
 
 class ConversationSerializer(serializers.ModelSerializer):
+    # Declared because fields through a custom model default to read only
+    participants = serializers.PrimaryKeyRelatedField(
+        many=True, queryset=EndUser.objects.all()
+    )
     participants_details = ParticipantSerializer(
         source="participants", many=True, read_only=True
     )
@@ -53,31 +91,42 @@ class ConversationSerializer(serializers.ModelSerializer):
             "is_group",
             "name",
             "created_at",
+            "last_activity_at",
             "participants_details",
             "last_message_preview",
             "unread_count",
             "display_name",
         ]
-        read_only_fields = ["is_group", "last_message_preview", "unread_count"]
+        read_only_fields = [
+            "is_group",
+            "last_activity_at",
+            "last_message_preview",
+            "unread_count",
+        ]
 
     def get_last_message_preview(self, obj):
         last_message = obj.last_message
         if last_message:
             return {
-                "content": last_message.content[:50]
-                + ("..." if len(last_message.content) > 50 else ""),
+                "content": obj.last_message_snippet,
                 "sender": last_message.sender.username,
                 "created_at": last_message.created_at,
             }
         return None
 
     def get_unread_count(self, obj):
+        # Annotated on the inbox, looked up for a single conversation
+        unread = getattr(obj, "unread", None)
+        if unread is not None:
+            return unread
         request = self.context.get("request")
         if request and request.user.is_authenticated:
+            # A requester who is not a member (anymore) has nothing unread
             return (
-                obj.messages.exclude(sender=request.user)
-                .exclude(read_by=request.user)
-                .count()
+                obj.members.filter(user_id=request.user.pk)
+                .values_list("unread_count", flat=True)
+                .first()
+                or 0
             )
         return 0
 
@@ -89,10 +138,13 @@ class ConversationSerializer(serializers.ModelSerializer):
         if obj.is_group:
             return obj.name or "Group Chat"
 
-        # For direct conversations, show the other participant's name
-        other_participants = obj.participants.exclude(id=request.user.id)
-        if other_participants.exists():
-            other_user = other_participants.first()
+        # For direct conversations, show the other participant's name, from the
+        # participants prefetched for the inbox
+        other_participants = [
+            user for user in obj.participants.all() if user.pk != request.user.pk
+        ]
+        if other_participants:
+            other_user = other_participants[0]
             return (
                 f"{other_user.first_name} {other_user.last_name}"
                 if other_user.first_name
@@ -111,5 +163,5 @@ class ConversationDetailSerializer(ConversationSerializer):
     def get_messages(self, obj):
         # Get the last 20 messages by default
         limit = self.context.get("message_limit", 20)
-        messages = obj.messages.order_by("-created_at")[:limit]
+        messages = obj.messages.select_related("sender").order_by("-created_at")[:limit]
         return MessageSerializer(messages, many=True, context=self.context).data
@@ -0,0 +1,344 @@
+# messages/services.py
+import json
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Case, F, Value, When
+from django.db.models.functions import Greatest
+from rest_framework.utils.encoders import JSONEncoder
+
+from core.broadcast import get_channel_layer
+from core.buffer import DeltaBuffer
+from .models import (
+    Conversation,
+    ConversationMember,
+    Message,
+    UnreadCounter,
+)
+from .serializers import MessageEventSerializer
+
+
+class MessageEventService:
+    """
+    Live events of conversations for the message sockets. Every user has a
+    single channel carrying the events of all their conversations, so a
+    socket subscribes once however many conversations the user is in, and
+    joining or leaving one needs no resubscription.
+    """
+
+    MESSAGE = "message"
+    READ = "read"
+    TYPING = "typing"
+
+    @staticmethod
+    def channel(user_id):
+        return f"user:{user_id}"
+
+    @staticmethod
+    def participant_ids(conversation_id):
+        return list(
+            ConversationMember.objects.filter(
+                conversation_id=conversation_id
+            ).values_list("user_id", flat=True)
+        )
+
+    @staticmethod
+    def publish(user_ids, event, data, on_commit=True):
+        """
+        Send an event to the channels of some users, after the current commit
+        unless `on_commit` is False
+
+        Args:
+            user_ids: Users whose sockets receive the event
+            event: Event type
+            data: JSON serializable payload, encoded once for every listener
+        """
+        message = json.dumps({"type": event, "data": data}, cls=JSONEncoder)
+
+        def send():
+            layer = get_channel_layer()
+            for user_id in user_ids:
+                layer.publish(MessageEventService.channel(user_id), message)
+
+        if on_commit:
+            transaction.on_commit(send)
+        else:
+            send()
+
+    @staticmethod
+    def message_created(message):
+        # The sender's other devices get the message too
+        MessageEventService.publish(
+            MessageEventService.participant_ids(message.conversation_id),
+            MessageEventService.MESSAGE,
+            MessageEventSerializer(message).data,
+        )
+
+    @staticmethod
+    def messages_read(conversation_id, user, message_id):
+        """Read receipt of a user who has read up to a message"""
+        MessageEventService.publish(
+            MessageEventService.participant_ids(conversation_id),
+            MessageEventService.READ,
+            {"conversation": conversation_id, "user": user.pk, "message": message_id},
+        )
+
+    @staticmethod
+    def typing(conversation_id, user):
+        """
+        Tell the other participants of a conversation that a user is typing
+
+        Returns:
+            False if the user is not a participant
+        """
+        user_ids = MessageEventService.participant_ids(conversation_id)
+        if user.pk not in user_ids:
+            return False
+        MessageEventService.publish(
+            [user_id for user_id in user_ids if user_id != user.pk],
+            MessageEventService.TYPING,
+            {"conversation": conversation_id, "user": user.pk},
+            # Nothing was written to wait for
+            on_commit=False,
+        )
+        return True
+
+
+class ReadService:
+    """
+    Read cursors of conversation members. Reading moves the reader's cursor
+    forward with one update, and a message becomes is_read once the cursors
+    of all members other than its sender have passed it, which `settle`
+    works out for a whole conversation at once.
+    """
+
+    @staticmethod
+    @transaction.atomic
+    def mark_read(conversation_id, user, message=None):
+        """
+        Move a member's cursor up to a message, by default the latest one of
+        the conversation, and publish the read receipt
+
+        Returns:
+            The message read up to, or None if the cursor did not move (not a
+            member, no messages or already read)
+        """
+        if message is None:
+            message = (
+                Message.objects.filter(conversation_id=conversation_id)
+                .order_by("-created_at", "-id")
+                .first()
+            )
+            if message is None:
+                return None
+
+        member = (
+            ConversationMember.objects.select_for_update()
+            .filter(conversation_id=conversation_id, user_id=user.pk)
+            .first()
+        )
+        if member is None or member.has_read(message):
+            return None
+        member.last_read_at, member.last_read_message = message.created_at, message
+        # An index range after the new cursor, empty when reading to the end
+        remaining = member.unread_messages().count()
+        ConversationMember.objects.filter(pk=member.pk).update(
+            last_read_at=message.created_at,
+            last_read_message=message,
+            unread_count=remaining,
+        )
+        InboxService.messages_read(user, member.unread_count - remaining)
+
+        # The receipts themselves are set based but grow with the messages
+        # the cursor passed, so they are settled after the response
+        if settings.READ_RECEIPT_WRITE_BEHIND:
+            transaction.on_commit(
+                lambda: read_receipts.add(Conversation, conversation_id, {"reads": 1})
+            )
+        else:
+            ReadService.settle(conversation_id)
+
+        MessageEventService.messages_read(conversation_id, user, message.id)
+        return message
+
+    @staticmethod
+    def settle(conversation_id):
+        """
+        Mark read the messages of a conversation that every member other than
+        their sender has read, in one statement over the unread messages. The
+        two lowest cursors decide it: a message is read once the lowest has
+        passed it, or only the second lowest if the sender holds the lowest.
+
+        Returns:
+            Number of messages marked read
+        """
+        members = ConversationMember._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                WITH cursors AS (
+                    SELECT user_id, last_read_at, last_read_message_id
+                    FROM {members}
+                    WHERE conversation_id = %(conversation)s
+                    ORDER BY last_read_at NULLS FIRST,
+                        last_read_message_id NULLS FIRST
+                    LIMIT 2
+                ),
+                lowest AS (SELECT * FROM cursors LIMIT 1),
+                next AS (SELECT * FROM cursors OFFSET 1)
+                UPDATE {Message._meta.db_table} message
+                SET is_read = true
+                FROM lowest, next
+                WHERE message.conversation_id = %(conversation)s
+                    AND NOT message.is_read
+                    AND (message.created_at, message.id)
+                        <= (next.last_read_at, next.last_read_message_id)
+                    AND (
+                        message.sender_id = lowest.user_id
+                        OR (message.created_at, message.id)
+                            <= (lowest.last_read_at, lowest.last_read_message_id)
+                    )
+                """,
+                {"conversation": conversation_id},
+            )
+            return cursor.rowcount
+
+
+# Conversations whose read receipts wait to be settled when
+# READ_RECEIPT_WRITE_BEHIND is on, every READ_RECEIPT_FLUSH_INTERVAL seconds
+read_receipts = DeltaBuffer(
+    lambda model, pk, deltas: ReadService.settle(pk),
+    lambda: settings.READ_RECEIPT_FLUSH_INTERVAL,
+)
+
+
+class InboxService:
+    """
+    The denormalized inbox: every conversation points at its latest message
+    with a snippet of it, and it and its memberships carry the time of that
+    message, so the inbox is a range of the (user, last_activity_at) index
+    of ConversationMember.
+
+    Unread counts are kept the same way. A membership counts the messages of
+    others after its cursor and UnreadCounter totals them per user: sending
+    adds one for every other member, reading subtracts what the cursor moved
+    past, and removing messages or memberships recounts the users involved.
+    """
+
+    SNIPPET_LENGTH = 50
+
+    @staticmethod
+    def snippet(content):
+        if len(content) > InboxService.SNIPPET_LENGTH:
+            return content[: InboxService.SNIPPET_LENGTH] + "..."
+        return content
+
+    @staticmethod
+    def message_sent(message):
+        # A message committing after a newer one must not move the inbox back
+        Conversation.objects.filter(
+            pk=message.conversation_id, last_activity_at__lte=message.created_at
+        ).update(
+            last_message=message,
+            last_message_snippet=InboxService.snippet(message.content),
+            last_activity_at=message.created_at,
+        )
+        ConversationMember.objects.filter(
+            conversation_id=message.conversation_id
+        ).update(
+            last_activity_at=Greatest("last_activity_at", Value(message.created_at)),
+            unread_count=Case(
+                When(user_id=message.sender_id, then=F("unread_count")),
+                default=F("unread_count") + 1,
+            ),
+        )
+        # In user order, so concurrent sends lock the counters alike
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                INSERT INTO {UnreadCounter._meta.db_table} AS counter
+                    (user_id, count)
+                SELECT user_id, 1 FROM {ConversationMember._meta.db_table}
+                WHERE conversation_id = %s AND user_id <> %s
+                ORDER BY user_id
+                ON CONFLICT (user_id) DO UPDATE SET count = counter.count + 1
+                """,
+                [message.conversation_id, message.sender_id],
+            )
+
+    @staticmethod
+    def messages_read(user, count):
+        if count:
+            UnreadCounter.objects.filter(user_id=user.pk).update(
+                count=Greatest(F("count") - count, 0)
+            )
+
+    @staticmethod
+    def recount(user_ids, conversation_id=None):
+        """
+        Recount the unread messages of some users' memberships from their
+        cursors, only those in one conversation if given, then their totals
+        """
+        if not user_ids:
+            return
+        members = ConversationMember._meta.db_table
+        params = {"users": list(user_ids), "conversation": conversation_id}
+        restrict = ""
+        if conversation_id is not None:
+            restrict = "AND member.conversation_id = %(conversation)s"
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                UPDATE {members} member
+                SET unread_count = (
+                    SELECT count(*) FROM {Message._meta.db_table} message
+                    WHERE message.conversation_id = member.conversation_id
+                        AND message.sender_id <> member.user_id
+                        AND (
+                            member.last_read_at IS NULL
+                            OR (message.created_at, message.id)
+                                > (member.last_read_at, member.last_read_message_id)
+                        )
+                )
+                WHERE member.user_id = ANY(%(users)s) {restrict}
+                """,
+                params,
+            )
+            cursor.execute(
+                f"""
+                INSERT INTO {UnreadCounter._meta.db_table} AS counter
+                    (user_id, count)
+                SELECT users.id, coalesce(sum(member.unread_count), 0)
+                FROM unnest(%(users)s::uuid[]) AS users (id)
+                LEFT JOIN {members} member ON member.user_id = users.id
+                GROUP BY users.id
+                ORDER BY users.id
+                ON CONFLICT (user_id) DO UPDATE SET count = EXCLUDED.count
+                """,
+                params,
+            )
+
+    @staticmethod
+    def unread_total(user):
+        return (
+            UnreadCounter.objects.filter(user_id=user.pk)
+            .values_list("count", flat=True)
+            .first()
+            or 0
+        )
+
+    @staticmethod
+    def refresh(conversation_id):
+        """
+        Point a conversation at its latest message again, after the last
+        message was edited or deleted. Its activity time is left alone.
+        """
+        latest = (
+            Message.objects.filter(conversation_id=conversation_id)
+            .order_by("-created_at", "-id")
+            .first()
+        )
+        Conversation.objects.filter(pk=conversation_id).update(
+            last_message=latest,
+            last_message_snippet=InboxService.snippet(latest.content) if latest else "",
+        )
@@ -0,0 +1,123 @@
+# messages/sockets.py
+import asyncio
+import json
+import time
+import uuid
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+
+from account.models import CustomUser
+from core.broadcast import get_channel_layer
+from .services import MessageEventService
+
+# Close codes: no valid end user token, and a socket that fell too far behind
+# its events (the client refetches over HTTP and reconnects)
+CLOSE_UNAUTHORIZED = 4401
+CLOSE_LAGGING = 4408
+
+# Typing events of a socket are forwarded at most once per conversation in
+# this many seconds, however often the client sends them
+TYPING_INTERVAL = 3
+
+
+def socket_user(scope):
+    """
+    The end user of a socket, authenticated by a JWT access token in the
+    `token` query parameter (browsers cannot set headers on a WebSocket) or
+    the Authorization header, or None
+    """
+    authentication = JWTAuthentication()
+    token = parse_qs(scope.get("query_string", b"").decode()).get("token", [None])[0]
+    try:
+        if token is None:
+            header = dict(scope.get("headers", ())).get(b"authorization")
+            token = header and authentication.get_raw_token(header)
+        if not token:
+            return None
+        user = authentication.get_user(authentication.get_validated_token(token))
+    except (AuthenticationFailed, InvalidToken):
+        return None
+    if user.user_type != CustomUser.UserType.END_USER:
+        return None
+    return user
+
+
+async def forward_events(subscription, send):
+    while not subscription.lagging:
+        message = await subscription.get()
+        if message is not None:
+            await send({"type": "websocket.send", "text": message})
+    await send({"type": "websocket.close", "code": CLOSE_LAGGING})
+
+
+async def client_event(user, text, typed_at):
+    """Handle a frame sent by the client, returning an error event if any"""
+    try:
+        event = json.loads(text or "")
+        event_type = event["type"]
+        conversation_id = uuid.UUID(str(event["conversation"]))
+    except (TypeError, ValueError, KeyError):
+        return {"type": "error", "detail": "Invalid event."}
+    if event_type != MessageEventService.TYPING:
+        return {"type": "error", "detail": f"Unknown event type {event_type}."}
+
+    now = time.monotonic()
+    if now - typed_at.get(conversation_id, -TYPING_INTERVAL) < TYPING_INTERVAL:
+        return None
+    typed_at[conversation_id] = now
+    if not await sync_to_async(MessageEventService.typing)(conversation_id, user):
+        return {"type": "error", "detail": "Not a participant of this conversation."}
+    return None
+
+
+async def message_socket(scope, receive, send):
+    """
+    WebSocket of an end user. Pushes `message`, `read` and `typing` events
+    of all the user's conversations, and takes `typing` events of the
+    client, `{"type": "typing", "conversation": <id>}`.
+    """
+    if (await receive())["type"] != "websocket.connect":
+        return
+    user = await sync_to_async(socket_user)(scope)
+    if user is None:
+        await send({"type": "websocket.close", "code": CLOSE_UNAUTHORIZED})
+        return
+
+    # Events and error replies are written from two tasks
+    lock = asyncio.Lock()
+
+    async def locked_send(message):
+        async with lock:
+            await send(message)
+
+    subscription = await get_channel_layer().subscribe(
+        MessageEventService.channel(user.pk)
+    )
+    forwarding = None
+    try:
+        await send({"type": "websocket.accept"})
+        forwarding = asyncio.create_task(forward_events(subscription, locked_send))
+        typed_at = {}
+        while True:
+            message = await receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            if message["type"] != "websocket.receive":
+                continue
+            error = await client_event(user, message.get("text"), typed_at)
+            if error is not None:
+                await locked_send({"type": "websocket.send", "text": json.dumps(error)})
+    finally:
+        if forwarding is not None:
+            forwarding.cancel()
+        subscription.close()
+
+
+# Paths of the WebSocket applications served next to Django
+websocket_routes = {
+    "/ws/messages/": message_socket,
+}
@@ -1,3 +1,443 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.core import checks
+from django.core.management import call_command
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APITestCase
+from rest_framework_simplejwt.tokens import AccessToken
+
+from account.models import EndUser
+from backend.asgi import application
+from core.broadcast import hub
+from .models import Conversation, ConversationMember, Message
+from .services import InboxService, MessageEventService, ReadService, read_receipts
+from .sockets import CLOSE_UNAUTHORIZED
+
+
+class Socket:
+    """Drives a WebSocket connection to the ASGI application"""
+
+    def __init__(self, path, query_string=b""):
+        self.received = asyncio.Queue()
+        self.sent = asyncio.Queue()
+        scope = {"type": "websocket", "path": path, "query_string": query_string}
+        self.task = asyncio.create_task(
+            application(scope, self.received.get, self.sent.put)
+        )
+
+    async def connect(self):
+        await self.received.put({"type": "websocket.connect"})
+        return await self.output()
+
+    async def output(self):
+        return await asyncio.wait_for(self.sent.get(), timeout=5)
+
+    async def event(self):
+        message = await self.output()
+        return json.loads(message["text"])
+
+    async def send(self, data):
+        await self.received.put({"type": "websocket.receive", "text": json.dumps(data)})
+
+    async def disconnect(self):
+        await self.received.put({"type": "websocket.disconnect", "code": 1000})
+        await asyncio.wait_for(self.task, timeout=5)
+
+
+@override_settings(READ_RECEIPT_WRITE_BEHIND=False)
+class MessageSocketTests(APITestCase):
+    def setUp(self):
+        self.sender, self.reader, self.outsider = [
+            EndUser.objects.create_user(
+                email=f"{name}@example.com", password="password123"
+            )
+            for name in ("sender", "reader", "outsider")
+        ]
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.sender, self.reader)
+
+    def query(self, user):
+        return f"token={AccessToken.for_user(user)}".encode()
+
+    def write(self, user, url, data=None):
+        self.client.force_authenticate(user=user)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(url, data)
+        self.assertIn(response.status_code, (200, 201), response.content)
+        return response
+
+    async def test_socket_pushes_messages_receipts_and_typing(self):
+        socket = Socket("/ws/messages/", self.query(self.reader))
+        self.assertEqual(await socket.connect(), {"type": "websocket.accept"})
+
+        response = await sync_to_async(self.write)(
+            self.sender,
+            "/api/messages/messages/",
+            {"conversation": self.conversation.id, "content": "Hello"},
+        )
+        event = await socket.event()
+        self.assertEqual(event["type"], "message")
+        self.assertEqual(event["data"]["id"], response.data["id"])
+        self.assertEqual(event["data"]["content"], "Hello")
+
+        await sync_to_async(self.write)(
+            self.reader, f"/api/messages/messages/{response.data['id']}/mark_read/"
+        )
+        event = await socket.event()
+        self.assertEqual(
+            event,
+            {
+                "type": "read",
+                "data": {
+                    "conversation": str(self.conversation.id),
+                    "user": str(self.reader.id),
+                    "message": response.data["id"],
+                },
+            },
+        )
+
+        # Typing reaches the other participants only, once per interval
+        sender = Socket("/ws/messages/", self.query(self.sender))
+        await sender.connect()
+        typing = {"type": "typing", "conversation": str(self.conversation.id)}
+        await socket.send(typing)
+        await socket.send(typing)
+        event = await sender.event()
+        self.assertEqual(event["data"]["user"], str(self.reader.id))
+        with self.assertRaises(asyncio.TimeoutError):
+            await asyncio.wait_for(sender.sent.get(), timeout=0.2)
+
+        await socket.send({"type": "typing", "conversation": "nope"})
+        self.assertEqual((await socket.event())["type"], "error")
+
+        await socket.disconnect()
+        await sender.disconnect()
+        self.assertNotIn(MessageEventService.channel(self.reader.id), hub.channels)
+
+    async def test_socket_requires_an_end_user_token(self):
+        socket = Socket("/ws/messages/", b"token=invalid")
+        self.assertEqual(
+            await socket.connect(),
+            {"type": "websocket.close", "code": CLOSE_UNAUTHORIZED},
+        )
+
+        socket = Socket("/ws/elsewhere/")
+        self.assertEqual((await socket.output())["type"], "websocket.close")
+
+        # Typing into a conversation of others is refused
+        socket = Socket("/ws/messages/", self.query(self.outsider))
+        await socket.connect()
+        await socket.send({"type": "typing", "conversation": str(self.conversation.id)})
+        self.assertEqual(
+            await socket.event(),
+            {"type": "error", "detail": "Not a participant of this conversation."},
+        )
+        await socket.disconnect()
+
+    def test_in_memory_layer_is_refused_with_several_workers(self):
+        with override_settings(WEB_CONCURRENCY=2):
+            errors = checks.run_checks()
+        self.assertIn("core.E001", [error.id for error in errors])
+        self.assertNotIn("core.E001", [error.id for error in checks.run_checks()])
+
+
+@override_settings(READ_RECEIPT_WRITE_BEHIND=True, READ_RECEIPT_FLUSH_INTERVAL=0)
+class ReadCursorTests(APITestCase):
+    def setUp(self):
+        self.sender, self.first, self.second = [
+            EndUser.objects.create_user(
+                email=f"{name}@example.com", password="password123"
+            )
+            for name in ("sender", "first", "second")
+        ]
+        self.conversation = Conversation.objects.create(is_group=True, name="Group")
+        self.conversation.participants.add(self.sender, self.first, self.second)
+        self.messages = [
+            Message.objects.create(
+                conversation=self.conversation, sender=self.sender, content=str(i)
+            )
+            for i in range(3)
+        ]
+        for message in self.messages:
+            InboxService.message_sent(message)
+        self.url = f"/api/messages/conversations/{self.conversation.id}/"
+
+    def unread_count(self, user):
+        self.client.force_authenticate(user=user)
+        response = self.client.get("/api/messages/conversations/unread_count/")
+        return response.data["unread_count"]
+
+    def open(self, user):
+        self.client.force_authenticate(user=user)
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.get(self.url)
+
+    def test_reading_moves_the_cursor_and_marks_messages_read_by_everyone(self):
+        self.assertEqual(self.unread_count(self.first), 3)
+
+        self.client.force_authenticate(user=self.first)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                f"/api/messages/messages/{self.messages[1].id}/mark_read/"
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.unread_count(self.first), 1)
+        self.assertEqual(read_receipts.flush(), 1)
+        self.assertFalse(Message.objects.filter(is_read=True).exists())
+
+        # Opening the conversation reads the rest, and receipts follow
+        response = self.open(self.second)
+        self.assertEqual(self.unread_count(self.second), 0)
+        receipts = {
+            message["content"]: [reader["id"] for reader in message["read_by_list"]]
+            for message in response.data["messages"]
+        }
+        self.assertEqual(
+            receipts,
+            {
+                "0": [str(self.first.id), str(self.second.id)],
+                "1": [str(self.first.id), str(self.second.id)],
+                "2": [str(self.second.id)],
+            },
+        )
+        # The is_read flags are settled after the response
+        self.assertFalse(Message.objects.filter(is_read=True).exists())
+        self.assertEqual(read_receipts.flush(), 1)
+        self.assertEqual(
+            set(Message.objects.filter(is_read=True).values_list("content", flat=True)),
+            {"0", "1"},
+        )
+
+        # A cursor never moves back
+        member = ConversationMember.objects.get(user=self.first)
+        self.assertIsNone(
+            ReadService.mark_read(self.conversation.id, self.first, self.messages[0])
+        )
+        member.refresh_from_db()
+        self.assertEqual(member.last_read_message_id, self.messages[1].id)
+
+    def test_receipts_lost_with_a_worker_are_settled_by_the_command(self):
+        # The on-commit callbacks never run, like a worker exiting before
+        # they are flushed
+        with self.captureOnCommitCallbacks():
+            ReadService.mark_read(self.conversation.id, self.first, self.messages[1])
+            ReadService.mark_read(self.conversation.id, self.second)
+        self.assertEqual(read_receipts.flush(), 0)
+
+        output = io.StringIO()
+        call_command("settle_read_receipts", "--batch-size", "1", stdout=output)
+        self.assertEqual(
+            output.getvalue().strip(),
+            "Marked 2 message(s) read in 1 conversation(s).",
+        )
+        self.assertEqual(
+            set(Message.objects.filter(is_read=True).values_list("content", flat=True)),
+            {"0", "1"},
+        )
+
+    def test_opening_a_conversation_costs_the_same_however_much_is_unread(self):
+        with CaptureQueriesContext(connection) as few:
+            self.open(self.first)
+        for i in range(40):
+            message = Message.objects.create(
+                conversation=self.conversation, sender=self.sender, content="More"
+            )
+            InboxService.message_sent(message)
+        with CaptureQueriesContext(connection) as many:
+            self.open(self.second)
+        self.assertEqual(len(few), len(many))
+
+        read_receipts.flush()
+        self.assertEqual(Message.objects.filter(is_read=False).count(), 40)
+        self.open(self.first)
+        self.assertEqual(read_receipts.flush(), 1)
+        self.assertFalse(Message.objects.filter(is_read=False).exists())
+
+
+class InboxTests(APITestCase):
+    def setUp(self):
+        self.viewer, *self.others = [
+            EndUser.objects.create_user(
+                email=f"user{i}@example.com", password="password123"
+            )
+            for i in range(6)
+        ]
+        self.conversations = []
+        for other in self.others:
+            conversation = Conversation.objects.create()
+            conversation.participants.add(self.viewer, other)
+            self.conversations.append(conversation)
+        self.group = Conversation.objects.create(is_group=True, name="Group")
+        self.group.participants.add(self.viewer, *self.others)
+
+    def send(self, user, conversation, content):
+        self.client.force_authenticate(user=user)
+        response = self.client.post(
+            "/api/messages/messages/",
+            {"conversation": conversation.id, "content": content},
+        )
+        self.assertEqual(response.status_code, 201, response.content)
+        return response.data["id"]
+
+    def inbox(self):
+        self.client.force_authenticate(user=self.viewer)
+        return self.client.get("/api/messages/conversations/").data["results"]
+
+    def test_inbox_is_ordered_by_activity_in_a_fixed_number_of_queries(self):
+        self.send(self.others[0], self.conversations[0], "Hi")
+        self.send(self.others[2], self.group, "x" * 80)
+        self.send(self.viewer, self.conversations[3], "Hello")
+
+        self.client.force_authenticate(user=self.viewer)
+        # Count, page and the participants of the page
+        with self.assertNumQueries(3):
+            response = self.client.get("/api/messages/conversations/")
+        inbox = response.data["results"]
+
+        self.assertEqual(
+            [conversation["id"] for conversation in inbox[:3]],
+            [
+                str(self.conversations[3].id),
+                str(self.group.id),
+                str(self.conversations[0].id),
+            ],
+        )
+        self.assertEqual(inbox[0]["unread_count"], 0)
+        self.assertEqual(inbox[0]["display_name"], self.others[3].username)
+        self.assertEqual(inbox[1]["unread_count"], 1)
+        self.assertEqual(inbox[1]["last_message_preview"]["content"], "x" * 50 + "...")
+        self.assertEqual(
+            inbox[1]["last_message_preview"]["sender"], self.others[2].username
+        )
+        self.assertEqual(len(inbox[1]["participants_details"]), 6)
+
+    def test_deleting_the_last_message_points_at_the_previous_one(self):
+        self.send(self.others[0], self.conversations[0], "First")
+        latest = self.send(self.others[0], self.conversations[0], "Second")
+        self.client.force_authenticate(user=self.others[0])
+        response = self.client.delete(f"/api/messages/messages/{latest}/")
+        self.assertEqual(response.status_code, 204)
+
+        inbox = self.inbox()
+        self.assertEqual(inbox[0]["id"], str(self.conversations[0].id))
+        self.assertEqual(inbox[0]["last_message_preview"]["content"], "First")
+
+    def assertNotModifiedUntilChanged(self, url, change):
+        self.client.force_authenticate(user=self.viewer)
+        etag = self.client.get(url)["ETag"]
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+        self.assertEqual(response.content, b"")
+
+        change()
+        self.client.force_authenticate(user=self.viewer)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_inbox_and_conversations_answer_conditional_gets(self):
+        self.assertNotModifiedUntilChanged(
+            "/api/messages/conversations/",
+            lambda: self.send(self.others[1], self.conversations[1], "Hi"),
+        )
+        self.assertNotModifiedUntilChanged(
+            f"/api/messages/conversations/{self.group.id}/",
+            lambda: self.send(self.others[0], self.group, "Hi"),
+        )
+
+
+class UnreadCounterTests(APITestCase):
+    def setUp(self):
+        self.viewer, self.first, self.second, self.late = [
+            EndUser.objects.create_user(
+                email=f"user{i}@example.com", password="password123"
+            )
+            for i in range(4)
+        ]
+        self.direct = Conversation.objects.create()
+        self.direct.participants.add(self.viewer, self.first)
+        self.group = Conversation.objects.create(is_group=True, name="Group")
+        self.group.participants.add(self.viewer, self.first, self.second)
+
+    def send(self, user, conversation, content="Hi"):
+        self.client.force_authenticate(user=user)
+        response = self.client.post(
+            "/api/messages/messages/",
+            {"conversation": conversation.id, "content": content},
+        )
+        self.assertEqual(response.status_code, 201, response.content)
+        return response.data["id"]
+
+    def badge(self, user):
+        self.client.force_authenticate(user=user)
+        with self.assertNumQueries(1):
+            response = self.client.get("/api/messages/conversations/unread_count/")
+        return response.data["unread_count"]
+
+    def assertCountersMatchRecount(self):
+        users = [self.viewer, self.first, self.second, self.late]
+        kept = [self.badge(user) for user in users]
+        InboxService.recount([user.pk for user in users])
+        self.assertEqual(kept, [self.badge(user) for user in users])
+
+    def test_sending_and_reading_move_the_counters(self):
+        self.send(self.first, self.direct)
+        self.send(self.first, self.group)
+        latest = self.send(self.second, self.group)
+        self.send(self.viewer, self.group)
+        self.assertEqual(self.badge(self.viewer), 3)
+        self.assertEqual(self.badge(self.first), 2)
+
+        self.client.force_authenticate(user=self.viewer)
+        self.client.get(f"/api/messages/conversations/{self.group.id}/")
+        self.assertEqual(self.badge(self.viewer), 1)
+        self.assertCountersMatchRecount()
+
+        # Deleting an unread message and leaving a group recount
+        self.client.force_authenticate(user=self.second)
+        response = self.client.delete(f"/api/messages/messages/{latest}/")
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.badge(self.first), 1)
+
+        self.client.force_authenticate(user=self.viewer)
+        response = self.client.post(
+            f"/api/messages/conversations/{self.group.id}/remove_participant/",
+            {"user_id": self.first.id},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.badge(self.first), 0)
+
+        # Joining late, the history counts as unread
+        self.client.force_authenticate(user=self.viewer)
+        response = self.client.post(
+            f"/api/messages/conversations/{self.group.id}/add_participant/",
+            {"user_id": self.late.id},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.badge(self.late), 2)
+        self.assertCountersMatchRecount()
+
+    def test_requests_leaving_the_requester_out_have_nothing_unread(self):
+        self.client.force_authenticate(user=self.viewer)
+        response = self.client.post(
+            "/api/messages/conversations/",
+            {"participants": [self.first.id, self.second.id], "is_group": True},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(response.data["unread_count"], 0)
+
+        self.send(self.first, self.group)
+        response = self.client.patch(
+            f"/api/messages/conversations/{self.group.id}/",
+            {"participants": [self.first.id, self.second.id]},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(response.data["unread_count"], 0)
@@ -1,41 +1,115 @@
 # messages/views.py
-from rest_framework import viewsets, status, permissions
+from rest_framework import viewsets, status, permissions, serializers
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from django.db.models import Q, Count, Max
+from rest_framework import generics
+from django.contrib.postgres.aggregates import ArrayAgg
+from django.db.models import Q, Count, F, Max, OuterRef, Subquery
+from django.db.transaction import atomic
 from django.shortcuts import get_object_or_404
 
-from .models import Conversation, Message
+from .models import Conversation, ConversationMember, Message
 from account.models import EndUser
+from core.conditional import ConditionalGetMixin
 from .serializers import (
     ConversationSerializer,
     ConversationDetailSerializer,
     MessageSerializer,
 )
+from .services import InboxService, MessageEventService, ReadService
 
 
-class ConversationViewSet(viewsets.ModelViewSet):
+class ConversationViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     serializer_class = ConversationSerializer
     permission_classes = [permissions.IsAuthenticated]
+    # Sending or deleting a message moves the activity or the last message,
+    # and `unread` is the viewer's count annotated on the inbox
+    etag_fields = (
+        "id",
+        "updated_at",
+        "name",
+        "last_activity_at",
+        "last_message_id",
+        "last_message_snippet",
+        "unread",
+        "participant_ids",
+    )
 
     def get_queryset(self):
+        # The viewer's conversations by latest activity, read in order from
+        # the (user, last_activity_at) index of their memberships
         user = self.request.user
-        return Conversation.objects.filter(participants=user).order_by("-created_at")
+        queryset = Conversation.objects.filter(members__user=user.pk).order_by(
+            "-members__last_activity_at", "-id"
+        )
+        if self.action == "list":
+            queryset = (
+                queryset.select_related("last_message__sender")
+                .prefetch_related("participants")
+                .annotate(unread=F("members__unread_count"))
+            )
+        return queryset
 
     def get_serializer_class(self):
         if self.action == "retrieve":
             return ConversationDetailSerializer
         return ConversationSerializer
 
+    @atomic
+    def perform_update(self, serializer):
+        before = set(serializer.instance.members.values_list("user_id", flat=True))
+        conversation = serializer.save()
+        after = set(conversation.members.values_list("user_id", flat=True))
+        InboxService.recount(before ^ after, conversation.id)
+
+    @atomic
+    def perform_destroy(self, instance):
+        user_ids = list(instance.members.values_list("user_id", flat=True))
+        super().perform_destroy(instance)
+        InboxService.recount(user_ids)
+
+    def get_etag_parts(self):
+        # Read receipts are the other members' cursors. The viewer's own is
+        # left out: the retrieve below moves it to the latest message, so it
+        # follows from the messages themselves
+        pk = self.kwargs["pk"]
+        members = ConversationMember.objects.filter(
+            conversation_id=OuterRef("pk")
+        ).values("conversation_id")
+        conversation = generics.get_object_or_404(
+            self.get_queryset()
+            .annotate(
+                participant_ids=Subquery(
+                    members.annotate(
+                        ids=ArrayAgg("user_id", order_by="user_id")
+                    ).values("ids")
+                ),
+                receipts=Subquery(
+                    members.exclude(user_id=self.request.user.pk)
+                    .annotate(
+                        cursors=ArrayAgg("last_read_message_id", order_by="user_id")
+                    )
+                    .values("cursors")
+                ),
+            )
+            .values_list("updated_at", "name", "participant_ids", "receipts"),
+            pk=pk,
+        )
+        messages = Message.objects.filter(conversation_id=pk).aggregate(
+            count=Count("id"), last_updated=Max("updated_at")
+        )
+        return (
+            conversation,
+            tuple(messages.values()),
+            self.request.query_params.get("message_limit"),
+        )
+
     def retrieve(self, request, *args, **kwargs):
+        self.check_etag(self.get_etag_parts())
         conversation = self.get_object()
 
-        # Mark messages as read when retrieving a conversation
-        unread_messages = conversation.messages.exclude(sender=request.user).exclude(
-            read_by=request.user
-        )
-        for message in unread_messages:
-            message.mark_as_read(request.user)
+        # Opening a conversation reads it up to the latest message
+        ReadService.mark_read(conversation.id, request.user)
 
         # Get message limit from query params
         message_limit = int(request.query_params.get("message_limit", 20))
@@ -107,7 +181,10 @@ class ConversationViewSet(viewsets.ModelViewSet):
             )
 
         user = get_object_or_404(EndUser, id=user_id)
-        conversation.participants.add(user)
+        with atomic():
+            conversation.participants.add(user)
+            # Whatever was said before they joined counts as unread
+            InboxService.recount([user.pk], conversation.id)
 
         return Response(
             {"detail": f"{user.username} added to the conversation."},
@@ -142,7 +219,9 @@ class ConversationViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
-        conversation.participants.remove(user)
+        with atomic():
+            conversation.participants.remove(user)
+            InboxService.recount([user.pk])
 
         return Response(
             {"detail": f"{user.username} removed from the conversation."},
@@ -169,18 +248,8 @@ class ConversationViewSet(viewsets.ModelViewSet):
 
     @action(detail=False, methods=["get"])
     def unread_count(self, request):
-        user = request.user
-        conversations = self.get_queryset()
-
-        # Calculate total unread messages across all conversations
-        total_unread = 0
-        for conversation in conversations:
-            unread_count = (
-                conversation.messages.exclude(sender=user).exclude(read_by=user).count()
-            )
-            total_unread += unread_count
-
-        return Response({"unread_count": total_unread})
+        # Maintained as messages are sent and read
+        return Response({"unread_count": InboxService.unread_total(request.user)})
 
 
 class MessageViewSet(viewsets.ModelViewSet):
@@ -193,6 +262,7 @@ class MessageViewSet(viewsets.ModelViewSet):
             "-created_at"
         )
 
+    @atomic
     def perform_create(self, serializer):
         conversation = serializer.validated_data["conversation"]
 
@@ -202,12 +272,31 @@ class MessageViewSet(viewsets.ModelViewSet):
                 {"detail": "You are not a participant in this conversation."}
             )
 
-        serializer.save(sender=self.request.user)
+        message = serializer.save(sender=self.request.user)
+        InboxService.message_sent(message)
+        MessageEventService.message_created(message)
+
+    @atomic
+    def perform_update(self, serializer):
+        message = serializer.save()
+        if Conversation.objects.filter(
+            pk=message.conversation_id, last_message=message
+        ).exists():
+            InboxService.refresh(message.conversation_id)
+
+    @atomic
+    def perform_destroy(self, instance):
+        super().perform_destroy(instance)
+        InboxService.refresh(instance.conversation_id)
+        InboxService.recount(
+            MessageEventService.participant_ids(instance.conversation_id),
+            instance.conversation_id,
+        )
 
     @action(detail=True, methods=["post"])
     def mark_read(self, request, pk=None):
         message = self.get_object()
-        message.mark_as_read(request.user)
+        ReadService.mark_read(message.conversation_id, request.user, message)
         return Response(
             {"detail": "Message marked as read."}, status=status.HTTP_200_OK
         )
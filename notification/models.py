@@ -52,4 +52,5 @@ class Notification(BaseModel):
         ordering = ["-created_at"]
         indexes = [
             models.Index(fields=["recipient", "is_read", "-created_at"]),
+            models.Index(fields=["recipient", "-created_at", "-id"]),
         ]
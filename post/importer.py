@@ -0,0 +1,321 @@
+# posts/importer.py
+import io
+import uuid
+from abc import ABC, abstractmethod
+from datetime import timezone as dt_timezone
+
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from account.models import EndUser
+from .models import Comment, Post, Reaction
+from .services import CounterService, TimelineService, TrendingService
+
+TRUE_VALUES = {"1", "true", "t", "yes", "y"}
+
+
+def parse_bool(value, default):
+    if value is None or value == "":
+        return default
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in TRUE_VALUES
+
+
+def parse_timestamp(value, default):
+    if not value:
+        return default
+    parsed = parse_datetime(str(value))
+    if parsed is None:
+        raise ValueError(f"Invalid timestamp: {value}")
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed, dt_timezone.utc)
+    return parsed
+
+
+def parse_uuid(value):
+    if not value:
+        return None
+    return uuid.UUID(str(value))
+
+
+def copy_value(value):
+    # COPY text format: \N is NULL, backslash and control characters escaped
+    if value is None:
+        return "\\N"
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+class BulkImporter(ABC):
+    """
+    Writes one chunk of records with PostgreSQL COPY.
+
+    Rows are copied into a temporary staging table and moved into the real
+    table with INSERT ... SELECT, which drops rows with dangling
+    references and ignores duplicates, so one bad row never aborts a chunk.
+    Nothing goes through save() or the per-request service hooks; whatever
+    they would have maintained is rebuilt set-wise once the chunk is in.
+    """
+
+    model = None
+    returning = "id"
+
+    def __init__(self):
+        self.now = timezone.now()
+
+    @abstractmethod
+    def build(self, record, users):
+        """Return an unsaved model instance for a record, or None to skip it"""
+
+    def referential_filter(self):
+        return "TRUE"
+
+    def after_chunk(self, returned):
+        pass
+
+    def finish(self):
+        pass
+
+    @staticmethod
+    def identifiers(records, keys):
+        return {
+            str(record[key]).strip()
+            for record in records
+            for key in keys
+            if record.get(key)
+        }
+
+    @staticmethod
+    def resolve_users(identifiers):
+        """Map emails and usernames to EndUser ids with one query"""
+        users = {}
+        if not identifiers:
+            return users
+        rows = EndUser.objects.filter(
+            Q(email__in=identifiers) | Q(username__in=identifiers)
+        ).values_list("id", "email", "username")
+        for user_id, email, username in rows:
+            users[email] = user_id
+            users[username] = user_id
+        return users
+
+    def import_chunk(self, records):
+        """
+        Returns:
+            (inserted, skipped) row counts for the chunk
+        """
+        users = self.resolve_users(self.identifiers(records, self.user_keys))
+
+        instances = []
+        for record in records:
+            try:
+                instance = self.build(record, users)
+            except (KeyError, TypeError, ValueError):
+                instance = None
+            if instance is not None:
+                instances.append(instance)
+
+        with transaction.atomic():
+            returned = self.copy(instances)
+            self.after_chunk(returned)
+
+        return len(returned), len(records) - len(returned)
+
+    def copy(self, instances):
+        if not instances:
+            return []
+
+        fields = self.model._meta.concrete_fields
+        buffer = io.StringIO()
+        for instance in instances:
+            buffer.write(
+                "\t".join(
+                    copy_value(
+                        field.get_db_prep_save(
+                            getattr(instance, field.attname), connection
+                        )
+                    )
+                    for field in fields
+                )
+            )
+            buffer.write("\n")
+        buffer.seek(0)
+
+        quote = connection.ops.quote_name
+        table = quote(self.model._meta.db_table)
+        columns = ", ".join(quote(field.column) for field in fields)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"CREATE TEMPORARY TABLE import_staging (LIKE {table} INCLUDING DEFAULTS)"
+            )
+            cursor.copy_expert(f"COPY import_staging ({columns}) FROM STDIN", buffer)
+            returned = self.insert(cursor, table, columns)
+            cursor.execute("DROP TABLE import_staging")
+        return returned
+
+    def insert(self, cursor, table, columns):
+        """Move the staged rows into the table, returning what was inserted"""
+        cursor.execute(f"""
+            INSERT INTO {table} ({columns})
+            SELECT {columns} FROM import_staging staged
+            WHERE {self.referential_filter()}
+            ON CONFLICT DO NOTHING
+            RETURNING {self.returning}
+            """)
+        return cursor.fetchall()
+
+
+class PostImporter(BulkImporter):
+    model = Post
+    user_keys = ("author",)
+    returning = "id, is_public, is_archived"
+
+    def build(self, record, users):
+        author_id = users.get(str(record.get("author", "")).strip())
+        if author_id is None or not record.get("content"):
+            return None
+
+        created_at = parse_timestamp(record.get("created_at"), self.now)
+        return Post(
+            id=parse_uuid(record.get("id")) or uuid.uuid4(),
+            author_id=author_id,
+            content=record["content"],
+            is_public=parse_bool(record.get("is_public"), True),
+            is_archived=parse_bool(record.get("is_archived"), False),
+            created_at=created_at,
+            updated_at=created_at,
+        )
+
+    def after_chunk(self, returned):
+        TimelineService.fan_out_posts(
+            [
+                post_id
+                for post_id, is_public, is_archived in returned
+                if not is_public and not is_archived
+            ]
+        )
+
+
+class CommentImporter(BulkImporter):
+    model = Comment
+    user_keys = ("author",)
+    returning = "post_id, parent_id"
+
+    def build(self, record, users):
+        author_id = users.get(str(record.get("author", "")).strip())
+        if author_id is None or not record.get("content"):
+            return None
+
+        created_at = parse_timestamp(record.get("created_at"), self.now)
+        return Comment(
+            id=parse_uuid(record.get("id")) or uuid.uuid4(),
+            post_id=parse_uuid(record["post"]),
+            parent_id=parse_uuid(record.get("parent")),
+            author_id=author_id,
+            content=record["content"],
+            is_deleted=parse_bool(record.get("is_deleted"), False),
+            created_at=created_at,
+            updated_at=created_at,
+        )
+
+    def referential_filter(self):
+        return f"""
+            EXISTS (
+                SELECT 1 FROM {Post._meta.db_table} post
+                WHERE post.id = staged.post_id
+            )
+            AND (
+                staged.parent_id IS NULL
+                OR EXISTS (
+                    SELECT 1 FROM {Comment._meta.db_table} parent
+                    WHERE parent.id = staged.parent_id
+                        AND parent.post_id = staged.post_id
+                )
+            )
+        """
+
+    def insert(self, cursor, table, columns):
+        # Replies may arrive in the same chunk as their parent, so they go in
+        # a pass per level of nesting, once their parent was accepted. A
+        # reply to a rejected parent is rejected with it.
+        returned = []
+        while True:
+            inserted = super().insert(cursor, table, columns)
+            if not inserted:
+                return returned
+            returned.extend(inserted)
+
+    def after_chunk(self, returned):
+        post_ids = {post_id for post_id, _ in returned}
+        parent_ids = {parent_id for _, parent_id in returned if parent_id}
+        CounterService.reconcile(Post.objects.filter(pk__in=post_ids))
+        CounterService.reconcile(Comment.objects.filter(pk__in=parent_ids))
+
+    def finish(self):
+        TrendingService.refresh()
+
+
+class ReactionImporter(BulkImporter):
+    model = Reaction
+    user_keys = ("user",)
+    returning = "post_id, comment_id"
+
+    def build(self, record, users):
+        user_id = users.get(str(record.get("user", "")).strip())
+        post_id = parse_uuid(record.get("post"))
+        comment_id = parse_uuid(record.get("comment"))
+        reaction_type = str(record.get("reaction_type") or Reaction.ReactionType.LIKE)
+        reaction_type = reaction_type.strip().upper()
+        if (
+            user_id is None
+            or (post_id is None) == (comment_id is None)
+            or reaction_type not in Reaction.ReactionType.values
+        ):
+            return None
+
+        created_at = parse_timestamp(record.get("created_at"), self.now)
+        return Reaction(
+            id=parse_uuid(record.get("id")) or uuid.uuid4(),
+            user_id=user_id,
+            post_id=post_id,
+            comment_id=comment_id,
+            reaction_type=reaction_type,
+            created_at=created_at,
+            updated_at=created_at,
+        )
+
+    def referential_filter(self):
+        return f"""
+            EXISTS (
+                SELECT 1 FROM {Post._meta.db_table} post
+                WHERE post.id = staged.post_id
+            )
+            OR EXISTS (
+                SELECT 1 FROM {Comment._meta.db_table} comment
+                WHERE comment.id = staged.comment_id
+            )
+        """
+
+    def after_chunk(self, returned):
+        post_ids = {post_id for post_id, _ in returned if post_id}
+        comment_ids = {comment_id for _, comment_id in returned if comment_id}
+        CounterService.reconcile(Post.objects.filter(pk__in=post_ids))
+        CounterService.reconcile(Comment.objects.filter(pk__in=comment_ids))
+
+    def finish(self):
+        TrendingService.refresh()
+
+
+IMPORTERS = {
+    "posts": PostImporter,
+    "comments": CommentImporter,
+    "reactions": ReactionImporter,
+}
@@ -0,0 +1,55 @@
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from post.services import ArchiveService
+
+
+class Command(BaseCommand):
+    help = (
+        "Move posts that have been archived for a while, with their comments "
+        "and reactions, into the partitioned archive tables"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--older-than-days",
+            type=int,
+            default=settings.ARCHIVE_AFTER_DAYS,
+            help="Only move posts archived at least this many days ago",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="Number of posts moved per transaction",
+        )
+        parser.add_argument(
+            "--detach-before",
+            help="Also detach archive partitions of months ending by this date "
+            "(YYYY-MM-DD)",
+        )
+
+    def handle(self, *args, **options):
+        before = timezone.now() - timedelta(days=options["older_than_days"])
+
+        moved = 0
+        while True:
+            batch = ArchiveService.archive(before, options["batch_size"])
+            if not batch:
+                break
+            moved += batch
+        self.stdout.write(self.style.SUCCESS(f"Moved {moved} post(s) to the archive."))
+
+        if options["detach_before"]:
+            try:
+                detach_before = datetime.strptime(
+                    options["detach_before"], "%Y-%m-%d"
+                ).replace(tzinfo=dt_timezone.utc)
+            except ValueError:
+                raise CommandError("--detach-before must be a YYYY-MM-DD date")
+
+            for name in ArchiveService.detach(detach_before):
+                self.stdout.write(f"Detached {name}")
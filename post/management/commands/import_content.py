@@ -0,0 +1,80 @@
+import csv
+import json
+import os
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+
+from post.importer import IMPORTERS
+
+
+class Command(BaseCommand):
+    help = (
+        "Bulk import posts, comments or reactions from an NDJSON or CSV file. "
+        "Users are referenced by email or username."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="File to import")
+        parser.add_argument(
+            "--kind",
+            required=True,
+            choices=sorted(IMPORTERS),
+            help="What the file contains",
+        )
+        parser.add_argument(
+            "--format",
+            choices=["ndjson", "csv"],
+            help="File format (inferred from the extension when omitted)",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=5000,
+            help="Number of records written per transaction",
+        )
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        if not os.path.exists(path):
+            raise CommandError(f"File not found: {path}")
+
+        file_format = options["format"]
+        if file_format is None:
+            file_format = "csv" if path.lower().endswith(".csv") else "ndjson"
+
+        importer = IMPORTERS[options["kind"]]()
+        inserted = skipped = 0
+
+        with open(path, newline="", encoding="utf-8") as source:
+            records = (
+                csv.DictReader(source)
+                if file_format == "csv"
+                else self.read_ndjson(source)
+            )
+            while True:
+                chunk = list(islice(records, options["chunk_size"]))
+                if not chunk:
+                    break
+                chunk_inserted, chunk_skipped = importer.import_chunk(chunk)
+                inserted += chunk_inserted
+                skipped += chunk_skipped
+                self.stdout.write(f"{inserted} imported, {skipped} skipped...")
+
+        importer.finish()
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Imported {inserted} {options['kind']}, skipped {skipped}."
+            )
+        )
+
+    @staticmethod
+    def read_ndjson(source):
+        for line_number, line in enumerate(source, start=1):
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError as exc:
+                raise CommandError(f"Invalid JSON on line {line_number}: {exc}")
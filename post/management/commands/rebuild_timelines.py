@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from account.models import EndUser
+from post.services import TimelineService
+
+
+class Command(BaseCommand):
+    help = "Rebuild the materialized home timelines from scratch"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--user",
+            action="append",
+            dest="emails",
+            default=[],
+            help="Only rebuild the timeline of the user with this email (repeatable)",
+        )
+
+    def handle(self, *args, **options):
+        users = EndUser.objects.order_by("pk")
+        if options["emails"]:
+            users = users.filter(email__in=options["emails"])
+
+        rebuilt = 0
+        for user in users.iterator(chunk_size=500):
+            TimelineService.rebuild(user)
+            rebuilt += 1
+
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {rebuilt} timeline(s)."))
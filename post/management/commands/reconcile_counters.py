@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from post.models import Comment, Post
+from post.services import CounterService
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the denormalized reaction and comment counters and repair any drift"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Number of rows checked per transaction",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+
+        for model in (Post, Comment):
+            repaired = 0
+            last_pk = None
+            while True:
+                batch = model.objects.order_by("pk")
+                if last_pk is not None:
+                    batch = batch.filter(pk__gt=last_pk)
+                pks = list(batch.values_list("pk", flat=True)[:batch_size])
+                if not pks:
+                    break
+
+                with transaction.atomic():
+                    repaired += CounterService.reconcile(
+                        model.objects.filter(pk__in=pks)
+                    )
+                last_pk = pks[-1]
+
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"Repaired counters on {repaired} {model._meta.verbose_name}(s)."
+                )
+            )
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from post.services import TrendingService
+
+
+class Command(BaseCommand):
+    help = "Recompute the trending scores of recent posts and prune older ones"
+
+    def handle(self, *args, **options):
+        ranked = TrendingService.refresh()
+        self.stdout.write(self.style.SUCCESS(f"Scored {ranked} trending post(s)."))
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("account", "0001_initial"),
+        ("post", "0002_timelineentry"),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="post",
+            name="post_public_feed_idx",
+        ),
+        migrations.AddIndex(
+            model_name="post",
+            index=models.Index(
+                condition=models.Q(("is_archived", False), ("is_public", True)),
+                fields=["-created_at", "-id"],
+                name="post_public_feed_idx",
+            ),
+        ),
+    ]
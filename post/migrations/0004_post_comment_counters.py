@@ -0,0 +1,129 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:07
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+REACTION_TYPES = ["LIKE", "LOVE", "LAUGH", "WOW", "SAD", "ANGRY"]
+
+
+def _count(queryset, group_by):
+    return Coalesce(
+        Subquery(
+            queryset.order_by()
+            .values(group_by)
+            .annotate(total=Count("pk"))
+            .values("total")
+        ),
+        0,
+    )
+
+
+def backfill_counters(apps, schema_editor):
+    Post = apps.get_model("post", "Post")
+    Comment = apps.get_model("post", "Comment")
+    Reaction = apps.get_model("post", "Reaction")
+
+    for model, target in ((Post, "post"), (Comment, "comment")):
+        counters = {
+            f"{reaction_type.lower()}_count": _count(
+                Reaction.objects.filter(
+                    **{target: OuterRef("pk")}, reaction_type=reaction_type
+                ),
+                target,
+            )
+            for reaction_type in REACTION_TYPES
+        }
+        model.objects.update(**counters)
+
+    Post.objects.update(
+        comments_count=_count(
+            Comment.objects.filter(post=OuterRef("pk"), is_deleted=False), "post"
+        )
+    )
+    Comment.objects.update(
+        replies_count=_count(
+            Comment.objects.filter(parent=OuterRef("pk"), is_deleted=False), "parent"
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("post", "0003_keyset_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="comment",
+            name="angry_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="comment",
+            name="laugh_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="comment",
+            name="like_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="comment",
+            name="love_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="comment",
+            name="replies_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="comment",
+            name="sad_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="comment",
+            name="wow_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="post",
+            name="angry_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="post",
+            name="comments_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="post",
+            name="laugh_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="post",
+            name="like_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="post",
+            name="love_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="post",
+            name="sad_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="post",
+            name="wow_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
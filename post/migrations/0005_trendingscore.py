@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:11
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("post", "0004_post_comment_counters"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TrendingScore",
+            fields=[
+                (
+                    "post",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="trending",
+                        serialize=False,
+                        to="post.post",
+                    ),
+                ),
+                ("score", models.FloatField()),
+                ("post_created_at", models.DateTimeField()),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                "indexes": [
+                    models.Index(fields=["-score"], name="post_trendi_score_31f276_idx")
+                ],
+            },
+        ),
+    ]
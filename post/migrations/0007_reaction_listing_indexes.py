@@ -0,0 +1,46 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("account", "0001_initial"),
+        ("post", "0006_post_search_vector"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="reaction",
+            index=models.Index(
+                condition=models.Q(("post__isnull", False)),
+                fields=["post", "-created_at", "-id"],
+                name="reaction_post_recent_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="reaction",
+            index=models.Index(
+                condition=models.Q(("post__isnull", False)),
+                fields=["post", "reaction_type", "-created_at", "-id"],
+                name="reaction_post_type_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="reaction",
+            index=models.Index(
+                condition=models.Q(("comment__isnull", False)),
+                fields=["comment", "-created_at", "-id"],
+                name="reaction_comment_recent_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="reaction",
+            index=models.Index(
+                condition=models.Q(("comment__isnull", False)),
+                fields=["comment", "reaction_type", "-created_at", "-id"],
+                name="reaction_comment_type_idx",
+            ),
+        ),
+    ]
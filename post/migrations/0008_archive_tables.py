@@ -0,0 +1,28 @@
+from django.db import migrations
+
+# Archive copies of the post, comment and reaction tables, range-partitioned
+# by month of created_at (see ArchiveService). The monthly partitions are
+# created on demand; rows of a month whose partition was detached land in
+# the DEFAULT partition.
+TABLES = ["post_post", "post_comment", "post_reaction"]
+
+CREATE_ARCHIVES = "\n".join(f"""
+CREATE TABLE {table}_archive (
+    LIKE {table} INCLUDING DEFAULTS,
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+CREATE TABLE {table}_archive_default PARTITION OF {table}_archive DEFAULT;
+""" for table in TABLES)
+
+DROP_ARCHIVES = "\n".join(f"DROP TABLE IF EXISTS {table}_archive;" for table in TABLES)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("post", "0007_reaction_listing_indexes"),
+    ]
+
+    operations = [
+        migrations.RunSQL(CREATE_ARCHIVES, DROP_ARCHIVES),
+    ]
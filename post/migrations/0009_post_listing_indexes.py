@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("account", "0001_initial"),
+        ("post", "0008_archive_tables"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="post",
+            index=models.Index(
+                condition=models.Q(("is_archived", False)),
+                fields=["-created_at", "-id"],
+                name="post_recent_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="post",
+            index=models.Index(
+                condition=models.Q(("is_archived", False)),
+                fields=["-updated_at", "-id"],
+                name="post_recently_updated_idx",
+            ),
+        ),
+    ]
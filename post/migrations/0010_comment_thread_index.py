@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("account", "0001_initial"),
+        ("post", "0009_post_listing_indexes"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="comment",
+            index=models.Index(
+                condition=models.Q(("is_deleted", False), ("parent", None)),
+                fields=["post", "created_at", "id"],
+                name="comment_thread_idx",
+            ),
+        ),
+    ]
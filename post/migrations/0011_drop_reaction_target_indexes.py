@@ -0,0 +1,59 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:32
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# The partial listing indexes of 0007 lead with post_id and comment_id and
+# cover every lookup by target, including the cascades, so the plain foreign
+# key indexes only cost writes. Only the indexes are dropped: altering the
+# fields directly would also drop and re-validate both foreign keys.
+DROP_INDEXES = """
+DROP INDEX IF EXISTS post_reaction_post_id_9a2b2ee4;
+DROP INDEX IF EXISTS post_reaction_comment_id_b082d582;
+"""
+
+CREATE_INDEXES = """
+CREATE INDEX IF NOT EXISTS post_reaction_post_id_9a2b2ee4
+ON post_reaction (post_id);
+CREATE INDEX IF NOT EXISTS post_reaction_comment_id_b082d582
+ON post_reaction (comment_id);
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("post", "0010_comment_thread_index"),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[migrations.RunSQL(DROP_INDEXES, CREATE_INDEXES)],
+            state_operations=[
+                migrations.AlterField(
+                    model_name="reaction",
+                    name="comment",
+                    field=models.ForeignKey(
+                        blank=True,
+                        db_index=False,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="reactions",
+                        to="post.comment",
+                    ),
+                ),
+                migrations.AlterField(
+                    model_name="reaction",
+                    name="post",
+                    field=models.ForeignKey(
+                        blank=True,
+                        db_index=False,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="reactions",
+                        to="post.post",
+                    ),
+                ),
+            ],
+        ),
+    ]
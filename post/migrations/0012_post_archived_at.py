@@ -0,0 +1,65 @@
+# Generated by Django 5.2.18 on 2026-10-18 05:01
+
+from django.db import migrations, models
+
+# Posts archived before this migration count from their last update, which
+# is what ArchiveService went by until now
+BACKFILL = """
+UPDATE post_post SET archived_at = updated_at WHERE is_archived;
+ALTER TABLE post_post_archive ADD COLUMN archived_at timestamp with time zone;
+"""
+
+UNDO_BACKFILL = "ALTER TABLE post_post_archive DROP COLUMN archived_at;"
+
+# archived_at follows is_archived whichever way the row is written, a
+# queryset update or a save() leaving out updated_at included. A write that
+# keeps the post archived keeps the time unless it sets a new one.
+CREATE_TRIGGER = """
+CREATE FUNCTION post_archived_at_update() RETURNS trigger AS $$
+BEGIN
+    IF NOT NEW.is_archived THEN
+        NEW.archived_at := NULL;
+    ELSIF TG_OP = 'INSERT' OR NOT OLD.is_archived THEN
+        NEW.archived_at := COALESCE(NEW.archived_at, now());
+    ELSE
+        NEW.archived_at := COALESCE(NEW.archived_at, OLD.archived_at);
+    END IF;
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER post_archived_at_update
+BEFORE INSERT OR UPDATE OF is_archived, archived_at ON post_post
+FOR EACH ROW EXECUTE FUNCTION post_archived_at_update();
+"""
+
+DROP_TRIGGER = """
+DROP TRIGGER IF EXISTS post_archived_at_update ON post_post;
+DROP FUNCTION IF EXISTS post_archived_at_update();
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("account", "0001_initial"),
+        ("post", "0011_drop_reaction_target_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="post",
+            name="archived_at",
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunSQL(BACKFILL, UNDO_BACKFILL),
+        migrations.RunSQL(CREATE_TRIGGER, DROP_TRIGGER),
+        migrations.AddIndex(
+            model_name="post",
+            index=models.Index(
+                condition=models.Q(("is_archived", True)),
+                fields=["archived_at"],
+                name="post_archived_idx",
+            ),
+        ),
+    ]
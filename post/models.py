@@ -1,23 +1,91 @@
 # posts/models.py
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
 from core.models import BaseModel
 from account.models import EndUser
 
 
-class Post(BaseModel):
+class ReactionCounters(models.Model):
+    # Denormalized per-type reaction counters, kept in step with the
+    # Reaction rows by CounterService
+    like_count = models.PositiveIntegerField(default=0)
+    love_count = models.PositiveIntegerField(default=0)
+    laugh_count = models.PositiveIntegerField(default=0)
+    wow_count = models.PositiveIntegerField(default=0)
+    sad_count = models.PositiveIntegerField(default=0)
+    angry_count = models.PositiveIntegerField(default=0)
+
+    COUNTER_FIELDS = (
+        "like_count",
+        "love_count",
+        "laugh_count",
+        "wow_count",
+        "sad_count",
+        "angry_count",
+    )
+
+    class Meta:
+        abstract = True
+
+    @staticmethod
+    def counter_field(reaction_type):
+        return f"{reaction_type.lower()}_count"
+
+    @property
+    def reaction_counts(self):
+        return {
+            reaction_type: getattr(self, self.counter_field(reaction_type))
+            for reaction_type, _ in Reaction.ReactionType.choices
+        }
+
+
+class Post(ReactionCounters, BaseModel):
     author = models.ForeignKey(EndUser, related_name="posts", on_delete=models.CASCADE)
     content = models.TextField()
     is_public = models.BooleanField(default=True)
     is_archived = models.BooleanField(default=False)
+    # Set when is_archived flips on and cleared when it flips off, by a
+    # database trigger so bulk updates are covered too, see migration 0012
+    archived_at = models.DateTimeField(null=True, blank=True, editable=False)
+    # Live (not soft-deleted) comments, replies included
+    comments_count = models.PositiveIntegerField(default=0)
+    # Maintained from `content` by a database trigger, see migration 0006
+    search_vector = SearchVectorField(null=True, editable=False)
 
     def __str__(self):
         return f"{self.author.username}'s post: {self.content[:50]}..."
 
     class Meta:
         ordering = ["-created_at"]
+        indexes = [
+            models.Index(
+                fields=["-created_at", "-id"],
+                condition=models.Q(is_public=True, is_archived=False),
+                name="post_public_feed_idx",
+            ),
+            # Listings filtered by author or re-ordered by the client
+            models.Index(
+                fields=["-created_at", "-id"],
+                condition=models.Q(is_archived=False),
+                name="post_recent_idx",
+            ),
+            models.Index(
+                fields=["-updated_at", "-id"],
+                condition=models.Q(is_archived=False),
+                name="post_recently_updated_idx",
+            ),
+            GinIndex(fields=["search_vector"], name="post_search_vector_idx"),
+            # Posts due to be moved to the archive tables
+            models.Index(
+                fields=["archived_at"],
+                condition=models.Q(is_archived=True),
+                name="post_archived_idx",
+            ),
+        ]
 
 
-class Comment(BaseModel):
+class Comment(ReactionCounters, BaseModel):
     post = models.ForeignKey(Post, related_name="comments", on_delete=models.CASCADE)
     author = models.ForeignKey(
         EndUser, related_name="comments", on_delete=models.CASCADE
@@ -27,12 +95,22 @@ class Comment(BaseModel):
     parent = models.ForeignKey(
         "self", null=True, blank=True, related_name="replies", on_delete=models.CASCADE
     )
+    # Live (not soft-deleted) direct replies
+    replies_count = models.PositiveIntegerField(default=0)
 
     def __str__(self):
         return f"Comment by {self.author.username} on {self.post}"
 
     class Meta:
         ordering = ["created_at"]
+        indexes = [
+            # Pages of the top-level comments of a post, oldest first
+            models.Index(
+                fields=["post", "created_at", "id"],
+                condition=models.Q(parent=None, is_deleted=False),
+                name="comment_thread_idx",
+            ),
+        ]
 
 
 class Reaction(BaseModel):
@@ -47,8 +125,15 @@ class Reaction(BaseModel):
     user = models.ForeignKey(
         EndUser, related_name="reactions", on_delete=models.CASCADE
     )
+    # Looked up through the partial listing indexes below, which lead with
+    # the target, so the plain foreign key indexes are not created
     post = models.ForeignKey(
-        Post, related_name="reactions", on_delete=models.CASCADE, null=True, blank=True
+        Post,
+        related_name="reactions",
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        db_index=False,
     )
     comment = models.ForeignKey(
         Comment,
@@ -56,6 +141,7 @@ class Reaction(BaseModel):
         on_delete=models.CASCADE,
         null=True,
         blank=True,
+        db_index=False,
     )
     reaction_type = models.CharField(
         max_length=10, choices=ReactionType.choices, default=ReactionType.LIKE
@@ -76,8 +162,73 @@ class Reaction(BaseModel):
                 name="reaction_not_both_post_and_comment",
             ),
         ]
+        # Newest-first reactor listings of a post or comment, overall and
+        # per reaction type
+        indexes = [
+            models.Index(
+                fields=["post", "-created_at", "-id"],
+                condition=models.Q(post__isnull=False),
+                name="reaction_post_recent_idx",
+            ),
+            models.Index(
+                fields=["post", "reaction_type", "-created_at", "-id"],
+                condition=models.Q(post__isnull=False),
+                name="reaction_post_type_idx",
+            ),
+            models.Index(
+                fields=["comment", "-created_at", "-id"],
+                condition=models.Q(comment__isnull=False),
+                name="reaction_comment_recent_idx",
+            ),
+            models.Index(
+                fields=["comment", "reaction_type", "-created_at", "-id"],
+                condition=models.Q(comment__isnull=False),
+                name="reaction_comment_type_idx",
+            ),
+        ]
 
     def __str__(self):
         if self.post:
             return f"{self.user.username} {self.reaction_type} on {self.post}"
         return f"{self.user.username} {self.reaction_type} on comment {self.comment.id}"
+
+
+class TimelineEntry(models.Model):
+    # Friends-only posts fanned out to every viewer allowed to see them.
+    # Public posts are read straight from the post table, so they never
+    # land here.
+    owner = models.ForeignKey(
+        EndUser, related_name="timeline_entries", on_delete=models.CASCADE
+    )
+    post = models.ForeignKey(
+        Post, related_name="timeline_entries", on_delete=models.CASCADE
+    )
+    post_created_at = models.DateTimeField()
+
+    class Meta:
+        unique_together = ("owner", "post")
+        indexes = [
+            models.Index(fields=["owner", "-post_created_at"]),
+        ]
+
+    def __str__(self):
+        return f"{self.post} in {self.owner.username}'s timeline"
+
+
+class TrendingScore(models.Model):
+    # Time-decayed activity score of a recent post, stored in log space so it
+    # only ever grows and never needs rescaling (see TrendingService)
+    post = models.OneToOneField(
+        Post, primary_key=True, related_name="trending", on_delete=models.CASCADE
+    )
+    score = models.FloatField()
+    post_created_at = models.DateTimeField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["-score"]),
+        ]
+
+    def __str__(self):
+        return f"{self.post_id}: {self.score}"
@@ -1,5 +1,10 @@
+from django.db.models import prefetch_related_objects
+from django.urls import reverse
 from rest_framework import serializers
+from rest_framework.utils.urls import replace_query_param
+from core.pagination import KeysetPagination
 from .models import Post, Comment, Reaction
+from .services import CommentThreadService
 from account.models import EndUser
 
 
@@ -20,9 +25,10 @@ class ReactionSerializer(serializers.ModelSerializer):
 
 class CommentSerializer(serializers.ModelSerializer):
     author_details = AuthorSerializer(source="author", read_only=True)
-    reactions_count = serializers.SerializerMethodField()
+    reactions_count = serializers.DictField(source="reaction_counts", read_only=True)
     user_reaction = serializers.SerializerMethodField()
     replies = serializers.SerializerMethodField()
+    replies_next = serializers.SerializerMethodField()
 
     class Meta:
         model = Comment
@@ -37,16 +43,17 @@ class CommentSerializer(serializers.ModelSerializer):
             "reactions_count",
             "user_reaction",
             "replies",
+            "replies_count",
+            "replies_next",
         ]
-        read_only_fields = ["author"]
-
-    def get_reactions_count(self, obj):
-        return {
-            reaction_type: obj.reactions.filter(reaction_type=reaction_type).count()
-            for reaction_type, _ in Reaction.ReactionType.choices
-        }
+        read_only_fields = ["author", "replies_count"]
 
     def get_user_reaction(self, obj):
+        # Preloaded for the whole comment tree by CommentThreadService
+        comment_reactions = self.context.get("comment_reactions")
+        if comment_reactions is not None:
+            return comment_reactions.get(obj.id)
+
         request = self.context.get("request")
         if request and request.user.is_authenticated:
             reaction = obj.reactions.filter(user=request.user).first()
@@ -55,16 +62,33 @@ class CommentSerializer(serializers.ModelSerializer):
         return None
 
     def get_replies(self, obj):
-        # Only get direct replies, not nested ones
-        replies = obj.replies.filter(is_deleted=False)
+        # Threads loaded by CommentThreadService only carry a preview of
+        # their replies, the rest is fetched page by page through replies_next
+        replies = getattr(obj, "reply_preview", None)
+        if replies is None:
+            # Only get direct replies, not nested ones
+            replies = obj.replies.filter(is_deleted=False).select_related("author")
         return CommentShallowSerializer(replies, many=True, context=self.context).data
 
+    def get_replies_next(self, obj):
+        replies = getattr(obj, "reply_preview", None)
+        request = self.context.get("request")
+        if not replies or not request or obj.replies_count <= len(replies):
+            return None
+
+        last = replies[-1]
+        cursor = KeysetPagination().encode_cursor(
+            [last.created_at.isoformat(), str(last.id)], reverse=False
+        )
+        url = request.build_absolute_uri(reverse("comment-replies", args=[obj.id]))
+        return replace_query_param(url, "cursor", cursor)
+
 
 class CommentShallowSerializer(serializers.ModelSerializer):
     """A simpler version of CommentSerializer to avoid infinite recursion"""
 
     author_details = AuthorSerializer(source="author", read_only=True)
-    reactions_count = serializers.SerializerMethodField()
+    reactions_count = serializers.DictField(source="reaction_counts", read_only=True)
     user_reaction = serializers.SerializerMethodField()
 
     class Meta:
@@ -79,13 +103,11 @@ class CommentShallowSerializer(serializers.ModelSerializer):
             "user_reaction",
         ]
 
-    def get_reactions_count(self, obj):
-        return {
-            reaction_type: obj.reactions.filter(reaction_type=reaction_type).count()
-            for reaction_type, _ in Reaction.ReactionType.choices
-        }
-
     def get_user_reaction(self, obj):
+        comment_reactions = self.context.get("comment_reactions")
+        if comment_reactions is not None:
+            return comment_reactions.get(obj.id)
+
         request = self.context.get("request")
         if request and request.user.is_authenticated:
             reaction = obj.reactions.filter(user=request.user).first()
@@ -94,10 +116,50 @@ class CommentShallowSerializer(serializers.ModelSerializer):
         return None
 
 
+class CommentEventSerializer(CommentShallowSerializer):
+    """A new comment as pushed to every viewer of the post's stream"""
+
+    user_reaction = None
+
+    class Meta:
+        model = Comment
+        fields = [
+            "id",
+            "post",
+            "parent",
+            "author",
+            "content",
+            "created_at",
+            "author_details",
+            "reactions_count",
+        ]
+
+
+class PostListSerializer(serializers.ListSerializer):
+    """
+    Serializes a page of posts in a fixed number of queries: one for the
+    authors that were not selected with the posts and one for the viewer's
+    own reactions. Reaction and comment counts come from the post row.
+    """
+
+    def to_representation(self, data):
+        posts = list(data.all() if hasattr(data, "all") else data)
+        prefetch_related_objects(posts, "author")
+
+        request = self.context.get("request")
+        if request and request.user.is_authenticated:
+            self.context["post_reactions"] = dict(
+                Reaction.objects.filter(
+                    user=request.user, post_id__in=[post.id for post in posts]
+                ).values_list("post_id", "reaction_type")
+            )
+
+        return super().to_representation(posts)
+
+
 class PostSerializer(serializers.ModelSerializer):
     author_details = AuthorSerializer(source="author", read_only=True)
-    comments_count = serializers.SerializerMethodField()
-    reactions_count = serializers.SerializerMethodField()
+    reactions_count = serializers.DictField(source="reaction_counts", read_only=True)
     user_reaction = serializers.SerializerMethodField()
 
     class Meta:
@@ -113,18 +175,15 @@ class PostSerializer(serializers.ModelSerializer):
             "reactions_count",
             "user_reaction",
         ]
-        read_only_fields = ["author"]
-
-    def get_comments_count(self, obj):
-        return obj.comments.filter(is_deleted=False).count()
-
-    def get_reactions_count(self, obj):
-        return {
-            reaction_type: obj.reactions.filter(reaction_type=reaction_type).count()
-            for reaction_type, _ in Reaction.ReactionType.choices
-        }
+        read_only_fields = ["author", "comments_count"]
+        list_serializer_class = PostListSerializer
 
     def get_user_reaction(self, obj):
+        # Preloaded for the whole page by PostListSerializer
+        post_reactions = self.context.get("post_reactions")
+        if post_reactions is not None:
+            return post_reactions.get(obj.id)
+
         request = self.context.get("request")
         if request and request.user.is_authenticated:
             reaction = obj.reactions.filter(user=request.user).first()
@@ -134,12 +193,42 @@ class PostSerializer(serializers.ModelSerializer):
 
 
 class PostDetailSerializer(PostSerializer):
-    comments = serializers.SerializerMethodField()
-
-    class Meta(PostSerializer.Meta):
-        fields = PostSerializer.Meta.fields + ["comments"]
-
-    def get_comments(self, obj):
-        # Only get top-level comments (no parent)
-        comments = obj.comments.filter(parent=None, is_deleted=False)
-        return CommentSerializer(comments, many=True, context=self.context).data
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+
+        # First page of top-level comments, each with a preview of its replies
+        page = serialize_comment_threads(instance, self.context)
+        data["comments"] = page["results"]
+        data["comments_next"] = page["next"]
+        return data
+
+
+def serialize_comment_threads(post, context, offset=0, limit=None):
+    """
+    Serialize one page of the comment threads of a post
+
+    The page of top-level comments and the previews of its replies are loaded
+    by CommentThreadService, and the viewer's reactions on every rendered
+    comment in one more query.
+    """
+    limit = limit or CommentThreadService.PAGE_SIZE
+    threads, total = CommentThreadService.load_threads(post, offset, limit)
+
+    context = dict(context)
+    request = context.get("request")
+    if request and request.user.is_authenticated:
+        context["comment_reactions"] = CommentThreadService.user_reactions(
+            request.user, threads
+        )
+
+    next_url = None
+    if request and offset + limit < total:
+        next_url = request.build_absolute_uri(reverse("post-comments", args=[post.id]))
+        next_url = replace_query_param(next_url, "limit", limit)
+        next_url = replace_query_param(next_url, "offset", offset + limit)
+
+    return {
+        "count": total,
+        "next": next_url,
+        "results": CommentSerializer(threads, many=True, context=context).data,
+    }
@@ -0,0 +1,940 @@
+# posts/services.py
+import json
+import math
+import uuid
+from base64 import b64decode
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone as dt_timezone
+from functools import reduce
+from operator import or_
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery, Value, Window
+from django.db.models.functions import Coalesce, Greatest, RowNumber, TruncMonth
+from django.utils import timezone
+from rest_framework.utils.encoders import JSONEncoder
+
+from core.broadcast import get_channel_layer
+from core.buffer import DeltaBuffer
+from core.pagination import KeysetPagination
+from core.partitions import detach_partitions, ensure_partitions
+from friend.models import FriendEdge, Friendship
+from .models import (
+    Comment,
+    Post,
+    Reaction,
+    ReactionCounters,
+    TimelineEntry,
+    TrendingScore,
+)
+
+
+class TimelineService:
+    @staticmethod
+    def get_feed(user):
+        """
+        Return the home feed of a user, newest first.
+
+        Public posts come from the partial public-feed index and friends-only
+        posts from the user's materialized timeline, so neither side needs the
+        friend list at read time.
+        """
+        public_posts = Post.objects.filter(is_public=True, is_archived=False)
+        # Posts archived or made public without going through sync_post keep
+        # their entries, which must not surface them a second time
+        timeline_posts = Post.objects.filter(
+            timeline_entries__owner=user, is_public=False, is_archived=False
+        )
+        return public_posts.union(timeline_posts, all=True).order_by(
+            "-created_at", "-id"
+        )
+
+    @staticmethod
+    def fan_out_post(post):
+        """Push a friends-only post into the timelines of its author and friends"""
+        if post.is_public or post.is_archived:
+            return
+
+        audience_ids = list(Friendship.get_friend_ids(post.author))
+        audience_ids.append(post.author_id)
+
+        TimelineEntry.objects.bulk_create(
+            [
+                TimelineEntry(
+                    owner_id=owner_id, post=post, post_created_at=post.created_at
+                )
+                for owner_id in audience_ids
+            ],
+            ignore_conflicts=True,
+        )
+        TimelineService.trim(audience_ids)
+
+    @staticmethod
+    def fan_out_posts(post_ids):
+        """Fan out many posts at once, reading the authors' friendships in one query"""
+        posts = list(
+            Post.objects.filter(
+                pk__in=post_ids, is_public=False, is_archived=False
+            ).values_list("id", "author_id", "created_at")
+        )
+        if not posts:
+            return
+
+        author_ids = {author_id for _, author_id, _ in posts}
+        audiences = defaultdict(set)
+        for author_id in author_ids:
+            audiences[author_id].add(author_id)
+        for author_id, friend_id in FriendEdge.objects.filter(
+            user_id__in=author_ids
+        ).values_list("user_id", "friend_id"):
+            audiences[author_id].add(friend_id)
+
+        TimelineEntry.objects.bulk_create(
+            [
+                TimelineEntry(
+                    owner_id=owner_id, post_id=post_id, post_created_at=created_at
+                )
+                for post_id, author_id, created_at in posts
+                for owner_id in audiences[author_id]
+            ],
+            ignore_conflicts=True,
+        )
+        TimelineService.trim(set().union(*audiences.values()))
+
+    @staticmethod
+    def trim(owner_ids):
+        """
+        Drop the entries past the newest TIMELINE_MAX_LENGTH of each timeline.
+        The cutoff of an owner is read from the (owner, post_created_at)
+        index, never more than TIMELINE_MAX_LENGTH + 1 entries into it.
+        """
+        entries = TimelineEntry._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                DELETE FROM {entries} entry
+                USING (
+                    SELECT owner.id AS owner_id, cutoff.post_created_at
+                    FROM unnest(%(owners)s::uuid[]) AS owner (id)
+                    CROSS JOIN LATERAL (
+                        SELECT post_created_at FROM {entries}
+                        WHERE owner_id = owner.id
+                        ORDER BY post_created_at DESC
+                        OFFSET %(length)s LIMIT 1
+                    ) cutoff
+                ) cut
+                WHERE entry.owner_id = cut.owner_id
+                    AND entry.post_created_at <= cut.post_created_at
+                """,
+                {"owners": list(owner_ids), "length": settings.TIMELINE_MAX_LENGTH},
+            )
+
+    @staticmethod
+    def remove_post(post):
+        """Remove a post from every timeline it was fanned out to"""
+        TimelineEntry.objects.filter(post=post).delete()
+
+    @staticmethod
+    def sync_post(post):
+        """Bring the timelines in line with the current visibility of a post"""
+        if post.is_public or post.is_archived:
+            TimelineService.remove_post(post)
+        else:
+            TimelineService.fan_out_post(post)
+
+    @staticmethod
+    def _timeline_posts(author_ids):
+        return Post.objects.filter(
+            author_id__in=author_ids, is_public=False, is_archived=False
+        ).order_by("-created_at")[: settings.TIMELINE_MAX_LENGTH]
+
+    @staticmethod
+    def _fill(owner, posts):
+        TimelineEntry.objects.bulk_create(
+            [
+                TimelineEntry(owner=owner, post_id=post_id, post_created_at=created_at)
+                for post_id, created_at in posts.values_list("id", "created_at")
+            ],
+            ignore_conflicts=True,
+        )
+
+    @staticmethod
+    @transaction.atomic
+    def connect_friends(user1, user2):
+        """Merge the friends-only posts of two new friends into each other's timeline"""
+        TimelineService._fill(user1, TimelineService._timeline_posts([user2.id]))
+        TimelineService._fill(user2, TimelineService._timeline_posts([user1.id]))
+        TimelineService.trim([user1.id, user2.id])
+
+    @staticmethod
+    @transaction.atomic
+    def disconnect_friends(user1, user2):
+        """Drop the friends-only posts of two former friends from each other's timeline"""
+        TimelineEntry.objects.filter(owner=user1, post__author=user2).delete()
+        TimelineEntry.objects.filter(owner=user2, post__author=user1).delete()
+
+    @staticmethod
+    @transaction.atomic
+    def rebuild(user):
+        """Rebuild the timeline of a user from scratch"""
+        author_ids = list(Friendship.get_friend_ids(user))
+        author_ids.append(user.id)
+
+        TimelineEntry.objects.filter(owner=user).delete()
+        TimelineService._fill(user, TimelineService._timeline_posts(author_ids))
+
+
+class CounterService:
+    @staticmethod
+    def _adjust(model, pk, deltas):
+        changes = {}
+        for field, delta in deltas.items():
+            if delta > 0:
+                changes[field] = F(field) + delta
+            elif delta < 0:
+                changes[field] = Greatest(F(field) + delta, Value(0))
+        if changes:
+            model.objects.filter(pk=pk).update(**changes)
+
+    @staticmethod
+    def shift_reactions(added, removed):
+        """
+        SQL SET clause moving the reaction counters of a post or comment by +1
+        for the `added` reaction type and -1 for the `removed` one, where both
+        are SQL expressions (a column, a placeholder or NULL)
+        """
+        return ", ".join(
+            f"{field} = GREATEST({field}"
+            f" + (CASE {added} WHEN '{reaction_type}' THEN 1 ELSE 0 END)"
+            f" - (CASE {removed} WHEN '{reaction_type}' THEN 1 ELSE 0 END), 0)"
+            for reaction_type, field in (
+                (reaction_type, ReactionCounters.counter_field(reaction_type))
+                for reaction_type in Reaction.ReactionType.values
+            )
+        )
+
+    @staticmethod
+    def buffer_reaction(model, pk, added=None, removed=None):
+        """
+        Queue the counter change of a reaction for the write-behind buffer,
+        once the reaction itself is committed
+
+        Args:
+            model: Post or Comment
+            pk: Primary key of the target
+            added: Reaction type that was added, if any
+            removed: Reaction type that was removed, if any
+        """
+        deltas = {}
+        if removed:
+            field = model.counter_field(removed)
+            deltas[field] = deltas.get(field, 0) - 1
+        if added:
+            field = model.counter_field(added)
+            deltas[field] = deltas.get(field, 0) + 1
+        transaction.on_commit(lambda: reaction_counters.add(model, pk, deltas))
+
+    @staticmethod
+    def comment_created(comment):
+        """Count a new comment on its post and, for replies, on its parent"""
+        if comment.is_deleted:
+            return
+        CounterService._adjust(Post, comment.post_id, {"comments_count": 1})
+        if comment.parent_id:
+            CounterService._adjust(Comment, comment.parent_id, {"replies_count": 1})
+
+    @staticmethod
+    def comment_deleted(comment):
+        """
+        Discount a comment that is about to be deleted, together with the
+        replies that are deleted along with it
+        """
+        removed = 0 if comment.is_deleted else 1
+        frontier = [comment.pk]
+        while frontier:
+            replies = list(
+                Comment.objects.filter(parent_id__in=frontier).values_list(
+                    "id", "is_deleted"
+                )
+            )
+            removed += sum(1 for _, is_deleted in replies if not is_deleted)
+            frontier = [reply_id for reply_id, _ in replies]
+
+        CounterService._adjust(Post, comment.post_id, {"comments_count": -removed})
+        if comment.parent_id and not comment.is_deleted:
+            CounterService._adjust(Comment, comment.parent_id, {"replies_count": -1})
+
+    @staticmethod
+    def comment_moved(comment, post_id, parent_id):
+        """
+        Move the count of an edited comment from the post and parent it was
+        under, `post_id` and `parent_id`, to its current ones
+        """
+        if comment.is_deleted:
+            return
+        if comment.post_id != post_id:
+            CounterService._adjust(Post, post_id, {"comments_count": -1})
+            CounterService._adjust(Post, comment.post_id, {"comments_count": 1})
+        if comment.parent_id != parent_id:
+            if parent_id:
+                CounterService._adjust(Comment, parent_id, {"replies_count": -1})
+            if comment.parent_id:
+                CounterService._adjust(Comment, comment.parent_id, {"replies_count": 1})
+
+    @staticmethod
+    def _count(queryset, group_by):
+        return Coalesce(
+            Subquery(
+                queryset.order_by()
+                .values(group_by)
+                .annotate(total=Count("pk"))
+                .values("total")
+            ),
+            0,
+        )
+
+    @staticmethod
+    def expected_counters(model):
+        """Expressions computing the true counter values of each Post or Comment"""
+        target = "post" if model is Post else "comment"
+        expected = {
+            model.counter_field(reaction_type): CounterService._count(
+                Reaction.objects.filter(
+                    **{target: OuterRef("pk")}, reaction_type=reaction_type
+                ),
+                target,
+            )
+            for reaction_type, _ in Reaction.ReactionType.choices
+        }
+        if model is Post:
+            expected["comments_count"] = CounterService._count(
+                Comment.objects.filter(post=OuterRef("pk"), is_deleted=False), "post"
+            )
+        else:
+            expected["replies_count"] = CounterService._count(
+                Comment.objects.filter(parent=OuterRef("pk"), is_deleted=False),
+                "parent",
+            )
+        return expected
+
+    @staticmethod
+    def reconcile(queryset):
+        """
+        Repair the counters of every drifted row in a Post or Comment queryset
+
+        Returns:
+            Number of rows that were repaired
+        """
+        expected = CounterService.expected_counters(queryset.model)
+        drifted = queryset.annotate(
+            **{f"expected_{field}": value for field, value in expected.items()}
+        ).filter(
+            reduce(or_, [~Q(**{field: F(f"expected_{field}")}) for field in expected])
+        )
+        drifted_ids = list(drifted.values_list("pk", flat=True))
+        if drifted_ids:
+            queryset.model.objects.filter(pk__in=drifted_ids).update(**expected)
+        return len(drifted_ids)
+
+
+# Reaction counter deltas waiting to be written when REACTION_WRITE_BEHIND
+# is on, flushed every REACTION_FLUSH_INTERVAL seconds
+reaction_counters = DeltaBuffer(
+    CounterService._adjust, lambda: settings.REACTION_FLUSH_INTERVAL
+)
+
+
+class ReactionService:
+    """
+    Reaction writes as single statements. The point visibility check on the
+    target, the reaction insert, update or delete and the counter update of
+    the target all run in one round trip, and the unique (user, target) index
+    arbitrates concurrent clicks instead of a read-then-write in Python.
+    """
+
+    REACTORS_PREVIEW = 3
+
+    @staticmethod
+    def reactions_of(target, reaction_type=None):
+        """Reactions to a Post or Comment with their users joined, newest first"""
+        reactions = target.reactions.select_related("user").order_by(
+            "-created_at", "-id"
+        )
+        if reaction_type:
+            reactions = reactions.filter(reaction_type=reaction_type)
+        return reactions
+
+    @staticmethod
+    def _target(model):
+        # Rows of the target the user may react to, %(target)s and %(user)s
+        if model is Comment:
+            return f"""
+                SELECT target.id, NULL::timestamptz AS created_at, target.post_id
+                FROM {Comment._meta.db_table} target
+                WHERE target.id = %(target)s
+            """
+        return f"""
+            SELECT target.id, target.created_at, target.id AS post_id
+            FROM {Post._meta.db_table} target
+            WHERE target.id = %(target)s AND NOT target.is_archived AND (
+                target.is_public
+                OR target.author_id = %(user)s
+                OR EXISTS (
+                    SELECT 1 FROM {FriendEdge._meta.db_table} edge
+                    WHERE edge.user_id = %(user)s
+                        AND edge.friend_id = target.author_id
+                )
+            )
+        """
+
+    @staticmethod
+    def _counted(model, added, removed, source, condition=""):
+        # Counter update of the target, left out of the statement when the
+        # deltas go through the write-behind buffer instead
+        if settings.REACTION_WRITE_BEHIND:
+            return ""
+        targets = model._meta.db_table
+        return f""",
+            counted AS (
+                UPDATE {targets}
+                SET {CounterService.shift_reactions(added, removed)}
+                FROM {source}
+                WHERE {targets}.id = %(target)s {condition}
+            )
+        """
+
+    @staticmethod
+    def _params(model, user, target_id, **params):
+        try:
+            target_id = uuid.UUID(str(target_id))
+        except ValueError:
+            raise model.DoesNotExist
+        return {"user": user.pk, "target": target_id, **params}
+
+    @staticmethod
+    def react(user, model, target_id, reaction_type):
+        """
+        Add or change the user's reaction to a Post or Comment
+
+        Returns:
+            True if the reaction was added, False if an existing one changed
+
+        Raises:
+            model.DoesNotExist: The target does not exist or is not visible
+        """
+        params = ReactionService._params(
+            model,
+            user,
+            target_id,
+            id=uuid.uuid4(),
+            reaction_type=reaction_type,
+            now=timezone.now(),
+        )
+        column = "post_id" if model is Post else "comment_id"
+        other_column = "comment_id" if model is Post else "post_id"
+        reactions = Reaction._meta.db_table
+
+        with connection.cursor() as cursor:
+            while True:
+                cursor.execute(
+                    f"""
+                    WITH target AS ({ReactionService._target(model)}),
+                    inserted AS (
+                        INSERT INTO {reactions} (id, user_id, {column},
+                            {other_column}, reaction_type, created_at, updated_at)
+                        SELECT %(id)s, %(user)s, target.id, NULL,
+                            %(reaction_type)s, %(now)s, %(now)s
+                        FROM target
+                        ON CONFLICT (user_id, {column}) DO NOTHING
+                        RETURNING reaction_type
+                    ){ReactionService._counted(
+                        model, "inserted.reaction_type", "NULL", "inserted"
+                    )}
+                    SELECT target.created_at, target.post_id,
+                        EXISTS (SELECT 1 FROM inserted)
+                    FROM target
+                    """,
+                    params,
+                )
+                row = cursor.fetchone()
+                if row is None:
+                    raise model.DoesNotExist
+                created_at, post_id, inserted = row
+                if inserted:
+                    StreamService.reactions_changed(
+                        post_id, model, params["target"], added=reaction_type
+                    )
+                    if settings.REACTION_WRITE_BEHIND:
+                        CounterService.buffer_reaction(
+                            model, params["target"], added=reaction_type
+                        )
+                    if model is Post:
+                        TrendingService.record_event(
+                            params["target"],
+                            created_at,
+                            TrendingService.REACTION_WEIGHT,
+                        )
+                    return True
+
+                # The reaction exists: the row lock orders concurrent changes
+                # and hands back the type this one replaces
+                cursor.execute(
+                    f"""
+                    WITH previous AS (
+                        SELECT id, reaction_type FROM {reactions}
+                        WHERE user_id = %(user)s AND {column} = %(target)s
+                        FOR UPDATE
+                    ),
+                    changed AS (
+                        UPDATE {reactions}
+                        SET reaction_type = %(reaction_type)s, updated_at = %(now)s
+                        FROM previous
+                        WHERE {reactions}.id = previous.id
+                        RETURNING previous.reaction_type AS removed
+                    ){ReactionService._counted(
+                        model,
+                        "%(reaction_type)s",
+                        "changed.removed",
+                        "changed",
+                        "AND changed.removed <> %(reaction_type)s",
+                    )}
+                    SELECT removed FROM changed
+                    """,
+                    params,
+                )
+                row = cursor.fetchone()
+                if row is not None:
+                    if row[0] != reaction_type:
+                        StreamService.reactions_changed(
+                            post_id, model, params["target"], reaction_type, row[0]
+                        )
+                        if settings.REACTION_WRITE_BEHIND:
+                            CounterService.buffer_reaction(
+                                model, params["target"], reaction_type, row[0]
+                            )
+                    return False
+                # Deleted in between, start over with an insert
+
+    @staticmethod
+    def unreact(user, model, target_id):
+        """
+        Remove the user's reaction to a Post or Comment
+
+        Returns:
+            The removed reaction type, or None if there was no reaction
+
+        Raises:
+            model.DoesNotExist: The target does not exist or is not visible
+        """
+        params = ReactionService._params(model, user, target_id)
+        column = "post_id" if model is Post else "comment_id"
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                WITH target AS ({ReactionService._target(model)}),
+                deleted AS (
+                    DELETE FROM {Reaction._meta.db_table}
+                    WHERE user_id = %(user)s
+                        AND {column} IN (SELECT id FROM target)
+                    RETURNING reaction_type
+                ){ReactionService._counted(
+                    model, "NULL", "deleted.reaction_type", "deleted"
+                )}
+                SELECT (SELECT reaction_type FROM deleted), target.post_id
+                FROM target
+                """,
+                params,
+            )
+            row = cursor.fetchone()
+        if row is None:
+            raise model.DoesNotExist
+
+        removed, post_id = row
+        if removed:
+            StreamService.reactions_changed(
+                post_id, model, params["target"], removed=removed
+            )
+            if settings.REACTION_WRITE_BEHIND:
+                CounterService.buffer_reaction(model, params["target"], removed=removed)
+        return removed
+
+
+class TrendingService:
+    # A score is ln(sum(weight * 2 ** ((event_time - EPOCH) / half_life))) over
+    # the reactions and comments of a post. Ranking by it is the same as
+    # ranking by activity decayed to the current time, but recording an event
+    # only touches the row of the post it happened on.
+    EPOCH = datetime(2025, 1, 1, tzinfo=dt_timezone.utc)
+    REACTION_WEIGHT = 1.0
+    COMMENT_WEIGHT = 2.0
+
+    @staticmethod
+    def decay_rate():
+        return math.log(2) / (settings.TRENDING_HALF_LIFE_HOURS * 3600)
+
+    @staticmethod
+    def window_start():
+        return timezone.now() - timedelta(days=settings.TRENDING_WINDOW_DAYS)
+
+    @staticmethod
+    def event_score(weight, at):
+        elapsed = (at - TrendingService.EPOCH).total_seconds()
+        return math.log(weight) + elapsed * TrendingService.decay_rate()
+
+    @staticmethod
+    def record(post, weight):
+        if not post.is_archived:
+            TrendingService.record_event(post.pk, post.created_at, weight)
+
+    @staticmethod
+    def record_event(post_id, post_created_at, weight):
+        """Fold one event into the score of a post with a single upsert"""
+        if post_created_at < TrendingService.window_start():
+            return
+        if settings.REACTION_WRITE_BEHIND:
+            transaction.on_commit(
+                lambda: trending_events.add(Post, post_id, {"weight": weight})
+            )
+            return
+        TrendingService.fold(post_id, weight)
+
+    @staticmethod
+    def fold(post_id, weight):
+        # Events buffered together count as happening now, which is off by
+        # at most one flush interval
+        now = timezone.now()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                INSERT INTO {TrendingScore._meta.db_table} AS trending
+                    (post_id, score, post_created_at, updated_at)
+                SELECT post.id, %s, post.created_at, %s
+                FROM {Post._meta.db_table} post
+                WHERE post.id = %s
+                ON CONFLICT (post_id) DO UPDATE SET
+                    score = GREATEST(trending.score, EXCLUDED.score)
+                        + LN(1 + EXP(-ABS(trending.score - EXCLUDED.score))),
+                    updated_at = EXCLUDED.updated_at
+                """,
+                [TrendingService.event_score(weight, now), now, post_id],
+            )
+
+    @staticmethod
+    def record_reaction(post):
+        TrendingService.record(post, TrendingService.REACTION_WEIGHT)
+
+    @staticmethod
+    def record_comment(post):
+        TrendingService.record(post, TrendingService.COMMENT_WEIGHT)
+
+    @staticmethod
+    @transaction.atomic
+    def refresh():
+        """
+        Recompute every score from the reactions and comments of the posts in
+        the trending window, dropping posts that fell out of it
+
+        Returns:
+            Number of posts that have a trending score
+        """
+        params = {
+            "epoch": TrendingService.EPOCH,
+            "rate": TrendingService.decay_rate(),
+            "reaction_weight": TrendingService.REACTION_WEIGHT,
+            "comment_weight": TrendingService.COMMENT_WEIGHT,
+            "window_start": TrendingService.window_start(),
+            "now": timezone.now(),
+        }
+        TrendingScore.objects.all().delete()
+        with connection.cursor() as cursor:
+            # Log-sum-exp around the per-post maximum keeps EXP() in range
+            cursor.execute(
+                f"""
+                WITH events AS (
+                    SELECT reaction.post_id, LN(%(reaction_weight)s)
+                        + EXTRACT(EPOCH FROM reaction.created_at - %(epoch)s)
+                        * %(rate)s AS score
+                    FROM {Reaction._meta.db_table} reaction
+                    WHERE reaction.post_id IS NOT NULL
+                    UNION ALL
+                    SELECT comment.post_id, LN(%(comment_weight)s)
+                        + EXTRACT(EPOCH FROM comment.created_at - %(epoch)s)
+                        * %(rate)s
+                    FROM {Comment._meta.db_table} comment
+                    WHERE NOT comment.is_deleted
+                ),
+                recent AS (
+                    SELECT events.post_id, events.score, post.created_at,
+                        MAX(events.score) OVER (PARTITION BY events.post_id) AS peak
+                    FROM events
+                    JOIN {Post._meta.db_table} post ON post.id = events.post_id
+                    WHERE post.created_at >= %(window_start)s AND NOT post.is_archived
+                )
+                INSERT INTO {TrendingScore._meta.db_table}
+                    (post_id, score, post_created_at, updated_at)
+                SELECT post_id, peak + LN(SUM(EXP(score - peak))), created_at, %(now)s
+                FROM recent
+                GROUP BY post_id, peak, created_at
+                ON CONFLICT (post_id) DO UPDATE SET
+                    score = EXCLUDED.score,
+                    updated_at = EXCLUDED.updated_at
+                """,
+                params,
+            )
+            return cursor.rowcount
+
+    @staticmethod
+    def ranked(queryset):
+        """Order a visibility-filtered Post queryset by trending score"""
+        return queryset.filter(
+            trending__post_created_at__gte=TrendingService.window_start()
+        ).order_by("-trending__score")
+
+
+# Trending events waiting to be folded in when REACTION_WRITE_BEHIND is on
+trending_events = DeltaBuffer(
+    lambda model, pk, deltas: TrendingService.fold(pk, deltas["weight"]),
+    lambda: settings.REACTION_FLUSH_INTERVAL,
+)
+
+
+class CommentThreadService:
+    PAGE_SIZE = 10
+    MAX_PAGE_SIZE = 100
+    REPLIES_PREVIEW = 3
+
+    @staticmethod
+    def load_threads(post, offset=0, limit=PAGE_SIZE):
+        """
+        Load one page of the top-level comments of a post with a preview of
+        their direct replies
+
+        The page is cut in SQL from the partial comment_thread_idx index, and
+        the reply previews of that page only come from one more query.
+
+        Returns:
+            (threads, total) where every thread carries its replies preview in
+            `reply_preview` and total is the number of top-level comments
+        """
+        top_level = Comment.objects.filter(post=post, parent=None, is_deleted=False)
+        threads = list(
+            top_level.select_related("author").order_by("created_at", "id")[
+                offset : offset + limit
+            ]
+        )
+
+        replies = defaultdict(list)
+        if threads:
+            previews = (
+                Comment.objects.filter(
+                    parent_id__in=[thread.id for thread in threads], is_deleted=False
+                )
+                .select_related("author")
+                .annotate(
+                    position=Window(
+                        RowNumber(),
+                        partition_by=[F("parent_id")],
+                        order_by=[F("created_at").asc(), F("id").asc()],
+                    )
+                )
+                .filter(position__lte=CommentThreadService.REPLIES_PREVIEW)
+                .order_by("created_at", "id")
+            )
+            for reply in previews:
+                replies[reply.parent_id].append(reply)
+
+        for thread in threads:
+            thread.reply_preview = replies[thread.id]
+        return threads, top_level.count()
+
+    @staticmethod
+    def user_reactions(user, threads):
+        """Map every comment rendered in the threads to the user's reaction type"""
+        comment_ids = []
+        for thread in threads:
+            comment_ids.append(thread.id)
+            comment_ids.extend(reply.id for reply in thread.reply_preview)
+        return dict(
+            Reaction.objects.filter(user=user, comment_id__in=comment_ids).values_list(
+                "comment_id", "reaction_type"
+            )
+        )
+
+
+class StreamService:
+    """
+    Live events of a post for the comment stream. Events are published on
+    the channel layer once their transaction commits, and new
+    comments carry a cursor a reconnecting client can resume from.
+    """
+
+    BACKLOG_LIMIT = 100
+    CURSOR_ORDERING = ("created_at", "id")
+
+    @staticmethod
+    def channel(post_id):
+        return f"post:{post_id}"
+
+    @staticmethod
+    def publish(post_id, event, data, event_id=None):
+        """
+        Publish an event to the stream of a post after the current commit
+
+        Args:
+            post_id: Post whose stream receives the event
+            event: SSE event name
+            data: JSON serializable payload, encoded once for every listener
+            event_id: SSE id of the event, a cursor for comment events
+        """
+        message = (event, event_id, json.dumps(data, cls=JSONEncoder))
+        transaction.on_commit(
+            lambda: get_channel_layer().publish(StreamService.channel(post_id), message)
+        )
+
+    @staticmethod
+    def cursor(comment):
+        return KeysetPagination().encode_cursor(
+            [comment.created_at.isoformat(), str(comment.id)], False
+        )
+
+    @staticmethod
+    def decode_cursor(value):
+        """
+        Position of a cursor built by `cursor`
+
+        Raises:
+            ValueError: The cursor is malformed
+        """
+        try:
+            created_at, comment_id = json.loads(b64decode(value.encode("ascii")))["p"]
+            return [datetime.fromisoformat(created_at), uuid.UUID(comment_id)]
+        except (TypeError, ValueError, KeyError, UnicodeError):
+            raise ValueError("Invalid cursor")
+
+    @staticmethod
+    def comments_since(post_id, position, limit=BACKLOG_LIMIT):
+        """Visible comments of a post created after a cursor position, oldest first"""
+        comments = Comment.objects.filter(post_id=post_id, is_deleted=False)
+        if position is not None:
+            comments = comments.filter(
+                KeysetPagination._after(StreamService.CURSOR_ORDERING, position)
+            )
+        return list(
+            comments.select_related("author").order_by(*StreamService.CURSOR_ORDERING)[
+                :limit
+            ]
+        )
+
+    @staticmethod
+    def reactions_changed(post_id, model, target_id, added=None, removed=None):
+        """Publish the reaction count deltas of a post or one of its comments"""
+        deltas = {}
+        if removed:
+            deltas[removed] = -1
+        if added:
+            deltas[added] = deltas.get(added, 0) + 1
+        if any(deltas.values()):
+            StreamService.publish(
+                post_id,
+                "reactions",
+                {
+                    "target": "post" if model is Post else "comment",
+                    "id": target_id,
+                    "deltas": deltas,
+                },
+            )
+
+
+class ArchiveService:
+    """
+    Moves archived posts out of the live tables.
+
+    Archived posts are never served again, yet their comments and reactions
+    keep weighing on vacuum, index size and cascades. Once a post has been
+    archived for a while, going by its archived_at, it is copied with its
+    comments and reactions into the `<table>_archive` tables, which are range-partitioned by month of
+    created_at (migration 0008), and deleted from the live ones. Old archive
+    partitions can then be detached. Post, Comment and Reaction themselves
+    stay plain tables: PostgreSQL requires the partition key in every primary
+    key and unique constraint, which the UUID keys, the foreign keys onto
+    them and the (user, target) reaction constraint rule out.
+    """
+
+    MODELS = (Post, Comment, Reaction)
+
+    @staticmethod
+    def archive_table(model):
+        return f"{model._meta.db_table}_archive"
+
+    @staticmethod
+    def _copy(queryset):
+        months = list(
+            queryset.order_by()
+            .annotate(month=TruncMonth("created_at", tzinfo=dt_timezone.utc))
+            .values_list("month", flat=True)
+            .distinct()
+        )
+        if not months:
+            return
+
+        model = queryset.model
+        archive = ArchiveService.archive_table(model)
+        ensure_partitions(archive, months)
+
+        # Explicit columns, so a field missing from the archive fails loudly
+        fields = model._meta.concrete_fields
+        columns = ", ".join(connection.ops.quote_name(field.column) for field in fields)
+        select, params = (
+            queryset.order_by()
+            .values_list(*[field.attname for field in fields])
+            .query.sql_with_params()
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(f"INSERT INTO {archive} ({columns}) {select}", params)
+
+    @staticmethod
+    def archive(before, batch_size=500):
+        """
+        Move one batch of posts archived before `before` into the archive
+
+        Returns:
+            Number of posts moved
+        """
+        with transaction.atomic():
+            post_ids = list(
+                Post.objects.filter(is_archived=True, archived_at__lt=before)
+                .order_by("archived_at")
+                .select_for_update(skip_locked=True)
+                .values_list("pk", flat=True)[:batch_size]
+            )
+            if not post_ids:
+                return 0
+
+            posts = Post.objects.filter(pk__in=post_ids)
+            ArchiveService._copy(posts)
+            ArchiveService._copy(Comment.objects.filter(post_id__in=post_ids))
+            ArchiveService._copy(
+                Reaction.objects.filter(
+                    Q(post_id__in=post_ids) | Q(comment__post_id__in=post_ids)
+                )
+            )
+            posts.delete()
+        return len(post_ids)
+
+    @staticmethod
+    def detach(before):
+        """
+        Detach the archive partitions of months that ended by `before`
+
+        Returns:
+            Names of the detached partitions
+        """
+        detached = []
+        with transaction.atomic():
+            for model in ArchiveService.MODELS:
+                detached += detach_partitions(
+                    ArchiveService.archive_table(model), before
+                )
+        return detached
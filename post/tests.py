@@ -1,3 +1,845 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import os
+import tempfile
+import uuid
+from base64 import b64encode
+from datetime import datetime, timedelta, timezone as dt_timezone
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APITestCase
+from rest_framework_simplejwt.tokens import AccessToken
+
+from account.models import EndUser
+from core.broadcast import hub
+from core.partitions import partitions
+from friend.models import Friendship
+from .models import Comment, Post, Reaction, TimelineEntry, TrendingScore
+from .services import (
+    CommentThreadService,
+    StreamService,
+    TrendingService,
+    reaction_counters,
+    trending_events,
+)
+
+
+class PostListQueryCountTests(APITestCase):
+    def setUp(self):
+        self.viewer = EndUser.objects.create_user(
+            email="viewer@example.com", password="password123"
+        )
+        authors = [
+            EndUser.objects.create_user(
+                email=f"author{i}@example.com", password="password123"
+            )
+            for i in range(4)
+        ]
+        for i in range(20):
+            post = Post.objects.create(author=authors[i % 4], content=f"Post {i}")
+            Reaction.objects.create(
+                user=self.viewer, post=post, reaction_type=Reaction.ReactionType.LIKE
+            )
+        # Resolve the EndUser link up front so it is not counted in the first request
+        self.viewer.enduser
+        self.client.force_authenticate(user=self.viewer)
+
+    def count_queries(self, url):
+        # Warm the per-user caches (friend ids) so only the page is measured
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries)
+
+    def test_list_query_count_does_not_grow_with_page_size(self):
+        small = self.count_queries("/api/posts/posts/?limit=2")
+        large = self.count_queries("/api/posts/posts/?limit=20")
+        self.assertEqual(small, large)
+
+    def test_filtered_list_query_count_does_not_grow_with_page_size(self):
+        small = self.count_queries("/api/posts/posts/?ordering=-created_at&limit=2")
+        large = self.count_queries("/api/posts/posts/?ordering=-created_at&limit=20")
+        self.assertEqual(small, large)
+
+    def trending(self):
+        response = self.client.get("/api/posts/posts/trending/")
+        return [post["id"] for post in response.data]
+
+    def test_trending_query_count_does_not_depend_on_posts(self):
+        # The reactions of the setup were not recorded as they happened
+        self.assertEqual(TrendingService.refresh(), 20)
+        self.assertEqual(len(self.trending()), 10)
+        queries = self.count_queries("/api/posts/posts/trending/")
+
+        extra = Post.objects.bulk_create(
+            [Post(author=self.viewer, content=f"Extra {i}") for i in range(10)]
+        )
+        Comment.objects.bulk_create(
+            [Comment(post=post, author=self.viewer, content="Hot") for post in extra]
+        )
+        self.assertEqual(TrendingService.refresh(), 30)
+        # Comments weigh more than the reactions on the other posts
+        self.assertEqual(set(self.trending()), {str(post.id) for post in extra})
+        self.assertEqual(queries, self.count_queries("/api/posts/posts/trending/"))
+
+    def test_cursors_page_through_and_bad_values_are_rejected(self):
+        for url in ("/api/posts/posts/?limit=8", "/api/posts/posts/search/?q=post"):
+            seen = []
+            while url:
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                seen += [post["id"] for post in response.data["results"]]
+                url = response.data["next"]
+            self.assertEqual(len(set(seen)), 20)
+
+        cursor = b64encode(json.dumps({"p": ["garbage", "x"]}).encode()).decode()
+        response = self.client.get(f"/api/posts/posts/?cursor={cursor}")
+        self.assertEqual(response.status_code, 404)
+
+    def test_user_reaction_is_batched(self):
+        response = self.client.get("/api/posts/posts/?limit=5")
+        self.assertTrue(
+            all(
+                post["user_reaction"] == Reaction.ReactionType.LIKE
+                for post in response.data["results"]
+            )
+        )
+
+
+class ConditionalGetTests(APITestCase):
+    def setUp(self):
+        self.viewer, self.author = [
+            EndUser.objects.create_user(
+                email=f"{name}@example.com", password="password123"
+            )
+            for name in ("viewer", "author")
+        ]
+        self.post = Post.objects.create(author=self.author, content="Post")
+        self.client.force_authenticate(user=self.viewer)
+
+    def react(self, reaction_type):
+        response = self.client.post(
+            f"/api/posts/posts/{self.post.id}/react/",
+            {"reaction_type": reaction_type},
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def assertNotModifiedUntilChanged(self, url, change):
+        etag = self.client.get(url)["ETag"]
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+        self.assertEqual(response.content, b"")
+
+        change()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        return response
+
+    def test_list_and_detail_change_their_etag_on_a_reaction(self):
+        response = self.assertNotModifiedUntilChanged(
+            "/api/posts/posts/", lambda: self.react("LIKE")
+        )
+        self.assertEqual(response.data["results"][0]["user_reaction"], "LIKE")
+
+        response = self.assertNotModifiedUntilChanged(
+            f"/api/posts/posts/{self.post.id}/", lambda: self.react("LOVE")
+        )
+        self.assertEqual(response.data["user_reaction"], "LOVE")
+
+        # Another viewer of the same post gets an ETag of their own
+        etag = self.client.get(f"/api/posts/posts/{self.post.id}/")["ETag"]
+        self.client.force_authenticate(user=self.author)
+        response = self.client.get(
+            f"/api/posts/posts/{self.post.id}/", HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(response.status_code, 200)
+
+
+class TimelineTests(APITestCase):
+    def setUp(self):
+        self.viewer, self.friend = [
+            EndUser.objects.create_user(
+                email=f"{name}@example.com", password="password123"
+            )
+            for name in ("viewer", "friend")
+        ]
+        Friendship.connect(self.viewer, self.friend)
+
+    def post(self, content):
+        self.client.force_authenticate(user=self.friend)
+        response = self.client.post(
+            "/api/posts/posts/", {"content": content, "is_public": False}
+        )
+        self.assertEqual(response.status_code, 201, response.content)
+        return response.data["id"]
+
+    def feed(self):
+        self.client.force_authenticate(user=self.viewer)
+        response = self.client.get("/api/posts/posts/")
+        return [post["content"] for post in response.data["results"]]
+
+    def test_feed_skips_archived_posts_and_timelines_stay_bounded(self):
+        first = self.post("First")
+        self.post("Second")
+        self.assertEqual(self.feed(), ["Second", "First"])
+
+        # Archived without going through the API
+        Post.objects.filter(pk=first).update(is_archived=True)
+        self.assertEqual(self.feed(), ["Second"])
+
+        with override_settings(TIMELINE_MAX_LENGTH=3):
+            for i in range(3):
+                self.post(f"More {i}")
+        self.assertEqual(TimelineEntry.objects.filter(owner=self.viewer).count(), 3)
+        self.assertEqual(self.feed(), ["More 2", "More 1", "More 0"])
+
+        # Made public without going through the API, it keeps its entry but
+        # is listed once
+        Post.objects.filter(content="More 1").update(is_public=True)
+        self.assertEqual(self.feed(), ["More 2", "More 1", "More 0"])
+
+
+class CommentThreadTests(APITestCase):
+    def setUp(self):
+        self.user = EndUser.objects.create_user(
+            email="commenter@example.com", password="password123"
+        )
+        self.post = Post.objects.create(author=self.user, content="Post")
+        self.threads = [
+            Comment.objects.create(post=self.post, author=self.user, content=f"C{i}")
+            for i in range(4)
+        ]
+        Comment.objects.create(
+            post=self.post, author=self.user, content="Deleted", is_deleted=True
+        )
+        for i in range(5):
+            Comment.objects.create(
+                post=self.post,
+                author=self.user,
+                content=f"R{i}",
+                parent=self.threads[1],
+            )
+        Comment.objects.filter(pk=self.threads[1].pk).update(replies_count=5)
+        self.client.force_authenticate(user=self.user)
+
+    def comments(self, query):
+        response = self.client.get(f"/api/posts/posts/{self.post.id}/comments/{query}")
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_pages_carry_only_their_reply_previews(self):
+        data = self.comments("?limit=2&offset=1")
+        self.assertEqual(data["count"], 4)
+        self.assertEqual([c["content"] for c in data["results"]], ["C1", "C2"])
+        self.assertEqual(
+            [r["content"] for r in data["results"][0]["replies"]], ["R0", "R1", "R2"]
+        )
+        self.assertIsNotNone(data["results"][0]["replies_next"])
+        self.assertEqual(data["results"][1]["replies"], [])
+        self.assertIn("offset=3", data["next"])
+
+    def test_limit_is_capped(self):
+        with mock.patch.object(CommentThreadService, "MAX_PAGE_SIZE", 3):
+            data = self.comments("?limit=50")
+        self.assertEqual(len(data["results"]), 3)
+        self.assertIn("limit=3", data["next"])
+
+
+class ImportContentTests(APITestCase):
+    PRIVATE = "00000000-0000-0000-0000-000000000001"
+    PUBLIC = "00000000-0000-0000-0000-000000000002"
+    THREAD = "00000000-0000-0000-0000-000000000011"
+
+    def setUp(self):
+        self.viewer, self.author = [
+            EndUser.objects.create_user(
+                email=f"{name}@example.com", password="password123"
+            )
+            for name in ("viewer", "author")
+        ]
+        Friendship.connect(self.viewer, self.author)
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def import_file(self, kind, name, content, *args):
+        path = os.path.join(self.directory.name, name)
+        with open(path, "w", encoding="utf-8") as target:
+            target.write(content)
+        output = io.StringIO()
+        call_command("import_content", path, "--kind", kind, *args, stdout=output)
+        return output.getvalue().strip().splitlines()[-1]
+
+    def ndjson(self, *records):
+        return "".join(json.dumps(record) + "\n" for record in records)
+
+    def test_posts_comments_and_reactions_are_imported(self):
+        author = self.author.email
+        summary = self.import_file(
+            "posts",
+            "posts.ndjson",
+            self.ndjson(
+                {
+                    "id": self.PRIVATE,
+                    "author": author,
+                    "content": "Private",
+                    "is_public": False,
+                    "created_at": "2024-01-01T10:00:00",
+                },
+                {
+                    "id": self.PUBLIC,
+                    "author": self.author.username,
+                    "content": "Public",
+                },
+                {"author": "nobody@example.com", "content": "Orphan"},
+                {"id": self.PRIVATE, "author": author, "content": "Duplicate"},
+            ),
+            "--chunk-size",
+            "2",
+        )
+        self.assertEqual(summary, "Imported 2 posts, skipped 2.")
+        private = Post.objects.get(pk=self.PRIVATE)
+        self.assertEqual(
+            (private.content, private.is_public, private.created_at.year),
+            ("Private", False, 2024),
+        )
+        # Fanned out to the author's and their friend's timelines
+        self.assertEqual(
+            set(TimelineEntry.objects.values_list("owner_id", "post_id")),
+            {(self.viewer.pk, private.pk), (self.author.pk, private.pk)},
+        )
+
+        summary = self.import_file(
+            "comments",
+            "comments.csv",
+            "id,post,parent,author,content\n"
+            f"{self.THREAD},{self.PUBLIC},,{author},Thread\n"
+            f",{self.PUBLIC},{self.THREAD},{self.viewer.email},Reply\n"
+            f",00000000-0000-0000-0000-000000000099,,{author},Dangling\n",
+        )
+        self.assertEqual(summary, "Imported 2 comments, skipped 1.")
+
+        summary = self.import_file(
+            "reactions",
+            "reactions.ndjson",
+            self.ndjson(
+                {"user": self.viewer.email, "post": self.PUBLIC},
+                {"user": author, "comment": self.THREAD, "reaction_type": "love"},
+                {"user": author, "post": self.PUBLIC, "reaction_type": "meh"},
+            ),
+        )
+        self.assertEqual(summary, "Imported 2 reactions, skipped 1.")
+
+        public = Post.objects.get(pk=self.PUBLIC)
+        self.assertEqual((public.comments_count, public.like_count), (2, 1))
+        thread = Comment.objects.get(pk=self.THREAD)
+        self.assertEqual((thread.replies_count, thread.love_count), (1, 1))
+        self.assertTrue(TrendingScore.objects.filter(post=public).exists())
+
+    def test_replies_to_rejected_comments_are_rejected_with_them(self):
+        post, other = [
+            Post.objects.create(author=self.author, content=content)
+            for content in ("Post", "Other")
+        ]
+        ids = {name: uuid.uuid4() for name in ("thread", "reply", "nested", "orphan")}
+        author = self.author.email
+        summary = self.import_file(
+            "comments",
+            "comments.csv",
+            "id,post,parent,author,content\n"
+            f"{ids['nested']},{post.id},{ids['reply']},{author},Nested\n"
+            f"{ids['reply']},{post.id},{ids['thread']},{author},Reply\n"
+            f"{ids['thread']},{post.id},,{author},Thread\n"
+            # Its post does not exist, and neither may its reply
+            f"{ids['orphan']},{uuid.uuid4()},,{author},Orphan\n"
+            f",{post.id},{ids['orphan']},{author},Reply to the orphan\n"
+            # The parent is under another post
+            f",{other.id},{ids['thread']},{author},Misplaced\n",
+        )
+        self.assertEqual(summary, "Imported 3 comments, skipped 3.")
+        # The deferred foreign keys hold
+        connection.check_constraints()
+        self.assertEqual(
+            set(Comment.objects.values_list("content", flat=True)),
+            {"Thread", "Reply", "Nested"},
+        )
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 3)
+
+
+class ArchiveTests(APITestCase):
+    JANUARY = datetime(2025, 1, 15, tzinfo=dt_timezone.utc)
+
+    def setUp(self):
+        self.author, self.reader = [
+            EndUser.objects.create_user(
+                email=f"{name}@example.com", password="password123"
+            )
+            for name in ("author", "reader")
+        ]
+
+    def archived_post(self, content, days_ago):
+        post = Post.objects.create(author=self.author, content=content)
+        Post.objects.filter(pk=post.pk).update(
+            is_archived=True, created_at=self.JANUARY
+        )
+        Post.objects.filter(pk=post.pk).update(
+            archived_at=timezone.now() - timedelta(days=days_ago)
+        )
+        return post
+
+    def archive(self, *args):
+        output = io.StringIO()
+        call_command("archive_posts", *args, stdout=output)
+        return output.getvalue().strip().splitlines()
+
+    def located(self, table, pk):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT tableoid::regclass::text FROM {table} WHERE id = %s", [pk]
+            )
+            return [name for (name,) in cursor.fetchall()]
+
+    def test_archived_at_follows_is_archived_on_bulk_updates(self):
+        post = Post.objects.create(author=self.author, content="Post")
+        self.assertIsNone(post.archived_at)
+
+        # Neither a queryset update nor a save() touches updated_at here
+        Post.objects.filter(pk=post.pk).update(is_archived=True)
+        post.refresh_from_db()
+        archived_at = post.archived_at
+        self.assertIsNotNone(archived_at)
+
+        post.content = "Edited"
+        post.save(update_fields=["content", "is_archived"])
+        post.refresh_from_db()
+        self.assertEqual(post.archived_at, archived_at)
+
+        post.is_archived = False
+        post.save(update_fields=["is_archived"])
+        post.refresh_from_db()
+        self.assertIsNone(post.archived_at)
+
+    def test_posts_move_to_month_partitions_and_old_months_detach(self):
+        old = self.archived_post("Old", days_ago=100)
+        recent = self.archived_post("Recent", days_ago=10)
+        live = Post.objects.create(author=self.author, content="Live")
+        comment = Comment.objects.create(post=old, author=self.reader, content="Hi")
+        Reaction.objects.create(user=self.reader, post=old, reaction_type="LIKE")
+        Reaction.objects.create(user=self.author, comment=comment, reaction_type="WOW")
+
+        self.assertEqual(
+            self.archive("--older-than-days", "90", "--batch-size", "1"),
+            ["Moved 1 post(s) to the archive."],
+        )
+        self.assertEqual(
+            set(Post.objects.values_list("pk", flat=True)), {recent.pk, live.pk}
+        )
+        self.assertEqual(
+            self.located("post_post_archive", old.pk), ["post_post_archive_y2025m01"]
+        )
+        self.assertEqual(Comment.objects.count(), 0)
+        self.assertEqual(Reaction.objects.count(), 0)
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT count(*) FROM post_reaction_archive")
+            self.assertEqual(cursor.fetchone()[0], 2)
+
+        self.assertIn(
+            "Detached post_post_archive_y2025m01",
+            self.archive("--detach-before", "2025-02-01"),
+        )
+        self.assertEqual(partitions("post_post_archive"), [])
+        self.assertEqual(self.located("post_post_archive", old.pk), [])
+
+        # The detached month is left to the DEFAULT partition
+        later = self.archived_post("Later", days_ago=100)
+        self.archive()
+        self.assertEqual(
+            self.located("post_post_archive", later.pk), ["post_post_archive_default"]
+        )
+
+        # Once its table is dropped the month gets a partition again, and the
+        # rows DEFAULT held for it move over
+        with connection.cursor() as cursor:
+            cursor.execute("DROP TABLE post_post_archive_y2025m01")
+        last = self.archived_post("Last", days_ago=100)
+        self.archive()
+        for post in (later, last):
+            self.assertEqual(
+                self.located("post_post_archive", post.pk),
+                ["post_post_archive_y2025m01"],
+            )
+
+    def test_detach_before_must_be_a_date(self):
+        with self.assertRaises(CommandError):
+            self.archive("--detach-before", "soon")
+
+
+class CounterTests(APITestCase):
+    def setUp(self):
+        self.user = EndUser.objects.create_user(
+            email="user@example.com", password="password123"
+        )
+        self.post, self.other = [
+            Post.objects.create(author=self.user, content=content)
+            for content in ("Post", "Other")
+        ]
+        self.client.force_authenticate(user=self.user)
+
+    def counters(self, obj, *fields):
+        obj.refresh_from_db()
+        return tuple(getattr(obj, field) for field in fields)
+
+    def comment(self, post, parent=None):
+        response = self.client.post(
+            "/api/posts/comments/",
+            {
+                "post": post.id,
+                "content": "Hi",
+                **({"parent": parent} if parent else {}),
+            },
+        )
+        self.assertEqual(response.status_code, 201, response.content)
+        return response.data["id"]
+
+    def test_reaction_switches_move_one_counter_to_the_other(self):
+        thread = Comment.objects.create(post=self.post, author=self.user, content="Hi")
+        for prefix, target in (("posts", self.post), ("comments", thread)):
+            url = f"/api/posts/{prefix}/{target.id}/"
+            self.client.post(f"{url}react/", {"reaction_type": "LIKE"})
+            self.assertEqual(self.counters(target, "like_count", "love_count"), (1, 0))
+            self.client.post(f"{url}react/", {"reaction_type": "LOVE"})
+            self.assertEqual(self.counters(target, "like_count", "love_count"), (0, 1))
+            self.client.delete(f"{url}unreact/")
+            self.assertEqual(self.counters(target, "like_count", "love_count"), (0, 0))
+
+    def test_comment_deletes_and_moves_update_the_counts(self):
+        first = self.comment(self.post)
+        second = self.comment(self.post)
+        reply = self.comment(self.post, parent=first)
+        self.comment(self.post, parent=reply)
+        self.assertEqual(self.counters(self.post, "comments_count"), (4,))
+        first = Comment.objects.get(pk=first)
+        self.assertEqual(self.counters(first, "replies_count"), (1,))
+
+        response = self.client.patch(
+            f"/api/posts/comments/{reply}/", {"parent": second}
+        )
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(self.counters(first, "replies_count"), (0,))
+        second = Comment.objects.get(pk=second)
+        self.assertEqual(self.counters(second, "replies_count"), (1,))
+
+        response = self.client.patch(
+            f"/api/posts/comments/{first.id}/", {"post": self.other.id}
+        )
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(self.counters(self.post, "comments_count"), (3,))
+        self.assertEqual(self.counters(self.other, "comments_count"), (1,))
+
+        # The reply under it goes too
+        response = self.client.delete(f"/api/posts/comments/{reply}/")
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.counters(self.post, "comments_count"), (1,))
+        self.assertEqual(self.counters(second, "replies_count"), (0,))
+
+    def test_reconcile_counters_repairs_drift(self):
+        thread = Comment.objects.create(post=self.post, author=self.user, content="Hi")
+        Reaction.objects.create(user=self.user, comment=thread, reaction_type="WOW")
+        Post.objects.filter(pk=self.post.pk).update(comments_count=5, like_count=2)
+
+        output = io.StringIO()
+        call_command("reconcile_counters", "--batch-size", "1", stdout=output)
+        self.assertEqual(
+            output.getvalue().splitlines(),
+            [
+                "Repaired counters on 1 post(s).",
+                "Repaired counters on 1 comment(s).",
+            ],
+        )
+        self.assertEqual(
+            self.counters(self.post, "comments_count", "like_count"), (1, 0)
+        )
+        self.assertEqual(self.counters(thread, "wow_count"), (1,))
+
+
+class ReactionUpsertTests(APITestCase):
+    def setUp(self):
+        self.viewer, self.author = [
+            EndUser.objects.create_user(
+                email=f"{name}@example.com", password="password123"
+            )
+            for name in ("viewer", "author")
+        ]
+        self.post = Post.objects.create(author=self.author, content="Post")
+        self.comment = Comment.objects.create(
+            post=self.post, author=self.author, content="Hi"
+        )
+        self.client.force_authenticate(user=self.viewer)
+
+    def react(self, url, reaction_type):
+        return self.client.post(f"{url}react/", {"reaction_type": reaction_type})
+
+    def test_insert_switch_and_same_type_on_posts_and_comments(self):
+        for prefix, target in (("posts", self.post), ("comments", self.comment)):
+            url = f"/api/posts/{prefix}/{target.id}/"
+            for reaction_type, detail, counts in (
+                ("LIKE", "Reaction added.", (1, 0)),
+                ("LOVE", "Reaction updated.", (0, 1)),
+                # Same type again: nothing moves
+                ("LOVE", "Reaction updated.", (0, 1)),
+            ):
+                response = self.react(url, reaction_type)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.data["detail"], detail)
+                target.refresh_from_db()
+                self.assertEqual((target.like_count, target.love_count), counts)
+                self.assertEqual(
+                    list(target.reactions.values_list("user_id", "reaction_type")),
+                    [(self.viewer.pk, reaction_type)],
+                )
+
+    def test_invisible_or_missing_targets_are_not_found(self):
+        private = Post.objects.create(
+            author=self.author, content="Friends only", is_public=False
+        )
+        archived = Post.objects.create(
+            author=self.author, content="Archived", is_archived=True
+        )
+        urls = [
+            f"/api/posts/posts/{private.id}/",
+            f"/api/posts/posts/{archived.id}/",
+            f"/api/posts/posts/{uuid.uuid4()}/",
+            "/api/posts/posts/not-a-uuid/",
+            f"/api/posts/comments/{uuid.uuid4()}/",
+        ]
+        for url in urls:
+            self.assertEqual(self.react(url, "LIKE").status_code, 404, url)
+            self.assertEqual(self.client.delete(f"{url}unreact/").status_code, 404)
+        self.assertFalse(Reaction.objects.exists())
+
+        # Becoming friends makes the friends-only post visible
+        Friendship.connect(self.viewer, self.author)
+        self.assertEqual(self.react(urls[0], "LIKE").status_code, 200)
+
+
+class ReactionListingTests(APITestCase):
+    def setUp(self):
+        self.users = [
+            EndUser.objects.create_user(
+                email=f"user{i}@example.com", password="password123"
+            )
+            for i in range(5)
+        ]
+        self.post = Post.objects.create(author=self.users[0], content="Post")
+        self.comment = Comment.objects.create(
+            post=self.post, author=self.users[0], content="Hi"
+        )
+        # Oldest first: three likes, then two loves
+        for user, reaction_type in zip(self.users, ["LIKE"] * 3 + ["LOVE"] * 2):
+            self.client.force_authenticate(user=user)
+            for prefix, target in (("posts", self.post), ("comments", self.comment)):
+                self.client.post(
+                    f"/api/posts/{prefix}/{target.id}/react/",
+                    {"reaction_type": reaction_type},
+                )
+        self.newest_first = [user.id for user in reversed(self.users)]
+
+    def get(self, url, status_code=200):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status_code, response.content)
+        return response.data
+
+    def test_preview_filter_and_invalid_types(self):
+        url = f"/api/posts/posts/{self.post.id}/reactions/"
+        data = self.get(f"{url}?preview=true")
+        self.assertEqual(data["total"], 5)
+        self.assertEqual(data["reactions_count"]["LIKE"], 3)
+        self.assertEqual(
+            [user["id"] for user in data["top_reactors"]],
+            [str(user_id) for user_id in self.newest_first[:3]],
+        )
+
+        data = self.get(f"{url}?reaction_type=LOVE")
+        self.assertEqual(data["total"], 2)
+        self.assertEqual(
+            [reaction["user"] for reaction in data["results"]], self.newest_first[:2]
+        )
+        self.get(f"{url}?reaction_type=MEH", status_code=400)
+
+        # Comments take the type as ?type=
+        url = f"/api/posts/comments/{self.comment.id}/reactions/"
+        data = self.get(f"{url}?type=LIKE")
+        self.assertEqual(data["total"], 3)
+        self.assertEqual(
+            {reaction["reaction_type"] for reaction in data["results"]}, {"LIKE"}
+        )
+        self.get(f"{url}?type=MEH", status_code=400)
+
+    def test_cursor_pages_cover_every_reaction_once(self):
+        for prefix, target in (("posts", self.post), ("comments", self.comment)):
+            url = f"/api/posts/{prefix}/{target.id}/reactions/?limit=2"
+            seen = []
+            while url:
+                data = self.get(url)
+                self.assertLessEqual(len(data["results"]), 2)
+                seen += [reaction["user"] for reaction in data["results"]]
+                url = data["next"]
+            self.assertEqual(seen, self.newest_first)
+
+    def test_query_count_does_not_grow_with_the_page(self):
+        url = f"/api/posts/posts/{self.post.id}/reactions/"
+        # Resolve the EndUser link up front so it is not counted
+        self.get(url)
+        counts = []
+        for query in ("?limit=1", "?limit=5", "?preview=true"):
+            with CaptureQueriesContext(connection) as context:
+                self.get(url + query)
+            counts.append(len(context.captured_queries))
+        self.assertEqual(counts[0], counts[1])
+        self.assertLessEqual(counts[2], counts[0])
+
+
+@override_settings(REACTION_WRITE_BEHIND=True, REACTION_FLUSH_INTERVAL=0)
+class ReactionWriteBehindTests(APITestCase):
+    def setUp(self):
+        self.author = EndUser.objects.create_user(
+            email="author@example.com", password="password123"
+        )
+        self.post = Post.objects.create(author=self.author, content="Viral")
+        self.fans = [
+            EndUser.objects.create_user(
+                email=f"fan{i}@example.com", password="password123"
+            )
+            for i in range(3)
+        ]
+
+    def react(self, user, reaction_type):
+        self.client.force_authenticate(user=user)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                f"/api/posts/posts/{self.post.id}/react/",
+                {"reaction_type": reaction_type},
+            )
+        self.assertEqual(response.status_code, 200)
+
+    def test_counters_are_written_on_flush(self):
+        for fan in self.fans:
+            self.react(fan, Reaction.ReactionType.LIKE)
+        self.react(self.fans[0], Reaction.ReactionType.LOVE)
+
+        self.assertEqual(self.post.reactions.count(), 3)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.like_count, 0)
+        self.assertFalse(TrendingScore.objects.filter(post=self.post).exists())
+
+        self.assertEqual(reaction_counters.flush(), 1)
+        self.assertEqual(trending_events.flush(), 1)
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.like_count, self.post.love_count), (2, 1))
+        self.assertTrue(TrendingScore.objects.filter(post=self.post).exists())
+        self.assertEqual(reaction_counters.flush(), 0)
+
+
+class PostStreamTests(APITestCase):
+    def setUp(self):
+        self.author = EndUser.objects.create_user(
+            email="author@example.com", password="password123"
+        )
+        self.viewer = EndUser.objects.create_user(
+            email="viewer@example.com", password="password123"
+        )
+        self.post = Post.objects.create(author=self.author, content="Live")
+        self.seen = Comment.objects.create(
+            post=self.post, author=self.author, content="Seen"
+        )
+        self.missed = Comment.objects.create(
+            post=self.post, author=self.author, content="Missed"
+        )
+        self.url = f"/api/posts/posts/{self.post.id}/stream/"
+        self.auth = f"Bearer {AccessToken.for_user(self.viewer)}"
+
+    def write(self, method, url, data):
+        self.client.force_authenticate(user=self.viewer)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = getattr(self.client, method)(url, data)
+        self.assertIn(response.status_code, (200, 201), response.content)
+
+    async def next_event(self, stream):
+        chunk = await asyncio.wait_for(anext(stream), timeout=5)
+        if isinstance(chunk, bytes):
+            chunk = chunk.decode()
+        fields = dict(line.split(": ", 1) for line in chunk.strip().split("\n"))
+        fields["data"] = json.loads(fields["data"])
+        return fields
+
+    async def test_stream_resumes_from_cursor_and_pushes_new_events(self):
+        response = await self.async_client.get(
+            self.url,
+            {"since": StreamService.cursor(self.seen)},
+            headers={"Authorization": self.auth},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        stream = aiter(response.streaming_content)
+
+        counts = await self.next_event(stream)
+        self.assertEqual(counts["event"], "counts")
+        self.assertEqual(counts["data"]["reactions_count"]["LIKE"], 0)
+
+        backlog = await self.next_event(stream)
+        self.assertEqual(backlog["event"], "comment")
+        self.assertEqual(backlog["data"]["id"], str(self.missed.id))
+        self.assertEqual(backlog["id"], StreamService.cursor(self.missed))
+
+        await sync_to_async(self.write)(
+            "post",
+            "/api/posts/comments/",
+            {"post": self.post.id, "content": "Live comment"},
+        )
+        comment = await self.next_event(stream)
+        self.assertEqual(comment["event"], "comment")
+        self.assertEqual(comment["data"]["content"], "Live comment")
+
+        await sync_to_async(self.write)(
+            "post",
+            f"/api/posts/comments/{self.seen.id}/react/",
+            {"reaction_type": "LOVE"},
+        )
+        reactions = await self.next_event(stream)
+        self.assertEqual(reactions["event"], "reactions")
+        self.assertEqual(
+            reactions["data"],
+            {"target": "comment", "id": str(self.seen.id), "deltas": {"LOVE": 1}},
+        )
+
+        # A client disconnect cancels the pending read
+        pending = asyncio.ensure_future(anext(stream))
+        await asyncio.sleep(0.1)
+        pending.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await pending
+        self.assertNotIn(StreamService.channel(self.post.id), hub.channels)
+
+    async def test_stream_applies_authentication_and_visibility(self):
+        response = await self.async_client.get(self.url)
+        self.assertEqual(response.status_code, 401)
+
+        await Post.objects.filter(pk=self.post.pk).aupdate(is_public=False)
+        response = await self.async_client.get(
+            self.url, headers={"Authorization": self.auth}
+        )
+        self.assertEqual(response.status_code, 404)
+
+    def test_stream_is_refused_under_wsgi(self):
+        response = self.client.get(self.url, headers={"Authorization": self.auth})
+        self.assertEqual(response.status_code, 501)
@@ -7,5 +7,6 @@ router.register(r"posts", views.PostViewSet, basename="post")
 router.register(r"comments", views.CommentViewSet, basename="comment")
 
 urlpatterns = [
+    path("posts/<uuid:pk>/stream/", views.post_stream, name="post-stream"),
     path("", include(router.urls)),
 ]
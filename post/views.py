@@ -3,56 +3,177 @@ from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.filters import OrderingFilter
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from django.db.models import Count, Q
+from rest_framework.renderers import JSONRenderer
+from rest_framework.pagination import LimitOffsetPagination
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db.models import Count, F, FloatField, Max, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Cast
+from rest_framework.generics import get_object_or_404
+from rest_framework.exceptions import (
+    APIException,
+    NotAuthenticated,
+    NotFound,
+    PermissionDenied,
+)
+from rest_framework.settings import api_settings
+from asgiref.sync import sync_to_async
+from core.broadcast import get_channel_layer
+from core.conditional import ConditionalGetMixin
+from core.pagination import KeysetPagination, RankedKeysetPagination
 from core.permissions import IsEndUser
 from .models import Post, Comment, Reaction
 from .serializers import (
+    AuthorSerializer,
     PostSerializer,
     PostDetailSerializer,
+    CommentEventSerializer,
     CommentSerializer,
+    CommentShallowSerializer,
     ReactionSerializer,
+    serialize_comment_threads,
+)
+from .services import (
+    CommentThreadService,
+    CounterService,
+    ReactionService,
+    StreamService,
+    TimelineService,
+    TrendingService,
 )
 from friend.models import Friendship
-from django.utils import timezone
-from datetime import timedelta
+from django.core.handlers.asgi import ASGIRequest
 from django.db.transaction import atomic
+from django.http import Http404, JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import require_GET
+
+
+def visible_posts(user):
+    # Base queryset - excludes archived posts
+    queryset = Post.objects.filter(is_archived=False)
+
+    # For non-public posts, only show posts from friends
+    friend_ids = list(Friendship.get_friend_ids(user))
+
+    # Show all public posts and private posts from friends
+    return queryset.filter(
+        Q(is_public=True)
+        | (Q(is_public=False) & Q(author_id__in=friend_ids))
+        | Q(author=user)  # Always show the user's own posts
+    )
+
+
+def viewer_reaction(user, **target):
+    return Subquery(
+        Reaction.objects.filter(user=user, **target).values("reaction_type")[:1]
+    )
+
+
+def comment_activity(comments):
+    # Edits bump updated_at, reactions and replies only move the counters
+    return tuple(
+        comments.aggregate(
+            count=Count("id"),
+            last_updated=Max("updated_at"),
+            replies=Sum("replies_count"),
+            **{field: Sum(field) for field in Comment.COUNTER_FIELDS},
+        ).values()
+    )
+
+
+def reaction_listing(request, target, reaction_type):
+    # Keyset pages of the reactors, or with ?preview=true only the latest few
+    # of them. Totals come from the target's counters instead of a COUNT.
+    if reaction_type and reaction_type not in Reaction.ReactionType.values:
+        return Response(
+            {
+                "detail": f"Invalid reaction type. Choose from {Reaction.ReactionType.values}"
+            },
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+
+    counts = target.reaction_counts
+    totals = {
+        "total": counts[reaction_type] if reaction_type else sum(counts.values()),
+        "reactions_count": counts,
+    }
+    reactions = ReactionService.reactions_of(target, reaction_type)
+
+    if request.query_params.get("preview", "").lower() in ("1", "true"):
+        latest = reactions[: ReactionService.REACTORS_PREVIEW]
+        return Response(
+            {
+                **totals,
+                "top_reactors": AuthorSerializer(
+                    [reaction.user for reaction in latest], many=True
+                ).data,
+            }
+        )
+
+    paginator = KeysetPagination()
+    page = paginator.paginate_queryset(reactions, request)
+    response = paginator.get_paginated_response(
+        ReactionSerializer(page, many=True).data
+    )
+    response.data.update(totals)
+    return response
 
 
-class PostViewSet(viewsets.ModelViewSet):
+class PostViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     serializer_class = PostSerializer
     permission_classes = [IsEndUser]
+    pagination_class = KeysetPagination
     filter_backends = [OrderingFilter, DjangoFilterBackend]
     ordering_fields = ["created_at", "updated_at"]
     ordering = ["-created_at"]
     filterset_fields = ["author"]
+    etag_fields = ("id", "updated_at", "comments_count", *Post.COUNTER_FIELDS)
 
     def get_queryset(self):
-        # Base queryset - excludes archived posts
-        queryset = Post.objects.filter(is_archived=False)
-
-        # Filter to only show posts the user should see
-        user = self.request.user
-
-        # For non-public posts, only show posts from friends
-        friends = Friendship.get_friends(user)
-        friend_ids = [friend.id for friend in friends]
-
-        # Show all public posts and private posts from friends
-        queryset = queryset.filter(
-            Q(is_public=True)
-            | (Q(is_public=False) & Q(author_id__in=friend_ids))
-            | Q(author=user)  # Always show the user's own posts
-        )
-
-        return queryset
+        return visible_posts(self.request.user).select_related("author")
 
     def get_serializer_class(self):
         if self.action == "retrieve":
             return PostDetailSerializer
         return PostSerializer
 
+    def get_etag_parts(self):
+        # A point query on the post through the visibility rules and one
+        # aggregate over its comments, instead of the detail serializer
+        post = get_object_or_404(
+            self.get_queryset()
+            .annotate(reaction=viewer_reaction(self.request.user, post=OuterRef("pk")))
+            .values_list(
+                "updated_at", "comments_count", "reaction", *Post.COUNTER_FIELDS
+            ),
+            pk=self.kwargs["pk"],
+        )
+        return post, comment_activity(Comment.objects.filter(post_id=self.kwargs["pk"]))
+
+    def list(self, request, *args, **kwargs):
+        # Filtered or re-ordered listings still go through the visibility
+        # query, the plain home feed is read from the materialized timeline
+        if "author" in request.query_params or "ordering" in request.query_params:
+            return super().list(request, *args, **kwargs)
+
+        queryset = TimelineService.get_feed(request.user.enduser)
+
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+
+        serializer = self.get_serializer(queryset, many=True)
+        return Response(serializer.data)
+
+    @atomic
     def perform_create(self, serializer):
-        serializer.save(author=self.request.user.enduser)
+        post = serializer.save(author=self.request.user.enduser)
+        TimelineService.fan_out_post(post)
+
+    @atomic
+    def perform_update(self, serializer):
+        post = serializer.save()
+        TimelineService.sync_post(post)
 
     @atomic
     def perform_destroy(self, instance):
@@ -60,7 +181,6 @@ class PostViewSet(viewsets.ModelViewSet):
 
     @action(detail=True, methods=["post"])
     def react(self, request, pk=None):
-        post = self.get_object()
         reaction_type = request.data.get("reaction_type")
         if not reaction_type:
             return Response(
@@ -76,86 +196,129 @@ class PostViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
-        # Check if the user already reacted to this post
-        existing_reaction = Reaction.objects.filter(
-            user=request.user.enduser, post=post
-        ).first()
-
-        if existing_reaction:
-            # Update existing reaction
-            existing_reaction.reaction_type = reaction_type
-            existing_reaction.save()
-            message = "Reaction updated."
-        else:
-            # Create new reaction
-            Reaction.objects.create(
-                user=request.user.enduser, post=post, reaction_type=reaction_type
-            )
-            message = "Reaction added."
+        # Visibility check, upsert and counter update in one statement
+        try:
+            added = ReactionService.react(request.user, Post, pk, reaction_type)
+        except Post.DoesNotExist:
+            raise Http404
 
+        message = "Reaction added." if added else "Reaction updated."
         return Response({"detail": message}, status=status.HTTP_200_OK)
 
     @action(detail=True, methods=["delete"])
     def unreact(self, request, pk=None):
-        post = self.get_object()
-
-        # Find and delete the reaction
-        reaction = Reaction.objects.filter(user=request.user.enduser, post=post).first()
+        try:
+            removed = ReactionService.unreact(request.user, Post, pk)
+        except Post.DoesNotExist:
+            raise Http404
 
-        if not reaction:
+        if not removed:
             return Response(
                 {"detail": "No reaction found."}, status=status.HTTP_404_NOT_FOUND
             )
-
-        reaction.delete()
         return Response({"detail": "Reaction removed."}, status=status.HTTP_200_OK)
 
     @action(detail=True, methods=["get"])
     def reactions(self, request, pk=None):
         post = self.get_object()
-        reactions = post.reactions.all()
-
-        reaction_type = request.query_params.get("reaction_type")
-        if reaction_type:
-            reactions = reactions.filter(reaction_type=reaction_type)
+        return reaction_listing(
+            request, post, request.query_params.get("reaction_type")
+        )
 
-        serializer = ReactionSerializer(reactions, many=True)
-        return Response(serializer.data)
+    @action(detail=True, methods=["get"])
+    def comments(self, request, pk=None):
+        post = self.get_object()
+        paginator = LimitOffsetPagination()
+        paginator.max_limit = CommentThreadService.MAX_PAGE_SIZE
+        limit = paginator.get_limit(request) or CommentThreadService.PAGE_SIZE
+        offset = paginator.get_offset(request)
+
+        return Response(
+            serialize_comment_threads(
+                post, self.get_serializer_context(), offset=offset, limit=limit
+            )
+        )
 
     @action(detail=False, methods=["get"])
-    def trending(self, request):
-        # Get posts with most reactions and comments in the last 7 days
+    def search(self, request):
+        terms = request.query_params.get("q", "").strip()
+        if not terms:
+            return Response(
+                {"detail": "q is required."}, status=status.HTTP_400_BAD_REQUEST
+            )
 
-        last_week = timezone.now() - timedelta(days=7)
+        # Matches come from the GIN index on search_vector, then go through
+        # the same visibility rules as every other listing
+        query = SearchQuery(terms, config="english", search_type="websearch")
+        queryset = (
+            self.get_queryset()
+            .filter(search_vector=query)
+            .annotate(rank=Cast(SearchRank(F("search_vector"), query), FloatField()))
+        )
 
-        # Calculate trending score based on reactions and comments
-        queryset = self.get_queryset().filter(created_at__gte=last_week)
+        paginator = RankedKeysetPagination()
+        page = paginator.paginate_queryset(queryset, request, self)
+        serializer = self.get_serializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
 
-        queryset = queryset.annotate(
-            reaction_count=Count("reactions"), comment_count=Count("comments")
-        ).order_by("-reaction_count", "-comment_count")[:10]
+    @action(detail=False, methods=["get"])
+    def trending(self, request):
+        # Top posts by time-decayed reaction and comment activity, read from
+        # the trending score index and filtered by what the user may see
+        queryset = TrendingService.ranked(self.get_queryset())[:10]
 
         serializer = self.get_serializer(queryset, many=True)
         return Response(serializer.data)
 
 
-class CommentViewSet(viewsets.ModelViewSet):
+class CommentViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     serializer_class = CommentSerializer
     permission_classes = [IsEndUser]
+    etag_fields = ("id", "updated_at", "replies_count", *Comment.COUNTER_FIELDS)
 
     def get_queryset(self):
         return Comment.objects.filter()
 
+    def get_etag_parts(self):
+        comment = get_object_or_404(
+            self.get_queryset()
+            .annotate(
+                reaction=viewer_reaction(self.request.user, comment=OuterRef("pk"))
+            )
+            .values_list(
+                "updated_at", "replies_count", "reaction", *Comment.COUNTER_FIELDS
+            ),
+            pk=self.kwargs["pk"],
+        )
+        return comment, comment_activity(
+            Comment.objects.filter(parent_id=self.kwargs["pk"])
+        )
+
+    @atomic
     def perform_create(self, serializer):
-        serializer.save(author=self.request.user.enduser)
+        comment = serializer.save(author=self.request.user.enduser)
+        CounterService.comment_created(comment)
+        TrendingService.record_comment(comment.post)
+        StreamService.publish(
+            comment.post_id,
+            "comment",
+            CommentEventSerializer(comment).data,
+            StreamService.cursor(comment),
+        )
+
+    @atomic
+    def perform_update(self, serializer):
+        moved_from = serializer.instance.post_id, serializer.instance.parent_id
+        comment = serializer.save()
+        CounterService.comment_moved(comment, *moved_from)
 
     @atomic
     def perform_destroy(self, instance):
+        CounterService.comment_deleted(instance)
         return super().perform_destroy(instance)
 
     @action(detail=True, methods=["post"])
     def react(self, request, pk=None):
-        comment = self.get_object()
         reaction_type = request.data.get("reaction_type")
 
         if not reaction_type or reaction_type not in dict(
@@ -168,52 +331,164 @@ class CommentViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
-        # Check if the user already reacted to this comment
-        existing_reaction = Reaction.objects.filter(
-            user=request.user.enduser, comment=comment
-        ).first()
-
-        if existing_reaction:
-            # Update existing reaction
-            existing_reaction.reaction_type = reaction_type
-            existing_reaction.save()
-            message = "Reaction updated."
-        else:
-            # Create new reaction
-            Reaction.objects.create(
-                user=request.user.enduser, comment=comment, reaction_type=reaction_type
-            )
-            message = "Reaction added."
+        try:
+            added = ReactionService.react(request.user, Comment, pk, reaction_type)
+        except Comment.DoesNotExist:
+            raise Http404
 
+        message = "Reaction added." if added else "Reaction updated."
         return Response({"detail": message}, status=status.HTTP_200_OK)
 
-    @atomic
     @action(detail=True, methods=["delete"])
     def unreact(self, request, pk=None):
-        comment = self.get_object()
+        try:
+            removed = ReactionService.unreact(request.user, Comment, pk)
+        except Comment.DoesNotExist:
+            raise Http404
 
-        # Find and delete the reaction
-        reaction = Reaction.objects.filter(
-            user=request.user.enduser, comment=comment
-        ).first()
-
-        if not reaction:
+        if not removed:
             return Response(
                 {"detail": "No reaction found."}, status=status.HTTP_404_NOT_FOUND
             )
-
-        reaction.delete()
         return Response({"detail": "Reaction removed."}, status=status.HTTP_200_OK)
 
     @action(detail=True, methods=["get"])
     def reactions(self, request, pk=None):
         comment = self.get_object()
-        reactions = comment.reactions.all()
 
         # Optional filtering by reaction type
-        reaction_type = request.query_params.get("type")
-        if reaction_type:
-            reactions = reactions.filter(reaction_type=reaction_type)
+        return reaction_listing(request, comment, request.query_params.get("type"))
 
-        serializer = ReactionSerializer(reactions, many=True)
-        return Response(serializer.data)
+    @action(detail=True, methods=["get"])
+    def replies(self, request, pk=None):
+        # "Load more" page of the direct replies of a comment, oldest first
+        comment = self.get_object()
+        replies = comment.replies.filter(is_deleted=False).select_related("author")
+
+        paginator = KeysetPagination()
+        paginator.ordering = ("created_at", "id")
+        page = paginator.paginate_queryset(replies, request, self)
+
+        context = self.get_serializer_context()
+        context["comment_reactions"] = dict(
+            Reaction.objects.filter(
+                user=request.user, comment_id__in=[reply.id for reply in page]
+            ).values_list("comment_id", "reaction_type")
+        )
+        serializer = CommentShallowSerializer(page, many=True, context=context)
+        return paginator.get_paginated_response(serializer.data)
+
+
+# Seconds between keep-alive comments on an idle stream, which keep proxies
+# from closing the connection
+STREAM_KEEPALIVE = 15
+
+
+def sse_message(event, data, event_id=None):
+    lines = [f"event: {event}"]
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"data: {data}")
+    return "\n".join(lines) + "\n\n"
+
+
+def stream_viewer(request, pk):
+    # The stream is a plain async view, so the API's authentication, end
+    # user permission and post visibility rules are applied by hand
+    for authentication in api_settings.DEFAULT_AUTHENTICATION_CLASSES:
+        result = authentication().authenticate(request)
+        if result is not None:
+            request.user = result[0]
+            break
+    else:
+        raise NotAuthenticated
+
+    if not IsEndUser().has_permission(request, None):
+        raise PermissionDenied
+    if not visible_posts(request.user).filter(pk=pk).exists():
+        raise NotFound
+
+
+def stream_backlog(pk, position):
+    post = Post.objects.only("comments_count", *Post.COUNTER_FIELDS).get(pk=pk)
+    counts = {
+        "comments_count": post.comments_count,
+        "reactions_count": post.reaction_counts,
+    }
+
+    comments = []
+    if position is not None:
+        comments = StreamService.comments_since(
+            pk, position, StreamService.BACKLOG_LIMIT + 1
+        )
+    truncated = len(comments) > StreamService.BACKLOG_LIMIT
+    backlog = [
+        (
+            StreamService.cursor(comment),
+            JSONRenderer().render(CommentEventSerializer(comment).data).decode(),
+        )
+        for comment in comments[: StreamService.BACKLOG_LIMIT]
+    ]
+    return JSONRenderer().render(counts).decode(), backlog, truncated
+
+
+async def post_events(pk, position):
+    # Subscribe before reading the backlog so that no comment committed in
+    # between is missed; one that shows up in both is sent once
+    subscription = await get_channel_layer().subscribe(StreamService.channel(pk))
+    try:
+        counts, backlog, truncated = await sync_to_async(stream_backlog)(pk, position)
+        yield sse_message("counts", counts)
+
+        sent = set()
+        for cursor, comment in backlog:
+            sent.add(cursor)
+            yield sse_message("comment", comment, cursor)
+        if truncated:
+            # The client reconnects from the last comment it received
+            return
+
+        # A listener that falls behind is dropped the same way
+        while not subscription.lagging:
+            message = await subscription.get(timeout=STREAM_KEEPALIVE)
+            if message is None:
+                yield ": keep-alive\n\n"
+                continue
+            event, event_id, data = message
+            if event_id is None or event_id not in sent:
+                yield sse_message(event, data, event_id)
+    finally:
+        subscription.close()
+
+
+@require_GET
+async def post_stream(request, pk):
+    """
+    Server-sent events of a post: a `counts` snapshot, then the comments
+    created after the `since` cursor (or the Last-Event-ID of a reconnecting
+    EventSource), then new `comment` and `reactions` delta events as they are
+    committed. Only served by the ASGI application.
+    """
+    # A WSGI server reads an async stream to the end before sending any of
+    # it, holding its worker for good
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse(
+            {"detail": "Streams are only served over ASGI."},
+            status=status.HTTP_501_NOT_IMPLEMENTED,
+        )
+    try:
+        await sync_to_async(stream_viewer)(request, pk)
+        since = request.GET.get("since") or request.headers.get("Last-Event-ID")
+        position = StreamService.decode_cursor(since) if since else None
+    except APIException as exc:
+        return JsonResponse({"detail": exc.detail}, status=exc.status_code)
+    except ValueError as exc:
+        return JsonResponse({"detail": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+
+    response = StreamingHttpResponse(
+        post_events(pk, position), content_type="text/event-stream"
+    )
+    response["Cache-Control"] = "no-cache"
+    # Keeps nginx from buffering the stream
+    response["X-Accel-Buffering"] = "no"
+    return response